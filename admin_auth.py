@@ -0,0 +1,36 @@
+import functools
+import hashlib
+import hmac
+from flask import abort, request, session
+from config import Config
+
+ADMIN_TOKEN_HEADER = 'X-Profile-Token'
+ADMIN_TOKEN_PARAM = '_profile'
+
+def _token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def token_matches(token):
+    """Constant-time check of a presented token against Config.PROFILE_TOKEN"""
+    return bool(token and Config.PROFILE_TOKEN and hmac.compare_digest(token, Config.PROFILE_TOKEN))
+
+def admin_token_required(view):
+    """Guard admin pages with PROFILE_TOKEN (header, query param or remembered in the session)
+
+    Pages are hidden (404) when no token is configured. A valid token is remembered
+    as a digest in the session so links between admin pages keep working; rotating
+    PROFILE_TOKEN invalidates it.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.PROFILE_TOKEN:
+            abort(404)
+
+        token = request.headers.get(ADMIN_TOKEN_HEADER) or request.args.get(ADMIN_TOKEN_PARAM)
+        if token_matches(token):
+            session['admin_token'] = _token_digest(token)
+        elif not hmac.compare_digest(session.get('admin_token', ''), _token_digest(Config.PROFILE_TOKEN)):
+            abort(403)
+
+        return view(*args, **kwargs)
+    return wrapper
@@ -1,11 +1,25 @@
 import google.generativeai as genai
+import functools
 import json
-import re
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from config import Config
-from models import get_db_connection, save_analysis_result, update_analysis_error
+from models import (
+    get_read_connection, save_analysis_result, update_analysis_error, get_users_needing_reanalysis, get_contact_cluster,
+    get_valuation_check
+)
 from utils import get_uploaded_documents, get_required_documents
+from field_parsing import parse_experience_years
+from document_extraction import summarize_extracted_financials
+from loan_calculator import loan_metrics
+from analysis_jobs import submit_analysis, CALLING_MODEL, RETRYING, SAVED, FAILED
+from metrics import (
+    ANALYSES_RUNNING, ANALYSES_COMPLETED_TOTAL, ANALYSES_FAILED_TOTAL,
+    ANALYSIS_RETRIES_TOTAL, FALLBACK_ANALYSES_TOTAL, GEMINI_CALL_LATENCY, GEMINI_CALL_ERRORS_TOTAL,
+    GEMINI_BREAKER_STATE, GEMINI_BREAKER_REJECTED_TOTAL, GEMINI_BREAKER_TRANSITIONS_TOTAL,
+    ANALYSIS_PARSE_FAILURES_TOTAL, GEMINI_TOKENS_TOTAL, GEMINI_PROMPT_TOKENS, GEMINI_HEDGE_OUTCOMES_TOTAL, track_in_progress
+)
 
 # Configure Gemini API
 try:
@@ -14,6 +28,81 @@ try:
 except Exception as e:
     print(f"Gemini API configuration failed: {e}")
 
+# Model calls run here so a hung request can be abandoned at its deadline
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=Config.AI_WORKER_THREADS * len(Config.AI_MODEL_NAMES), thread_name_prefix='gemini'
+)
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker that stops calling Gemini while it is unhealthy"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, recovery_timeout, on_close=None):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.on_close = on_close
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Whether a remote call may be attempted now (one trial call while half-open)"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            was_recovering = self.state != self.CLOSED
+            self.failure_count = 0
+            self.trial_in_flight = False
+            if was_recovering:
+                self._transition(self.CLOSED)
+        if was_recovering and self.on_close:
+            self.on_close()
+
+    def record_failure(self):
+        with self._lock:
+            self.failure_count += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failure_count >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state):
+        print(f"Gemini circuit breaker: {self.state} -> {state}")
+        self.state = state
+        GEMINI_BREAKER_TRANSITIONS_TOTAL.inc(state)
+
+def reanalyze_fallback_results():
+    """Re-queue analyses that were served by the fallback while the breaker was open"""
+    # Capped so recovering from a long outage does not re-queue the whole portfolio at once
+    user_ids = get_users_needing_reanalysis(limit=Config.AI_REANALYSIS_BATCH_LIMIT)
+    if user_ids:
+        print(f"Gemini recovered, re-analyzing {len(user_ids)} fallback results")
+        trigger_bulk_analysis(user_ids)
+
+gemini_breaker = CircuitBreaker(
+    failure_threshold=Config.AI_BREAKER_FAILURE_THRESHOLD,
+    recovery_timeout=Config.AI_BREAKER_RECOVERY_SECONDS,
+    on_close=reanalyze_fallback_results
+)
+GEMINI_BREAKER_STATE.set_function(
+    lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[gemini_breaker.state]
+)
+
 def get_available_models():
     """List available models for debugging"""
     try:
@@ -24,45 +113,112 @@ def get_available_models():
         print(f"Failed to list models: {e}")
         return []
 
-def get_gemini_model():
-    """Get the correct Gemini model with fallback"""
-    try:
-        # Try the newer model names first
-        model_names = [
-            'gemini-1.5-pro',
-            'gemini-1.0-pro',
-            'models/gemini-pro',
-            'gemini-pro'
-        ]
-        
-        for model_name in model_names:
+@functools.lru_cache(maxsize=None)
+def get_gemini_model(model_name):
+    """GenerativeModel for a name in Config.AI_MODEL_NAMES (construction makes no API call)"""
+    return genai.GenerativeModel(model_name)
+
+def _attempt_model(model_name, prompt, deadline):
+    """One analysis call against one model; returns the parsed result"""
+    if model_name not in Config.AI_SCHEMA_MODEL_NAMES:
+        prompt += plain_response_instructions()
+    response = generate_content_timed(
+        get_gemini_model(model_name), model_name, prompt,
+        generation_config=analysis_generation_config(model_name),
+        request_options={'timeout': max(deadline - time.monotonic(), 1)}
+    )
+    record_token_usage(response, prompt)
+    return parse_gemini_response(response.text)
+
+def hedged_generate(prompt):
+    """Race the model list under a hard deadline and return the first valid analysis.
+
+    The primary model gets Config.AI_HEDGE_DELAY_SECONDS to answer before the next model
+    is started alongside it; a model that errors or returns an invalid answer hands over
+    immediately. Raises TimeoutError once Config.AI_TIMEOUT_SECONDS pass without a winner,
+    and AnalysisSchemaError when every model answered but none validly.
+    """
+    deadline = time.monotonic() + Config.AI_TIMEOUT_SECONDS
+    remaining_models = list(Config.AI_MODEL_NAMES)
+    in_flight = {}
+    invalid_result = None
+    last_error = None
+
+    def launch_next():
+        model_name = remaining_models.pop(0)
+        in_flight[_hedge_executor.submit(_attempt_model, model_name, prompt, deadline)] = model_name
+
+    launch_next()
+    next_hedge_at = time.monotonic() + Config.AI_HEDGE_DELAY_SECONDS
+
+    while in_flight:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_until = min(deadline, next_hedge_at) if remaining_models else deadline
+        done, _ = wait(in_flight, timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            model_name = in_flight.pop(future)
             try:
-                model = genai.GenerativeModel(model_name)
-                # Test with a simple prompt to verify the model works
-                response = model.generate_content("Hello")
-                return model
+                result = future.result()
             except Exception as e:
+                GEMINI_HEDGE_OUTCOMES_TOTAL.inc(model_name, 'error')
                 print(f"Model {model_name} failed: {e}")
+                last_error = e
                 continue
-        
-        # If no model works, raise error
-        raise Exception("No working Gemini model found. Available models: " + str(get_available_models()))
-        
-    except Exception as e:
-        print(f"Failed to get Gemini model: {e}")
-        raise e
+            if result.get('eligibility') == 'Analysis Error':
+                GEMINI_HEDGE_OUTCOMES_TOTAL.inc(model_name, 'invalid')
+                invalid_result = result
+                continue
+
+            GEMINI_HEDGE_OUTCOMES_TOTAL.inc(model_name, 'win')
+            for loser in in_flight.values():
+                GEMINI_HEDGE_OUTCOMES_TOTAL.inc(loser, 'loss')
+            return result
+
+        # Hedge when the delay passes, or at once when every running model has given up
+        if remaining_models and (not in_flight or time.monotonic() >= next_hedge_at):
+            launch_next()
+            next_hedge_at = time.monotonic() + Config.AI_HEDGE_DELAY_SECONDS
+
+    for model_name in in_flight.values():
+        GEMINI_HEDGE_OUTCOMES_TOTAL.inc(model_name, 'timeout')
+    if in_flight:
+        raise TimeoutError(f"No Gemini model answered within {Config.AI_TIMEOUT_SECONDS}s")
+    if invalid_result is not None:
+        # Every model answered, none validly: a failure for the breaker, not a result
+        raise AnalysisSchemaError(invalid_result['reasoning'])
+    raise Exception(f"No working Gemini model found (last error: {last_error}). "
+                    f"Available models: {get_available_models()}")
+
+def generate_content_timed(model, model_name, prompt, kind='analysis', generation_config=None, request_options=None):
+    """Call generate_content and record latency and errors per model and call kind"""
+    start = time.perf_counter()
+    try:
+        return model.generate_content(prompt, generation_config=generation_config,
+                                      request_options=request_options)
+    except Exception:
+        GEMINI_CALL_ERRORS_TOTAL.inc(model_name, kind)
+        raise
+    finally:
+        GEMINI_CALL_LATENCY.observe(time.perf_counter() - start, model_name, kind)
+
+def queue_analysis(user_id):
+    """Queue an analysis on the worker pool and return its job id"""
+    return submit_analysis(user_id, analyze_loan_eligibility)
 
 def trigger_ai_analysis(user_id):
-    """Trigger AI analysis in background thread"""
+    """Queue automatic AI analysis when it is enabled"""
     if not Config.AUTO_ANALYSIS_ENABLED:
-        return
-    
-    # Run analysis in background thread
-    thread = threading.Thread(target=analyze_loan_eligibility, args=(user_id,))
-    thread.daemon = True
-    thread.start()
+        return None
+    return queue_analysis(user_id)
+
+def _no_progress(stage, message=''):
+    pass
 
-def analyze_loan_eligibility(user_id):
+@track_in_progress(ANALYSES_RUNNING)
+def analyze_loan_eligibility(user_id, progress=_no_progress):
     """Main function to analyze loan eligibility using Gemini AI"""
     retry_count = 0
     max_retries = Config.AI_RETRY_ATTEMPTS
@@ -71,15 +227,18 @@ def analyze_loan_eligibility(user_id):
         try:
             # Add delay between retries to avoid rate limiting
             if retry_count > 0:
+                ANALYSIS_RETRIES_TOTAL.inc()
+                progress(RETRYING, f"Retry {retry_count}/{max_retries} in {2 ** retry_count}s")
                 time.sleep(2 ** retry_count)  # Exponential backoff: 2, 4, 8 seconds
             
             # Get user data
-            conn = get_db_connection()
-            user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+            conn = get_read_connection()
+            user = conn.execute('SELECT * FROM users_full WHERE id = ?', (user_id,)).fetchone()
             conn.close()
             
             if not user:
                 print(f"User {user_id} not found for analysis")
+                progress(FAILED, 'User not found')
                 return {"error": "User not found"}
             
             user_data = dict(user)
@@ -91,9 +250,10 @@ def analyze_loan_eligibility(user_id):
             prompt_data = create_structured_prompt_data(user_data, uploaded_documents)
             
             # Call Gemini API
+            progress(CALLING_MODEL, 'Waiting for the model')
             analysis_result = call_gemini_api(prompt_data)
             
-            # Save successful result
+            # Save successful result (group-committed by the writer thread)
             save_analysis_result(
                 user_id=user_id,
                 eligibility_status=analysis_result.get('eligibility', 'Pending'),
@@ -104,8 +264,11 @@ def analyze_loan_eligibility(user_id):
                 missing_docs='\n'.join(analysis_result.get('missing_documents', [])),
                 risk_level=analysis_result.get('risk_level', 'Medium'),
                 recommendation=analysis_result.get('recommendation', ''),
-                retry_count=retry_count
-            )
+                retry_count=retry_count,
+                needs_reanalysis=analysis_result.get('needs_reanalysis', False)
+            ).result()
+            ANALYSES_COMPLETED_TOTAL.inc()
+            progress(SAVED, analysis_result.get('eligibility', 'Pending'))
             
             return analysis_result
             
@@ -118,19 +281,39 @@ def analyze_loan_eligibility(user_id):
                 continue
             else:
                 # Final failure - save error information
-                update_analysis_error(user_id, error_msg, retry_count)
+                update_analysis_error(user_id, error_msg, retry_count).result()
+                ANALYSES_FAILED_TOTAL.inc()
+                progress(FAILED, error_msg)
                 return {"error": str(e)}
 
 def create_structured_prompt_data(user_data, uploaded_documents):
     """Create structured data for AI prompt"""
     
     # Calculate basic metrics
-    property_value = user_data.get('sale_deed_amount', 0)
-    loan_amount = user_data.get('loan_amount', 0)
+    property_value = user_data.get('sale_deed_amount') or 0
+    loan_amount = user_data.get('loan_amount') or 0
+    tenure_months = user_data.get('tenure') or 0
     ltv = (loan_amount / property_value * 100) if property_value > 0 else 0
     
-    # Estimate age from experience (simplified)
-    estimated_age = estimate_age_from_experience(user_data.get('total_experience', ''))
+    # EMI at table rates; FOIR once salary slips / bank statements give income and obligations
+    extracted_financials = summarize_extracted_financials(uploaded_documents)
+    loan = loan_metrics(
+        loan_amount, tenure_months, user_data.get('property_type'),
+        monthly_income=extracted_financials.get('net_monthly_income') or extracted_financials.get('gross_monthly_income'),
+        monthly_obligations=extracted_financials.get('monthly_obligations')
+    )
+    
+    # Estimate age from experience (simplified); total_experience_years is parsed at ingest
+    experience_years = user_data.get('total_experience_years')
+    if experience_years is not None:
+        estimated_age = estimate_age_from_years(experience_years)
+    else:
+        estimated_age = estimate_age_from_experience(user_data.get('total_experience', ''))
+    
+    # Mobiles/emails this application shares with others (primary-key lookup of its cluster)
+    contact_cluster = get_contact_cluster(user_data['id'])
+    # Sale deed price per sq ft against the pincode's streaming quartiles (primary-key lookup)
+    valuation = get_valuation_check(user_data)
     
     # Document analysis
     required_docs = get_required_documents(user_data)
@@ -154,11 +337,15 @@ def create_structured_prompt_data(user_data, uploaded_documents):
         },
         "loan_details": {
             "loan_amount": loan_amount,
-            "tenure_months": user_data.get('tenure', 0),
-            "tenure_years": user_data.get('tenure', 0) / 12,
+            "tenure_months": tenure_months,
+            "tenure_years": tenure_months / 12,
             "property_type": user_data.get('property_type', 'Not specified'),
             "property_value": property_value,
-            "ltv_calculated": ltv
+            "ltv_calculated": ltv,
+            "interest_rate": loan['interest_rate'],
+            "emi": loan['emi'],
+            "total_interest": loan['total_interest'],
+            "foir_calculated": loan['foir']
         },
         "co_applicant_details": {
             "has_co_applicant": user_data['has_co_applicant'],
@@ -172,6 +359,15 @@ def create_structured_prompt_data(user_data, uploaded_documents):
             "missing_documents": missing_docs,
             "completion_percentage": (len(uploaded_doc_types) / len(required_docs) * 100) if required_docs else 0
         },
+        # Figures read from salary slips, Form 16 and bank statements (empty until extracted)
+        "extracted_financials": extracted_financials,
+        "risk_signals": {
+            "shared_contacts": {
+                "connected_applications": contact_cluster['size'] - 1,
+                "shared_fields": [shared['source'] for shared in contact_cluster['shared_contacts']]
+            } if contact_cluster else {},
+            "valuation": valuation or {}
+        },
         "eligibility_rules": {
             "salaried": {
                 "max_foir": Config.SALARIED_FOIR_MAX * 100,
@@ -194,34 +390,54 @@ def create_structured_prompt_data(user_data, uploaded_documents):
 
 def call_gemini_api(prompt_data):
     """Call Gemini API with structured data"""
+    # While the breaker is open skip the model probe entirely and answer from the rules
+    if not gemini_breaker.allow_request():
+        GEMINI_BREAKER_REJECTED_TOTAL.inc()
+        return create_fallback_analysis(prompt_data, needs_reanalysis=True)
+
     try:
-        model = get_gemini_model()
-        
-        # Create detailed prompt
-        prompt = create_detailed_prompt(prompt_data)
+        # Compact prompt; JSON mode returns schema-shaped output (validated for every model)
+        prompt = create_compact_prompt(prompt_data)
         
-        response = model.generate_content(prompt)
-        return parse_gemini_response(response.text)
+        analysis_result = hedged_generate(prompt)
+        gemini_breaker.record_success()
+        return analysis_result
         
     except Exception as e:
         print(f"Gemini API call failed: {e}")
+        gemini_breaker.record_failure()
         # Return a fallback analysis if API fails
-        return create_fallback_analysis(prompt_data)
+        return create_fallback_analysis(prompt_data, needs_reanalysis=True)
 
-def create_fallback_analysis(prompt_data):
+def create_fallback_analysis(prompt_data, needs_reanalysis=False):
     """Create a fallback analysis when AI is not available"""
+    FALLBACK_ANALYSES_TOTAL.inc()
     loan_amount = prompt_data['loan_details']['loan_amount']
     property_value = prompt_data['loan_details']['property_value']
     ltv = prompt_data['loan_details']['ltv_calculated']
+    foir = prompt_data['loan_details'].get('foir_calculated')
     doc_completion = prompt_data['documents_analysis']['completion_percentage']
+    rules = prompt_data['eligibility_rules']
+    self_employed = prompt_data['applicant_details'].get('employment_type') == 'Self-Employed'
+    max_foir = rules['self_employed' if self_employed else 'salaried']['max_foir']
+    max_ltv = rules['general']['max_ltv']
     
     # Simple rule-based fallback analysis
     if doc_completion < 50:
         eligibility = "Not Eligible"
         reasoning = "Insufficient documents uploaded for proper assessment"
-    elif ltv > 75:
+    elif ltv > max_ltv:
+        eligibility = "Not Eligible"
+        reasoning = f"LTV ratio {ltv:.1f}% exceeds maximum {max_ltv:g}% threshold"
+    elif foir is not None and foir > max_foir:
         eligibility = "Not Eligible"
-        reasoning = f"LTV ratio {ltv:.1f}% exceeds maximum 75% threshold"
+        reasoning = f"FOIR {foir:.1f}% exceeds maximum {max_foir:g}% for the EMI of {prompt_data['loan_details']['emi']:,.0f}"
+    elif foir is not None and self_employed and foir + ltv > rules['self_employed']['foir_plus_ltv_max']:
+        eligibility = "Not Eligible"
+        reasoning = f"FOIR + LTV {foir + ltv:.1f}% exceeds maximum {rules['self_employed']['foir_plus_ltv_max']}%"
+    elif doc_completion >= 80 and foir is not None:
+        eligibility = "Conditional"
+        reasoning = f"Documents appear complete and FOIR {foir:.1f}% is within {max_foir:g}%; manual verification required"
     elif doc_completion >= 80:
         eligibility = "Conditional"
         reasoning = "Documents appear complete, but manual income verification required"
@@ -229,128 +445,210 @@ def create_fallback_analysis(prompt_data):
         eligibility = "Pending"
         reasoning = "Insufficient data for automated analysis"
     
+    queries = ["Manual verification required due to AI service unavailability"]
+    shared_contacts = prompt_data.get('risk_signals', {}).get('shared_contacts')
+    if shared_contacts:
+        queries.append(f"Contacts ({', '.join(shared_contacts['shared_fields'])}) are shared with "
+                       f"{shared_contacts['connected_applications']} other applications; verify applicant and references")
+    valuation = prompt_data.get('risk_signals', {}).get('valuation')
+    inflated_deed = bool(valuation) and valuation['outlier'] and valuation['deviation_score'] > 0
+    if inflated_deed:
+        queries.append(f"Sale deed implies ₹{valuation['price_per_sqft']:,}/sq ft against a local median of "
+                       f"₹{valuation['median_price_per_sqft']:,}; LTV at the local median is "
+                       f"{valuation['ltv_at_local_median']}%. Obtain an independent valuation")
+    
     return {
         "eligibility": eligibility,
-        "foir_used": None,
+        "foir_used": foir,
         "ltv_used": ltv,
-        "risk_level": "Medium",
+        "risk_level": "High" if shared_contacts or inflated_deed else "Medium",
         "reasoning": f"FALLBACK ANALYSIS: {reasoning}",
         "missing_documents": prompt_data['documents_analysis']['missing_documents'],
-        "queries": ["Manual verification required due to AI service unavailability"],
-        "recommendation": "Please verify income documents and property valuation manually"
+        "queries": queries,
+        "recommendation": "Please verify income documents and property valuation manually",
+        "needs_reanalysis": needs_reanalysis
     }
 
-def create_detailed_prompt(prompt_data):
-    """Create detailed prompt for Gemini"""
-    
-    prompt = f"""
-    LOAN ELIGIBILITY ANALYSIS REQUEST
-
-    Please analyze this loan application and provide a structured JSON response.
-
-    APPLICANT DATA:
-    {json.dumps(prompt_data, indent=2)}
-
-    ANALYSIS INSTRUCTIONS:
-
-    1. Evaluate eligibility based on:
-       - FOIR (Fixed Obligation to Income Ratio) - estimate based on standard industry norms
-       - LTV (Loan-to-Value) ratio
-       - Document completeness
-       - Employment stability
-       - Age considerations
-
-    2. Consider these rules:
-       - Salaried: FOIR ≤ {prompt_data['eligibility_rules']['salaried']['max_foir']}%, Age ≤ {prompt_data['eligibility_rules']['salaried']['max_age']}
-       - Self-employed: FOIR ≤ {prompt_data['eligibility_rules']['self_employed']['max_foir']}%, FOIR + LTV ≤ 140%
-       - Maximum LTV: {prompt_data['eligibility_rules']['general']['max_ltv']}%
-
-    3. IMPORTANT: Never show full Aadhaar numbers. Mask first 8 digits if mentioned.
-
-    4. Return analysis in this exact JSON format:
-    {{
-        "eligibility": "Eligible/Not Eligible/Conditional",
-        "foir_used": 55.5,
-        "ltv_used": 62.5,
-        "risk_level": "Low/Medium/High",
-        "reasoning": "Detailed explanation of the decision",
-        "missing_documents": ["Document1", "Document2"],
-        "queries": ["Query question 1", "Query question 2"],
-        "recommendation": "Overall recommendation text"
-    }}
-
-    5. For FOIR calculation, assume standard income estimates based on:
-       - Designation and industry norms
-       - Document completeness
-       - Employment history
-
-    Provide only the JSON response, no additional text.
-    """
-    
+# Response contract enforced by Gemini's JSON mode and re-checked by validate_analysis_result
+ELIGIBILITY_VALUES = ['Eligible', 'Not Eligible', 'Conditional']
+RISK_LEVELS = ['Low', 'Medium', 'High']
+ANALYSIS_RESPONSE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'eligibility': {'type': 'string', 'enum': ELIGIBILITY_VALUES},
+        'foir_used': {'type': 'number', 'nullable': True},
+        'ltv_used': {'type': 'number', 'nullable': True},
+        'risk_level': {'type': 'string', 'enum': RISK_LEVELS},
+        'reasoning': {'type': 'string'},
+        'missing_documents': {'type': 'array', 'items': {'type': 'string'}},
+        'queries': {'type': 'array', 'items': {'type': 'string'}},
+        'recommendation': {'type': 'string'}
+    },
+    'required': ['eligibility', 'risk_level', 'reasoning', 'missing_documents', 'queries', 'recommendation']
+}
+
+# Payload fields dropped, in order, while a prompt is over Config.AI_PROMPT_TOKEN_BUDGET
+_PROMPT_TRIM_ORDER = [
+    ('loan_details', 'total_interest'),
+    ('documents_analysis', 'uploaded_documents'),
+    ('applicant_details', 'qualification'),
+    ('applicant_details', 'department'),
+    ('co_applicant_details', 'qualification'),
+    ('documents_analysis', 'missing_documents'),
+]
+
+class AnalysisSchemaError(ValueError):
+    """Model output that does not match ANALYSIS_RESPONSE_SCHEMA"""
+
+@functools.lru_cache(maxsize=8)
+def _instruction_prefix(salaried_foir, salaried_age, max_tenure, self_employed_foir, self_employed_age, max_ltv):
+    """Static instructions, built once per rule configuration"""
+    return (
+        "Assess this home loan application. Rules: "
+        f"salaried FOIR<={salaried_foir:g}%, age<={salaried_age}, tenure<={max_tenure}y; "
+        f"self-employed FOIR<={self_employed_foir:g}%, age<={self_employed_age}, FOIR+LTV<=140%; "
+        f"LTV<={max_ltv:g}%; documents>=80% complete. "
+        "loan_details.emi is the instalment at our rates; use loan_details.foir_calculated when given, "
+        "else estimate income from designation and experience and compute FOIR with that EMI. "
+        "risk_signals.shared_contacts means mobiles/emails of this application also appear in other "
+        "applications (possible fraud ring): raise risk_level and add a verification query. "
+        "risk_signals.valuation compares the sale deed price per sq ft with local comparables; "
+        "a deviation_score of 3 or more suggests an inflated deed, so judge LTV by ltv_at_local_median. "
+        "foir_used and ltv_used are percentages. Never output full Aadhaar numbers. "
+        "Application JSON:\n"
+    )
+
+def build_instruction_prefix():
+    """Instruction prefix for the current Config rule thresholds"""
+    return _instruction_prefix(
+        Config.SALARIED_FOIR_MAX * 100, Config.MAX_AGE_SALARIED, Config.MAX_TENURE,
+        Config.SELF_EMPLOYED_FOIR_MAX * 100, Config.MAX_AGE_SELF_EMPLOYED, Config.LTV_THRESHOLD * 100
+    )
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + 1
+
+def _compact_value(value):
+    """Drop empty fields and round floats so the payload carries no filler"""
+    if isinstance(value, dict):
+        compacted = {key: _compact_value(item) for key, item in value.items()}
+        return {key: item for key, item in compacted.items() if item not in (None, '', [], {}, 'Not provided', 'Not specified')}
+    if isinstance(value, list):
+        return [_compact_value(item) for item in value]
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+def create_compact_prompt(prompt_data):
+    """Instruction prefix plus a minified applicant payload, trimmed to the token budget"""
+    payload = {key: value for key, value in prompt_data.items() if key not in ('eligibility_rules', 'user_id')}
+    # Contact details do not affect eligibility and only cost tokens
+    payload['applicant_details'] = {
+        key: value for key, value in payload.get('applicant_details', {}).items()
+        if key not in ('name', 'email', 'mobile')
+    }
+    payload['co_applicant_details'] = {
+        key: value for key, value in payload.get('co_applicant_details', {}).items() if key != 'name'
+    }
+    payload = _compact_value(payload)
+
+    prefix = build_instruction_prefix()
+    prompt = prefix + json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+    for section, field in _PROMPT_TRIM_ORDER:
+        if estimate_tokens(prompt) <= Config.AI_PROMPT_TOKEN_BUDGET:
+            break
+        payload.get(section, {}).pop(field, None)
+        prompt = prefix + json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
     return prompt
 
+def analysis_generation_config(model_name):
+    """JSON mode with the response schema for models that support it, else a plain config"""
+    if model_name not in Config.AI_SCHEMA_MODEL_NAMES:
+        return genai.GenerationConfig(temperature=0.2)
+    return genai.GenerationConfig(
+        response_mime_type='application/json',
+        response_schema=ANALYSIS_RESPONSE_SCHEMA,
+        temperature=0.2
+    )
+
+@functools.lru_cache(maxsize=1)
+def plain_response_instructions():
+    """Output contract spelled out for models without JSON mode"""
+    fields = []
+    for field, spec in ANALYSIS_RESPONSE_SCHEMA['properties'].items():
+        kind = f"one of {'/'.join(spec['enum'])}" if 'enum' in spec else spec['type']
+        if spec['type'] == 'array':
+            kind = 'list of strings'
+        fields.append(f"{field} ({kind}{' or null' if spec.get('nullable') else ''})")
+    return "\nReply with only a JSON object with keys: " + ', '.join(fields) + "."
+
+def validate_analysis_result(result):
+    """Strictly check a decoded response against ANALYSIS_RESPONSE_SCHEMA"""
+    if not isinstance(result, dict):
+        raise AnalysisSchemaError("Response is not a JSON object")
+
+    missing = [field for field in ANALYSIS_RESPONSE_SCHEMA['required'] if field not in result]
+    if missing:
+        raise AnalysisSchemaError(f"Missing fields: {', '.join(missing)}")
+
+    for field, spec in ANALYSIS_RESPONSE_SCHEMA['properties'].items():
+        if field not in result:
+            continue
+        value = result[field]
+        if value is None and spec.get('nullable'):
+            continue
+        if spec['type'] == 'string' and not isinstance(value, str):
+            raise AnalysisSchemaError(f"{field} must be a string")
+        if spec['type'] == 'number' and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise AnalysisSchemaError(f"{field} must be a number")
+        if spec['type'] == 'array' and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise AnalysisSchemaError(f"{field} must be a list of strings")
+        if 'enum' in spec and value not in spec['enum']:
+            raise AnalysisSchemaError(f"{field} must be one of {spec['enum']}")
+
+    return result
+
 def parse_gemini_response(response_text):
-    """Parse Gemini response and extract structured data"""
+    """Decode a response and validate it against the schema. Models without JSON mode
+    may wrap the object in a markdown fence or prose, so the outermost {...} is taken."""
     try:
-        # Clean the response text
-        cleaned_text = response_text.strip()
-        
-        # Remove markdown code blocks if present
-        cleaned_text = re.sub(r'```json\s*', '', cleaned_text)
-        cleaned_text = re.sub(r'```\s*', '', cleaned_text)
-        
-        # Try to find JSON in the response
-        json_match = re.search(r'\{.*\}', cleaned_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            result = json.loads(json_str)
-            
-            # Validate required fields
-            if 'eligibility' not in result:
-                result['eligibility'] = 'Analysis Completed'
-            if 'reasoning' not in result:
-                result['reasoning'] = 'AI analysis completed'
-            if 'queries' not in result:
-                result['queries'] = []
-            if 'missing_documents' not in result:
-                result['missing_documents'] = []
-                
-            return result
-        else:
-            # Fallback for non-JSON responses
-            return {
-                "eligibility": "Analysis Completed",
-                "reasoning": cleaned_text,
-                "queries": ["Manual review recommended"],
-                "missing_documents": [],
-                "risk_level": "Medium",
-                "recommendation": "Please review the AI analysis manually"
-            }
-            
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing failed: {e}")
+        start, end = response_text.find('{'), response_text.rfind('}')
+        if start == -1 or end < start:
+            raise AnalysisSchemaError("No JSON object in response")
+        return validate_analysis_result(json.loads(response_text[start:end + 1]))
+    except (json.JSONDecodeError, AnalysisSchemaError) as e:
+        ANALYSIS_PARSE_FAILURES_TOTAL.inc()
+        print(f"Gemini response rejected: {e}")
         return {
             "eligibility": "Analysis Error",
-            "reasoning": f"JSON parsing failed: {str(e)}",
+            "reasoning": f"Invalid AI response: {str(e)}",
             "queries": ["Technical analysis error"],
             "missing_documents": [],
             "risk_level": "High",
             "recommendation": "Please retry analysis or check manually"
         }
 
+def record_token_usage(response, prompt):
+    """Record prompt/response token counts, preferring the API's own usage metadata"""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', 0) or estimate_tokens(prompt)
+    response_tokens = getattr(usage, 'candidates_token_count', 0) or estimate_tokens(response.text)
+    GEMINI_TOKENS_TOTAL.inc('prompt', amount=prompt_tokens)
+    GEMINI_TOKENS_TOTAL.inc('response', amount=response_tokens)
+    GEMINI_PROMPT_TOKENS.observe(prompt_tokens)
+
+def estimate_age_from_years(experience_years):
+    """Assume starting career at 22 + experience years"""
+    return 22 + int(experience_years)
+
 def estimate_age_from_experience(experience_text):
-    """Estimate age from experience (simplified)"""
-    if not experience_text:
+    """Estimate age from experience text (simplified)"""
+    experience_years = parse_experience_years(experience_text)
+    if experience_years is None:
         return 30  # Default assumption
-    
-    # Extract years from experience text
-    years_match = re.search(r'(\d+)\s*(years|yrs)', experience_text.lower())
-    if years_match:
-        experience_years = int(years_match.group(1))
-        # Assume starting career at 22 + experience years
-        return 22 + experience_years
-    
-    return 30  # Default fallback
+    return estimate_age_from_years(experience_years)
 
 def classify_employment_type(user_data):
     """Classify employment type based on user data"""
@@ -367,9 +665,6 @@ def classify_employment_type(user_data):
     return 'Salaried'
 
 def trigger_bulk_analysis(user_ids):
-    """Trigger AI analysis for multiple users with delays to avoid rate limiting"""
-    for i, user_id in enumerate(user_ids):
-        trigger_ai_analysis(user_id)
-        # Add delay between requests to avoid rate limiting
-        if i < len(user_ids) - 1:  # Don't delay after the last one
-            time.sleep(1)  # 1 second delay between requests
\ No newline at end of file
+    """Queue AI analysis for multiple users; the worker pool size bounds the request rate"""
+    for user_id in user_ids:
+        trigger_ai_analysis(user_id)
\ No newline at end of file
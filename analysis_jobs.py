@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from metrics import ANALYSES_QUEUED
+
+# In-process analysis job queue. Web requests only enqueue; a bounded pool of worker
+# threads talks to the model and reports progress, which the status endpoints read.
+
+QUEUED = 'queued'
+CALLING_MODEL = 'calling_model'
+RETRYING = 'retrying'
+SAVED = 'saved'
+FAILED = 'failed'
+TERMINAL_STAGES = (SAVED, FAILED)
+
+_executor = ThreadPoolExecutor(max_workers=Config.AI_WORKER_THREADS, thread_name_prefix='analysis')
+_jobs = {}
+_active_by_user = {}
+_jobs_changed = threading.Condition()
+
+def _snapshot(job):
+    return {
+        'id': job['id'],
+        'user_id': job['user_id'],
+        'stage': job['stage'],
+        'message': job['message'],
+        'version': len(job['events']),
+        # Copies, so callers can annotate events without touching the shared job
+        'events': [dict(event) for event in job['events']],
+        'done': job['stage'] in TERMINAL_STAGES
+    }
+
+def _prune_jobs(now):
+    """Forget finished jobs older than Config.AI_JOB_RETENTION_SECONDS (caller holds the lock)"""
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job['stage'] in TERMINAL_STAGES and now - job['updated_at'] > Config.AI_JOB_RETENTION_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def _update(job_id, stage, message=''):
+    with _jobs_changed:
+        job = _jobs[job_id]
+        if job['stage'] in TERMINAL_STAGES:
+            return
+        job['stage'] = stage
+        job['message'] = message
+        job['updated_at'] = time.time()
+        job['events'].append({'stage': stage, 'message': message, 'at': job['updated_at']})
+        if stage in TERMINAL_STAGES and _active_by_user.get(job['user_id']) == job_id:
+            del _active_by_user[job['user_id']]
+        _jobs_changed.notify_all()
+
+def _run(job_id, user_id, analyze):
+    ANALYSES_QUEUED.dec()
+
+    def progress(stage, message=''):
+        _update(job_id, stage, message)
+
+    try:
+        result = analyze(user_id, progress=progress)
+    except Exception as e:
+        _update(job_id, FAILED, str(e))
+        raise
+
+    # analyze() reports SAVED itself; anything that returned without it failed
+    if isinstance(result, dict) and 'error' in result:
+        _update(job_id, FAILED, result['error'])
+    else:
+        _update(job_id, SAVED, 'Analysis saved')
+
+def submit_analysis(user_id, analyze):
+    """Queue analyze(user_id, progress=...) and return the job id (reuses an unfinished job for the user)"""
+    with _jobs_changed:
+        now = time.time()
+        _prune_jobs(now)
+
+        active_id = _active_by_user.get(user_id)
+        if active_id is not None:
+            return active_id
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'id': job_id,
+            'user_id': user_id,
+            'stage': QUEUED,
+            'message': 'Waiting for a worker',
+            'updated_at': now,
+            'events': [{'stage': QUEUED, 'message': 'Waiting for a worker', 'at': now}]
+        }
+        _active_by_user[user_id] = job_id
+
+    ANALYSES_QUEUED.inc()
+    _executor.submit(_run, job_id, user_id, analyze)
+    return job_id
+
+def get_job(job_id):
+    """Current state of a job, or None if unknown or expired"""
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        return _snapshot(job) if job else None
+
+def wait_for_job(job_id, since_version, timeout):
+    """Block until the job has more than since_version events, finishes, or timeout passes"""
+    deadline = time.monotonic() + timeout
+    with _jobs_changed:
+        while True:
+            job = _jobs.get(job_id)
+            if job is None:
+                return None
+            if len(job['events']) > since_version or job['stage'] in TERMINAL_STAGES:
+                return _snapshot(job)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return _snapshot(job)
+            _jobs_changed.wait(remaining)
@@ -1,7 +1,14 @@
 from flask import Flask
 from config import Config
 from models import init_db, check_table_schema, get_user_analysis
+from completeness import refresh_stale_completeness
+from rollups import rebuild_rollups
 from routes import configure_routes
+from query_instrumentation import init_query_instrumentation
+from metrics import init_metrics
+from profiling import init_profiling
+from document_storage import init_document_storage
+from rule_simulator import init_rule_simulator
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -9,6 +16,12 @@ app.config.from_object(Config)
 # Initialize database (only at app start)
 init_db()
 
+# Score users added before the completeness columns existed, or last scored in an earlier year
+refresh_stale_completeness()
+
+# Compact the analytics rollups: recompute them from the base tables and drop emptied buckets
+rebuild_rollups()
+
 # Verify schema
 is_valid, missing = check_table_schema()
 if is_valid:
@@ -16,6 +29,21 @@ if is_valid:
 else:
     print(f"✗ Database schema issues: {missing}")
 
+# Count and time SQL per request
+init_query_instrumentation(app)
+
+# Request, DB and AI pipeline telemetry at /metrics
+init_metrics(app)
+
+# Opt-in per-request cProfile dumps under logs/profiles
+init_profiling(app)
+
+# Hash document uploads into the content-addressed store as they stream in
+init_document_storage(app)
+
+# What-if sweeps of the eligibility thresholds at /admin/rule_simulator
+init_rule_simulator(app)
+
 # Configure all routes
 configure_routes(app)
 
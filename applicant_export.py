@@ -0,0 +1,107 @@
+import csv
+import io
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from config import Config
+from models import get_read_connection, listing_conditions
+from utils import EXCEL_COLUMN_MAP
+
+# Month-end applicant dumps: every applicant matching the listing filters with their
+# latest analysis. Rows come off a SQLite cursor in batches and are written straight
+# into the response, so memory stays flat however many applicants match. Applicant
+# columns use the Excel import headers, so an export can be edited and re-imported.
+
+EXPORT_COLUMNS = (
+    [('Applicant ID', 'u.id')]
+    + [(header, f'u.{column}') for header, column in EXCEL_COLUMN_MAP.items()]
+    + [
+        ('Completeness Score', 'u.completeness_score'),
+        ('Created At', 'u.created_at'),
+        ('Eligibility Status', "COALESCE(ua.eligibility_status, 'Pending')"),
+        ('FOIR Used', 'ua.foir_used'),
+        ('LTV Used', 'ua.ltv_used'),
+        ('Risk Level', 'ua.risk_level'),
+        ('Recommendation', 'ua.recommendation'),
+        ('AI Summary', 'ua.ai_summary'),
+        ('AI Queries', 'ua.ai_queries'),
+        ('Missing Documents', 'ua.missing_docs'),
+        ('Analysis Date', 'ua.analysis_date'),
+        ('Retry Count', 'ua.retry_count'),
+        ('Needs Reanalysis', 'ua.needs_reanalysis'),
+    ]
+)
+EXPORT_HEADERS = [header for header, _ in EXPORT_COLUMNS]
+
+def iter_applicant_rows(search='', status='', **filters):
+    """Yield export rows (tuples in EXPORT_COLUMNS order) for the all_users listing filters"""
+    query = f'''
+        SELECT {', '.join(expression for _, expression in EXPORT_COLUMNS)}
+        FROM users_full u
+        LEFT JOIN user_analysis ua ON ua.id = (
+            SELECT id FROM user_analysis WHERE user_id = u.id ORDER BY analysis_date DESC LIMIT 1
+        )
+        WHERE 1 = 1
+    '''
+    conditions, params = listing_conditions('u.', **filters)
+    query += conditions
+    if search:
+        query += ' AND (u.applicant_name LIKE ? OR u.email_id LIKE ? OR u.mobile_no LIKE ?)'
+        params.extend([f'%{search}%'] * 3)
+    if status:
+        query += " AND COALESCE(ua.eligibility_status, 'Pending') = ?"
+        params.append(status)
+    query += ' ORDER BY u.id'
+
+    conn = get_read_connection()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(Config.EXPORT_FETCH_ROWS)
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+    finally:
+        conn.close()
+
+def _csv_safe(value):
+    # A leading =, +, - or @ makes spreadsheet apps evaluate the cell as a formula
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+def stream_csv(rows):
+    """Yield a UTF-8 CSV (header + rows) in chunks of about Config.DOWNLOAD_CHUNK_SIZE"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens non-ASCII names correctly
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        writer.writerow([_csv_safe(value) for value in row])
+        if buffer.tell() >= Config.DOWNLOAD_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def stream_xlsx(rows):
+    """Yield an XLSX workbook of the rows.
+
+    A write-only workbook spools each row to disk as it is appended; the finished
+    file is then streamed back in chunks. XLSX is a ZIP that openpyxl cannot write
+    to an unseekable stream, so bytes start flowing once the last row is read.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Applicants')
+    sheet.append(EXPORT_HEADERS)
+    for row in rows:
+        sheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+                      for value in row])
+
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(Config.DOWNLOAD_CHUNK_SIZE), b''):
+            yield chunk
@@ -0,0 +1,102 @@
+from datetime import datetime
+from models import get_db_connection, bump_rollup
+from utils import (
+    COMPLETENESS_FIELDS, DOCUMENT_TYPES, DOCUMENT_TYPE_BITS, completeness_score, document_mask, get_required_documents
+)
+
+# Per-user completeness kept on the users row so listings, filters and the dashboard never
+# recompute it: completeness_fields (filled COMPLETENESS_FIELDS), doc_required_mask,
+# doc_uploaded_mask, doc_missing_mask (required & ~uploaded) and completeness_score.
+# Rewritten whenever a user is created or imported and adjusted on document upload/delete.
+
+# Host-parameter limit of older SQLite builds
+_ID_CHUNK = 500
+
+# Document funnel for the analytics page; each stage includes the ones before it
+_KYC_MASK = document_mask(['Aadhar Card', 'PAN Card'])
+_INCOME_MASK = document_mask([doc_type for doc_type in DOCUMENT_TYPES
+                              if doc_type.startswith(('Salary Slip', 'Form 16', 'Bank Statement'))])
+FUNNEL_STAGES = [
+    ('applied', lambda required, uploaded: True),
+    ('documents_started', lambda required, uploaded: uploaded != 0),
+    ('kyc_uploaded', lambda required, uploaded: uploaded & _KYC_MASK == _KYC_MASK),
+    ('income_documents_uploaded', lambda required, uploaded: required & _INCOME_MASK & ~uploaded == 0),
+    ('all_required_uploaded', lambda required, uploaded: required & ~uploaded == 0),
+]
+
+def funnel_stages(required_mask, uploaded_mask):
+    """Funnel stages reached by a user with these masks (none before the first scoring)"""
+    reached = []
+    if required_mask is None:
+        return reached
+    for stage, reached_stage in FUNNEL_STAGES:
+        if not reached_stage(required_mask, uploaded_mask or 0):
+            break
+        reached.append(stage)
+    return reached
+
+def _store(conn, user_id, filled_fields, required_mask, uploaded_mask):
+    previous = conn.execute('SELECT doc_required_mask, doc_uploaded_mask FROM users WHERE id = ?',
+                            (user_id,)).fetchone()
+    conn.execute('''
+        UPDATE users
+        SET completeness_fields = ?, doc_required_mask = ?, doc_uploaded_mask = ?, doc_missing_mask = ?,
+            completeness_score = ?, completeness_year = ?
+        WHERE id = ?
+    ''', (filled_fields, required_mask, uploaded_mask, required_mask & ~uploaded_mask,
+          completeness_score(filled_fields, required_mask, uploaded_mask), datetime.now().year, user_id))
+    before = set(funnel_stages(previous['doc_required_mask'], previous['doc_uploaded_mask'])) if previous else set()
+    after = set(funnel_stages(required_mask, uploaded_mask))
+    for stage in before ^ after:
+        bump_rollup(conn, 'rollup_document_funnel', {'stage': stage}, {'users': 1 if stage in after else -1})
+
+def refresh_completeness(conn, user_ids):
+    """Recompute completeness from scratch for new or edited users (caller commits)"""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), _ID_CHUNK):
+        chunk = user_ids[start:start + _ID_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        uploaded = {}
+        for row in conn.execute(f'SELECT DISTINCT user_id, document_type FROM user_documents '
+                                f'WHERE user_id IN ({placeholders})', chunk):
+            uploaded[row['user_id']] = uploaded.get(row['user_id'], 0) | DOCUMENT_TYPE_BITS.get(row['document_type'], 0)
+        users = conn.execute(f'''
+            SELECT id, job_since, job_since_year, has_co_applicant, {', '.join(COMPLETENESS_FIELDS)}
+            FROM users_full WHERE id IN ({placeholders})
+        ''', chunk).fetchall()
+        for user in users:
+            _store(conn, user['id'], sum(1 for field in COMPLETENESS_FIELDS if user[field]),
+                   document_mask(get_required_documents(user)), uploaded.get(user['id'], 0))
+
+def _adjust_uploaded_mask(conn, user_id, set_bits=0, clear_bits=0):
+    user = conn.execute('SELECT completeness_fields, doc_required_mask, doc_uploaded_mask FROM users WHERE id = ?',
+                        (user_id,)).fetchone()
+    if user is None:
+        return
+    if user['doc_required_mask'] is None:
+        refresh_completeness(conn, [user_id])
+        return
+    _store(conn, user_id, user['completeness_fields'], user['doc_required_mask'],
+           (user['doc_uploaded_mask'] | set_bits) & ~clear_bits)
+
+def record_documents_added(conn, user_id, document_types):
+    """Mark uploaded document types present (caller commits)"""
+    _adjust_uploaded_mask(conn, user_id, set_bits=document_mask(document_types))
+
+def record_document_removed(conn, user_id, document_type):
+    """Clear a document type once its last file is deleted (caller commits, after the DELETE)"""
+    if conn.execute('SELECT 1 FROM user_documents WHERE user_id = ? AND document_type = ? LIMIT 1',
+                    (user_id, document_type)).fetchone() is not None:
+        return
+    _adjust_uploaded_mask(conn, user_id, clear_bits=DOCUMENT_TYPE_BITS.get(document_type, 0))
+
+def refresh_stale_completeness():
+    """Score users never scored, or scored in an earlier year (the job-tenure rule moves with the calendar)"""
+    conn = get_db_connection()
+    user_ids = [row['id'] for row in conn.execute(
+        'SELECT id FROM users WHERE completeness_year IS NULL OR completeness_year != ?', (datetime.now().year,))]
+    if user_ids:
+        refresh_completeness(conn, user_ids)
+        conn.commit()
+        print(f"Refreshed completeness for {len(user_ids)} users")
+    conn.close()
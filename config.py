@@ -7,11 +7,30 @@ load_dotenv()
 class Config:
     SECRET_KEY = 'your_secret_key_here_for_production_change_this'
     UPLOAD_FOLDER = 'uploads'
-    DOCUMENT_UPLOAD_FOLDER = 'user_documents'
+    DOCUMENT_UPLOAD_FOLDER = os.getenv('DOCUMENT_UPLOAD_FOLDER', 'user_documents')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
     ALLOWED_DOCUMENT_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png'}
-    DATABASE = 'users.db'
+    MAX_DOCUMENT_SIZE = 10 * 1024 * 1024  # per document, enforced while the upload streams in
+    BULK_UPLOAD_MAX_FILES = 50  # files taken from one bulk ZIP upload
+    DOCUMENT_STORE_FOLDER = os.path.join(DOCUMENT_UPLOAD_FOLDER, 'store')  # content-addressed blobs
+    DOCUMENT_CACHE_SECONDS = 3600  # private browser caching of documents; revalidated by ETag afterwards
+    # Hand file bodies to the front-end server (X-Sendfile) instead of streaming them from Python
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+    # Background re-encoding of JPG/PNG uploads (needs Pillow)
+    IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '1'))
+    IMAGE_MAX_DIMENSION = 2000  # longest side in pixels after downscaling
+    IMAGE_JPEG_QUALITY = 82
+    KEEP_ORIGINAL_IMAGES = os.getenv('KEEP_ORIGINAL_IMAGES', 'false').lower() == 'true'
+    THUMBNAIL_SIZE = 240
+    THUMBNAIL_CACHE_SECONDS = 365 * 24 * 3600  # thumbnails are content-addressed, so never change
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024  # bytes read per step when streaming files out
+    EXPORT_MAX_APPLICANTS = 200  # applicants per multi-applicant document export
+    EXPORT_FETCH_ROWS = 500  # rows pulled from the cursor per step by the CSV/XLSX applicant export
+    DATABASE = os.getenv('DATABASE_PATH', 'users.db')
+    # Background writes are group-committed by one writer thread (db_writer.py)
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '64'))  # max intents per transaction
+    DB_WRITE_MAX_LATENCY_MS = float(os.getenv('DB_WRITE_MAX_LATENCY_MS', '5'))  # wait for more intents before committing
     
     # Gemini AI Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your_gemini_api_key_here')
@@ -23,12 +42,76 @@ class Config:
     MAX_AGE_SELF_EMPLOYED = 70
     MAX_TENURE = 30  # years
     LTV_THRESHOLD = 0.75  # 75% LTV max
+
+    # Pricing used to compute EMI and FOIR (loan_calculator.py): annual rate (%) by loan-amount
+    # slab (inclusive upper bound, None for the last slab) plus a spread per property type
+    LOAN_RATE_SLABS = [(3000000, 8.40), (7500000, 8.65), (None, 8.90)]
+    LOAN_RATE_SPREADS = {'Plot': 0.50, 'Commercial': 1.00}
     
     # AI Analysis Settings
     AUTO_ANALYSIS_ENABLED = True
     AI_RETRY_ATTEMPTS = 2  # Reduced from 3 to avoid excessive retries
-    AI_TIMEOUT_SECONDS = 30
+    AI_TIMEOUT_SECONDS = 30  # hard deadline for one analysis across all hedged model calls
+    AI_HEDGE_DELAY_SECONDS = float(os.getenv('AI_HEDGE_DELAY_SECONDS', '8'))  # wait before racing the next model
+    AI_MODEL_NAMES = ['gemini-1.5-pro', 'gemini-1.0-pro', 'models/gemini-pro', 'gemini-pro']  # in preference order
+    # Models that accept JSON mode with a response schema; the others get a plain prompt
+    # asking for the same JSON, and their answers go through the same validation
+    AI_SCHEMA_MODEL_NAMES = {'gemini-1.5-pro'}
     AI_RATE_LIMIT_DELAY = 1  # seconds between API calls
+    AI_BREAKER_FAILURE_THRESHOLD = 3  # consecutive Gemini failures before the circuit opens
+    AI_BREAKER_RECOVERY_SECONDS = 60  # how long to serve fallbacks before probing Gemini again
+    AI_PROMPT_TOKEN_BUDGET = 600  # estimated prompt tokens; low-value payload fields are trimmed past this
+    AI_WORKER_THREADS = int(os.getenv('AI_WORKER_THREADS', '2'))  # concurrent analyses; also paces Gemini requests
+    AI_STATUS_POLL_SECONDS = 20  # max wait of one long-poll / SSE keep-alive interval
+    AI_JOB_RETENTION_SECONDS = 600  # how long finished analysis jobs stay visible to the status endpoints
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))  # processes for PDF/OCR text extraction
+    EXTRACTION_MAX_TEXT_CHARS = 20000  # extracted text kept per document
+    AI_REANALYSIS_BATCH_LIMIT = 20  # fallback results re-queued when the breaker closes; the rest go through /analyze_bulk
+
+    # Probable duplicate applicants (duplicates.py), detected on every insert/import
+    DUPLICATE_SCORE_THRESHOLD = 0.6  # pair score (0..1) at which applicants are flagged
+    DUPLICATE_MAX_BLOCK_SIZE = 200  # blocking keys shared by more users than this are ignored
+
+    # Shared-contact clusters across applicant, co-applicant and reference mobiles/emails (contact_graph.py)
+    CONTACT_CLUSTER_ALERT_SIZE = 3  # applications in a cluster before it is flagged in the listing and AI prompt
+    CONTACT_MAX_IDENTIFIER_USERS = 25  # a mobile/email given by this many users stops joining clusters
+    CONTACT_CLUSTER_LIST_LIMIT = 20  # linked applications listed per applicant
+
+    # Sale-deed price per sq ft against pincode quartiles (valuation_index.py)
+    VALUATION_MIN_SAMPLES = 10  # comparables a bucket needs before it is used (P² is rough below this)
+    VALUATION_OUTLIER_SCORE = 3.0  # |deviation score| (robust z, IQR scale) at which a valuation is flagged
+    VALUATION_MIN_SPREAD = 0.05  # floor on the scale as a fraction of the median, for near-identical prices
+
+    # What-if threshold sweeps at /admin/rule_simulator (rule_simulator.py)
+    RULE_SIMULATOR_MAX_AGE_SECONDS = 600  # portfolio features are reloaded after this
+    RULE_SIMULATOR_CACHE_SIZE = 256  # scenario results kept
+    RULE_SIMULATOR_MAX_SCENARIOS = 500  # grid size accepted per request
+
+    # Query instrumentation: every statement is counted and timed per Flask endpoint.
+    # In development/test a request that exceeds its query budget raises, which
+    # surfaces N+1 patterns early; budgets are never enforced in production.
+    # Only read/listing endpoints are budgeted: bulk writes such as /upload_excel
+    # legitimately scale with their input. Aggregates are at /admin/queries.
+    APP_ENV = os.getenv('APP_ENV', 'production')
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+    QUERY_BUDGET_ENFORCED = APP_ENV in ('development', 'test')
+    DEFAULT_QUERY_BUDGET = None  # unlisted endpoints are not budgeted
+    QUERY_STATS_MAX_SHAPES = 200  # distinct SQL shapes kept per endpoint
+    QUERY_BUDGETS = {
+        'dashboard': 10,
+        'all_users': 10,
+        'view_user': 15,
+        'analytics': 10,
+        'analytics_data': 10,
+    }
+
+    # Analytics page and /analytics/data (read from the rollup tables, rollups.py)
+    ANALYTICS_DAYS = 30  # days shown in the time series
+    ANALYTICS_TOP_PINCODES = 20
+
+    # Fake AI backend (load testing / local development without Gemini)
+    USE_MOCK_AI = os.getenv('USE_MOCK_AI', 'false').lower() == 'true'
+    MOCK_AI_LATENCY_SECONDS = float(os.getenv('MOCK_AI_LATENCY_SECONDS', '0.5'))
 
     # Create upload directories if they don't exist
     for folder in [UPLOAD_FOLDER, DOCUMENT_UPLOAD_FOLDER]:
@@ -38,4 +121,14 @@ class Config:
     # Create logs directory
     LOGS_FOLDER = 'logs'
     if not os.path.exists(LOGS_FOLDER):
-        os.makedirs(LOGS_FOLDER)
\ No newline at end of file
+        os.makedirs(LOGS_FOLDER)
+
+    # On-demand request profiling: send the X-Profile-Token header (or ?_profile=<token>)
+    # matching PROFILE_TOKEN, or sample a fraction of requests. cProfile dumps are
+    # written to logs/profiles and listed at /admin/profiles.
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_MAX_FILES = 200
+    PROFILES_FOLDER = os.path.join(LOGS_FOLDER, 'profiles')
+    if not os.path.exists(PROFILES_FOLDER):
+        os.makedirs(PROFILES_FOLDER)
@@ -0,0 +1,104 @@
+import re
+from config import Config
+from duplicates import normalize_mobile
+
+# Shared-contact graph: applications are connected when any of their mobiles or emails
+# (applicant, co-applicant or references) is the same. contact_identifiers maps each
+# normalised identifier ('p:<10 digits>' / 'e:<email>') to the users that gave it.
+# Connected applications form clusters kept by an incremental union-find: union by size,
+# relabelling the smaller side, so every users row carries its cluster's root in
+# contact_cluster_id and contact_clusters holds the size. Looking up an applicant's
+# cluster is a primary-key read; each user is relabelled at most log2(n) times overall.
+# Clusters only grow (nothing deletes users). Identifiers already given by
+# Config.CONTACT_MAX_IDENTIFIER_USERS users (placeholders, shared switchboards) are
+# still recorded but no longer merge clusters.
+
+# users_full column -> identifier kind. Office landlines are left out: colleagues share them.
+CONTACT_FIELDS = {
+    'mobile_no': 'phone',
+    'email_id': 'email',
+    'official_email_id': 'email',
+    'co_applicant_mobile': 'phone',
+    'co_applicant_email': 'email',
+    'ref1_mobile': 'phone',
+    'ref1_email': 'email',
+    'ref2_mobile': 'phone',
+    'ref2_email': 'email',
+}
+
+_PLACEHOLDER_EMAIL_NAMES = {'na', 'none', 'nil', 'test', 'abc', 'xyz', 'noemail', 'noreply'}
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[a-z]{2,}$')
+
+def normalize_email(email):
+    email = str(email or '').strip().lower()
+    if not _EMAIL_RE.match(email) or email.split('@')[0] in _PLACEHOLDER_EMAIL_NAMES:
+        return None
+    return email
+
+def normalize_identifier(kind, value):
+    """'p:<mobile>' / 'e:<email>' for a contact value, or None when empty or a placeholder"""
+    if kind == 'phone':
+        mobile = normalize_mobile(value)
+        # 0000000000, 9999999999 and the like are "not provided"
+        return f'p:{mobile}' if mobile and len(set(mobile)) > 1 else None
+    email = normalize_email(value)
+    return f'e:{email}' if email else None
+
+def contact_identifiers(user):
+    """{(identifier, source column)} of a user dict/row with CONTACT_FIELDS"""
+    identifiers = set()
+    for column, kind in CONTACT_FIELDS.items():
+        identifier = normalize_identifier(kind, user[column])
+        if identifier:
+            identifiers.add((identifier, column))
+    return identifiers
+
+def _union(conn, first, second):
+    """Merge two clusters, relabelling the smaller; returns the surviving root (caller commits)"""
+    if first == second:
+        return first
+    sizes = dict(conn.execute('SELECT cluster_id, size FROM contact_clusters WHERE cluster_id IN (?, ?)',
+                              (first, second)).fetchall())
+    # Larger cluster survives; on a tie the older (lower) root does
+    root, child = sorted((first, second), key=lambda cluster_id: (-sizes[cluster_id], cluster_id))
+    conn.execute('UPDATE users SET contact_cluster_id = ? WHERE contact_cluster_id = ?', (root, child))
+    conn.execute('UPDATE contact_clusters SET size = size + ? WHERE cluster_id = ?', (sizes[child], root))
+    conn.execute('DELETE FROM contact_clusters WHERE cluster_id = ?', (child,))
+    return root
+
+def index_user_contacts(conn, user_id, user):
+    """Record a new user's contact identifiers and merge it into the clusters it connects to;
+    returns the user's cluster id (caller commits)"""
+    conn.execute('INSERT INTO contact_clusters (cluster_id, size) VALUES (?, 1)', (user_id,))
+    conn.execute('UPDATE users SET contact_cluster_id = ? WHERE id = ?', (user_id, user_id))
+    identifiers = sorted(contact_identifiers(user))
+    if not identifiers:
+        return user_id
+
+    values = sorted({identifier for identifier, _ in identifiers})
+    placeholders = ','.join('?' * len(values))
+    linked_clusters = [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT u.contact_cluster_id
+        FROM contact_identifiers ci JOIN users u ON u.id = ci.user_id
+        WHERE ci.identifier IN (
+            SELECT identifier FROM contact_identifiers WHERE identifier IN ({placeholders})
+            GROUP BY identifier HAVING COUNT(DISTINCT user_id) < ?
+        )
+    ''', values + [Config.CONTACT_MAX_IDENTIFIER_USERS])]
+    conn.executemany('INSERT OR IGNORE INTO contact_identifiers (identifier, user_id, source) VALUES (?, ?, ?)',
+                     [(identifier, user_id, source) for identifier, source in identifiers])
+
+    root = user_id
+    for cluster_id in linked_clusters:
+        root = _union(conn, root, cluster_id)
+    return root
+
+def backfill_contact_graph(conn):
+    """Index users not yet in the graph in id order, as if each had just been inserted (caller commits)"""
+    users = conn.execute(f"""
+        SELECT id, {', '.join(CONTACT_FIELDS)} FROM users_full WHERE contact_cluster_id IS NULL ORDER BY id
+    """).fetchall()
+    for user in users:
+        index_user_contacts(conn, user['id'], user)
+    if users:
+        print(f"Indexed contacts of {len(users)} users")
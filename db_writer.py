@@ -0,0 +1,131 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from config import Config
+from query_instrumentation import InstrumentedConnection
+from metrics import DB_CONNECTIONS_TOTAL, DB_WRITE_BATCH_SIZE, DB_WRITE_LATENCY, DB_WRITE_QUEUE_DEPTH
+
+# Single-writer commit queue for background writes (analysis results, extraction cache,
+# image swaps). Worker threads hand over write intents instead of opening their own
+# connection; one writer thread applies whatever has queued up in a single transaction
+# (group commit), so there is one lock holder and one WAL sync per batch instead of per row.
+
+_STOP = object()
+
+class _WriteIntent:
+    __slots__ = ('function', 'args', 'future', 'queued_at')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+DB_WRITE_QUEUE_DEPTH.set_function(_queue.qsize)
+
+def _connect():
+    DB_CONNECTIONS_TOTAL.inc()
+    # Autocommit mode: the writer issues BEGIN/COMMIT itself
+    conn = sqlite3.connect(Config.DATABASE, factory=InstrumentedConnection, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    # In WAL mode NORMAL only syncs at checkpoints and stays durable across application crashes
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def _next_batch():
+    """Block for one intent, then gather more for up to DB_WRITE_MAX_LATENCY_MS / DB_WRITE_BATCH_SIZE"""
+    batch = [_queue.get()]
+    deadline = time.monotonic() + Config.DB_WRITE_MAX_LATENCY_MS / 1000
+    while len(batch) < Config.DB_WRITE_BATCH_SIZE and batch[-1] is not _STOP:
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(_queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _apply(conn, batch):
+    """Run a batch in one transaction; a failing intent is rolled back to its savepoint only"""
+    applied = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for intent in batch:
+            if not intent.future.set_running_or_notify_cancel():
+                continue
+            conn.execute('SAVEPOINT write_intent')
+            try:
+                result = intent.function(conn, *intent.args)
+            except Exception as e:
+                conn.execute('ROLLBACK TO write_intent')
+                conn.execute('RELEASE write_intent')
+                intent.future.set_exception(e)
+                continue
+            conn.execute('RELEASE write_intent')
+            applied.append((intent, result))
+        conn.execute('COMMIT')
+    except Exception as e:
+        print(f"Write batch of {len(batch)} failed: {e}")
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        # Nothing in the batch was committed, including intents that had already run
+        for intent in batch:
+            if not intent.future.done():
+                intent.future.set_exception(e)
+        return
+
+    DB_WRITE_BATCH_SIZE.observe(len(batch))
+    now = time.perf_counter()
+    for intent, result in applied:
+        DB_WRITE_LATENCY.observe(now - intent.queued_at)
+        intent.future.set_result(result)
+
+def _run():
+    conn = _connect()
+    try:
+        while True:
+            batch = _next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                _apply(conn, batch)
+            if stop:
+                return
+    finally:
+        conn.close()
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run, name='db-writer', daemon=True)
+            _writer.start()
+
+def submit_write(function, *args):
+    """Queue function(conn, *args) for the writer thread; returns a Future of its return value.
+
+    The function runs inside the writer's transaction and must not commit or close conn.
+    """
+    intent = _WriteIntent(function, args)
+    _ensure_writer()
+    _queue.put(intent)
+    return intent.future
+
+def shutdown_writer(timeout=10):
+    """Commit everything queued so far and stop the writer thread"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.is_alive():
+        _queue.put(_STOP)
+        writer.join(timeout)
+
+atexit.register(shutdown_writer)
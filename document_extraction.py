@@ -0,0 +1,283 @@
+import hashlib
+import json
+import multiprocessing
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+from models import get_read_connection
+from db_writer import submit_write
+from metrics import DOCUMENT_EXTRACTIONS_TOTAL, DOCUMENT_EXTRACTION_LATENCY
+
+# Optional extractors: pypdf for text PDFs, pytesseract + Pillow for scanned images.
+# Without them documents are left unextracted and the analysis falls back to estimates.
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+    Image = None
+
+# Only financial documents carry income/obligation figures worth extracting
+EXTRACTABLE_DOCUMENT_PREFIXES = ('Salary Slip', 'Form 16', 'Bank Statement')
+
+# Rupee amounts: comma-grouped or 4+ digits, not part of a date or account number
+_AMOUNT = r'(?:₹|rs\.?|inr)?\s*((?<![\d/.-])(?:\d{1,3}(?:,\d{2,3})+|\d{4,})(?:\.\d{1,2})?(?![\d/-]))'
+_NET_PAY = re.compile(r'(?:net\s+(?:pay|salary|amount)|take\s+home)[^\d₹\n]{0,40}' + _AMOUNT, re.IGNORECASE)
+_GROSS_PAY = re.compile(r'(?:gross\s+(?:salary|earnings|pay)|total\s+earnings)[^\d₹\n]{0,40}' + _AMOUNT, re.IGNORECASE)
+_ANNUAL_INCOME = re.compile(r'(?:gross\s+salary|gross\s+total\s+income|total\s+income)[^\d₹\n]{0,60}' + _AMOUNT,
+                            re.IGNORECASE)
+_OBLIGATION_LINE = re.compile(r'\b(?:emi|loan|nach|ecs|ach\s*d)\b', re.IGNORECASE)
+_SALARY_CREDIT_LINE = re.compile(r'\b(?:salary|sal\s*cr)\b', re.IGNORECASE)
+_ANY_AMOUNT = re.compile(_AMOUNT, re.IGNORECASE)
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.RLock()  # a done future runs its callback inline
+
+def is_extractable(document_type):
+    return document_type.startswith(EXTRACTABLE_DOCUMENT_PREFIXES)
+
+def extractor_installed(file_path):
+    """Whether the optional library that reads this file type is installed"""
+    if file_path.rsplit('.', 1)[-1].lower() == 'pdf':
+        return PdfReader is not None
+    return pytesseract is not None
+
+def file_content_hash(file_path):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _parse_amount(text):
+    return float(text.replace(',', ''))
+
+def _first_amount(pattern, text):
+    match = pattern.search(text)
+    return _parse_amount(match.group(1)) if match else None
+
+def _line_amounts(text, line_pattern):
+    """First amount on each line matching line_pattern (the transaction amount column)"""
+    amounts = []
+    for line in text.splitlines():
+        if line_pattern.search(line):
+            match = _ANY_AMOUNT.search(line)
+            if match:
+                amounts.append(_parse_amount(match.group(1)))
+    return amounts
+
+def extract_fields(document_type, text):
+    """Pull compact income/obligation figures out of extracted text"""
+    fields = {}
+    if document_type.startswith('Salary Slip'):
+        fields['net_pay'] = _first_amount(_NET_PAY, text)
+        fields['gross_pay'] = _first_amount(_GROSS_PAY, text)
+    elif document_type.startswith('Form 16'):
+        fields['annual_income'] = _first_amount(_ANNUAL_INCOME, text)
+    elif document_type.startswith('Bank Statement'):
+        obligations = _line_amounts(text, _OBLIGATION_LINE)
+        salary_credits = _line_amounts(text, _SALARY_CREDIT_LINE)
+        fields['emi_debits'] = round(sum(obligations), 2) if obligations else None
+        fields['salary_credit'] = max(salary_credits) if salary_credits else None
+    return {name: value for name, value in fields.items() if value is not None}
+
+def extract_document(file_path, document_type):
+    """Extract text and fields from one file. Runs in a worker process; no database access."""
+    extension = file_path.rsplit('.', 1)[-1].lower()
+    try:
+        if extension == 'pdf':
+            if PdfReader is None:
+                return {'extractor': None, 'text': '', 'fields': {}, 'error': 'pypdf not installed'}
+            reader = PdfReader(file_path)
+            text = '\n'.join(page.extract_text() or '' for page in reader.pages)
+            extractor = 'pypdf'
+        else:
+            if pytesseract is None:
+                return {'extractor': None, 'text': '', 'fields': {}, 'error': 'pytesseract/Pillow not installed'}
+            with Image.open(file_path) as image:
+                text = pytesseract.image_to_string(image)
+            extractor = 'tesseract'
+    except Exception as e:
+        return {'extractor': 'failed', 'text': '', 'fields': {}, 'error': str(e)}
+
+    text = text[:Config.EXTRACTION_MAX_TEXT_CHARS]
+    return {'extractor': extractor, 'text': text, 'fields': extract_fields(document_type, text), 'error': None}
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded web server can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=Config.EXTRACTION_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_pool():
+    """Drop a broken pool so the next extraction starts fresh workers"""
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def get_cached_extraction(content_hash):
+    conn = get_read_connection()
+    row = conn.execute('SELECT * FROM document_extractions WHERE content_hash = ?', (content_hash,)).fetchone()
+    conn.close()
+    return row
+
+def _write_extraction(conn, content_hash, document_type, result):
+    conn.execute('''
+        INSERT OR REPLACE INTO document_extractions
+        (content_hash, document_type, extracted_text, fields, extractor, error)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (content_hash, document_type, result['text'], json.dumps(result['fields']),
+          result['extractor'], result['error']))
+
+def _store_extraction(content_hash, document_type, start, future):
+    """Done-callback: cache the worker's result under the content hash"""
+    with _in_flight_lock:
+        _in_flight.pop(content_hash, None)
+    DOCUMENT_EXTRACTION_LATENCY.observe(time.perf_counter() - start)
+
+    try:
+        result = future.result()
+    except Exception as e:
+        # Worker crash or pool shutdown says nothing about the file, so nothing is cached
+        DOCUMENT_EXTRACTIONS_TOTAL.inc('failed')
+        print(f"Extraction of {content_hash[:12]} failed: {e}")
+        if isinstance(e, BrokenProcessPool):
+            _reset_pool()
+        return
+
+    if result['extractor'] is None:
+        # Missing optional dependency: leave uncached so installing it takes effect
+        DOCUMENT_EXTRACTIONS_TOTAL.inc('unsupported')
+        return
+
+    DOCUMENT_EXTRACTIONS_TOTAL.inc('failed' if result['error'] else 'extracted')
+    try:
+        # Wait for the commit: on_complete callbacks (the analysis) read this row next
+        submit_write(_write_extraction, content_hash, document_type, result).result()
+    except Exception as e:
+        print(f"Failed to cache extraction {content_hash[:12]}: {e}")
+
+def _submit_extraction(file_path, content_hash, document_type):
+    """Future for an extraction, or None when the content is already cached"""
+    if get_cached_extraction(content_hash) is not None:
+        DOCUMENT_EXTRACTIONS_TOTAL.inc('cached')
+        return None
+
+    with _in_flight_lock:
+        # The same content uploaded twice shares one extraction
+        future = _in_flight.get(content_hash)
+        if future is not None:
+            return future
+        start = time.perf_counter()
+        future = _get_pool().submit(extract_document, file_path, document_type)
+        _in_flight[content_hash] = future
+        # Registered before anyone else can see the future, so the cache is written first
+        future.add_done_callback(lambda done: _store_extraction(content_hash, document_type, start, done))
+    return future
+
+def queue_extractions(documents, on_complete=None):
+    """Extract (file_path, content_hash, document_type) documents off the request path.
+
+    on_complete runs once every extraction is cached (immediately if nothing needed extracting).
+    """
+    futures = []
+    for file_path, content_hash, document_type in documents:
+        if not is_extractable(document_type):
+            continue
+        if not extractor_installed(file_path):
+            # Checked before submitting, so a missing library never starts the worker pool
+            DOCUMENT_EXTRACTIONS_TOTAL.inc('unsupported')
+            continue
+        try:
+            future = _submit_extraction(file_path, content_hash, document_type)
+        except Exception as e:
+            print(f"Failed to queue extraction for {file_path}: {e}")
+            continue
+        if future is not None:
+            futures.append(future)
+
+    if on_complete is None:
+        return
+    if not futures:
+        on_complete()
+        return
+
+    remaining = [len(futures)]
+    remaining_lock = threading.Lock()
+
+    def extraction_done(_):
+        with remaining_lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            on_complete()
+
+    for future in futures:
+        future.add_done_callback(extraction_done)
+
+def summarize_extracted_financials(uploaded_documents):
+    """Compact monthly income/obligation figures from a user's cached extractions"""
+    hashes = {doc['content_hash']: doc['document_type'] for doc in uploaded_documents
+              if 'content_hash' in doc.keys() and doc['content_hash'] and is_extractable(doc['document_type'])}
+    if not hashes:
+        return {}
+
+    conn = get_read_connection()
+    rows = conn.execute(
+        f"SELECT content_hash, fields FROM document_extractions WHERE content_hash IN ({','.join('?' * len(hashes))})",
+        list(hashes)
+    ).fetchall()
+    conn.close()
+    return _summarize_fields([row['fields'] for row in rows])
+
+def extracted_financials_by_user():
+    """summarize_extracted_financials for every user with extracted documents, in one query"""
+    conn = get_read_connection()
+    rows = conn.execute('''
+        SELECT ud.user_id, ud.document_type, de.content_hash, de.fields
+        FROM user_documents ud JOIN document_extractions de ON de.content_hash = ud.content_hash
+    ''').fetchall()
+    conn.close()
+
+    fields_by_user = {}
+    for row in rows:
+        if is_extractable(row['document_type']):
+            fields_by_user.setdefault(row['user_id'], {})[row['content_hash']] = row['fields']
+    summaries = {user_id: _summarize_fields(list(fields.values())) for user_id, fields in fields_by_user.items()}
+    return {user_id: summary for user_id, summary in summaries.items() if summary}
+
+def _summarize_fields(field_jsons):
+    if not field_jsons:
+        return {}
+
+    values = {}
+    for fields in field_jsons:
+        for name, value in json.loads(fields or '{}').items():
+            values.setdefault(name, []).append(value)
+
+    def median(name):
+        return round(statistics.median(values[name]), 2) if name in values else None
+
+    annual_income = median('annual_income')
+    summary = {
+        'net_monthly_income': median('net_pay') or median('salary_credit'),
+        'gross_monthly_income': median('gross_pay') or (round(annual_income / 12, 2) if annual_income else None),
+        'monthly_obligations': median('emi_debits'),
+        'documents_read': len(field_jsons)
+    }
+    return {name: value for name, value in summary.items() if value is not None}
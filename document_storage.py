@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+from flask import Request, flash, redirect, request, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import Config
+
+# Content-addressed document store: each distinct file is kept once at
+# <DOCUMENT_STORE_FOLDER>/<aa>/<bb>/<sha256>.<ext> and reference-counted in document_blobs.
+# Uploads are hashed and size-checked while werkzeug parses the request, so a file is
+# never buffered and then re-read just to hash it.
+
+# Endpoints whose file uploads stream straight into the store's spool
+STREAMED_UPLOAD_ENDPOINTS = {'upload_documents'}
+
+class DocumentTooLarge(RequestEntityTooLarge):
+    description = 'Document exceeds the maximum upload size'
+
+class HashingSpool:
+    """Writable upload target that hashes and counts bytes as werkzeug writes them"""
+
+    def __init__(self, max_size):
+        os.makedirs(_spool_folder(), exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=_spool_folder(), suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            # Abort mid-stream; the rest of the body is never written to disk
+            self.close()
+            raise DocumentTooLarge()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read/readline/seek/tell/flush for werkzeug's FileStorage
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """Request whose document uploads land in a HashingSpool instead of a plain temp file"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in STREAMED_UPLOAD_ENDPOINTS:
+            spool = HashingSpool(Config.MAX_DOCUMENT_SIZE)
+            # Tracked so spools of an aborted or unsaved upload are removed at teardown
+            self.__dict__.setdefault('upload_spools', []).append(spool)
+            return spool
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+def _spool_folder():
+    return os.path.join(Config.DOCUMENT_STORE_FOLDER, 'tmp')
+
+def blob_path(content_hash, extension):
+    """Sharded location of a stored document"""
+    return os.path.join(Config.DOCUMENT_STORE_FOLDER, content_hash[:2], content_hash[2:4],
+                        f"{content_hash}.{extension}")
+
+def thumbnail_path(content_hash):
+    """Where image_processing files the JPEG thumbnail of a blob"""
+    return os.path.join(Config.DOCUMENT_STORE_FOLDER, 'thumbs', content_hash[:2], f"{content_hash}.jpg")
+
+def _spool_from_stream(stream):
+    """Chunked copy + hash for uploads that did not arrive through UploadRequest"""
+    spool = HashingSpool(Config.MAX_DOCUMENT_SIZE)
+    try:
+        for chunk in iter(lambda: stream.read(Config.DOWNLOAD_CHUNK_SIZE), b''):
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+def store_upload(file_storage, extension):
+    """Hash an uploaded file into a spool; returns (content_hash, file_path, file_size, spool).
+
+    The spool is filed at file_path by add_reference, inside the caller's transaction.
+    """
+    return store_stream(file_storage.stream, extension)
+
+def store_stream(stream, extension):
+    """store_upload for any readable stream (e.g. a ZIP member), hashed and size-checked in chunks"""
+    spool = stream
+    if not isinstance(spool, HashingSpool):
+        spool = _spool_from_stream(stream)
+
+    spool.flush()
+    content_hash = spool.hexdigest()
+    return content_hash, blob_path(content_hash, extension), spool.size, spool
+
+def add_reference(conn, content_hash, file_path, file_size, spool):
+    """Count one more user_documents row pointing at a blob and make sure its file exists (caller commits).
+
+    The file is placed after this function's first write, so the connection holds the
+    database write lock: a delete_document that removed the last reference (it removes
+    files before committing) has either finished, or waits until this commits.
+    Identical content is stored once; a duplicate upload only discards its spool.
+    """
+    conn.execute('''
+        INSERT OR IGNORE INTO document_blobs (content_hash, file_path, file_size, ref_count)
+        VALUES (?, ?, ?, 0)
+    ''', (content_hash, file_path, file_size))
+    conn.execute('UPDATE document_blobs SET ref_count = ref_count + 1 WHERE content_hash = ?', (content_hash,))
+    if os.path.exists(file_path):
+        spool.close()
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        spool._file.close()
+        os.replace(spool.path, file_path)
+
+def release_reference(conn, content_hash):
+    """Drop one reference; returns the files to delete once nothing uses the blob.
+    The caller removes them before committing, while it still holds the write lock."""
+    conn.execute('UPDATE document_blobs SET ref_count = ref_count - 1 WHERE content_hash = ?', (content_hash,))
+    blob = conn.execute('SELECT file_path, original_path, ref_count FROM document_blobs WHERE content_hash = ?',
+                        (content_hash,)).fetchone()
+    if blob is None or blob['ref_count'] > 0:
+        return []
+    conn.execute('DELETE FROM document_blobs WHERE content_hash = ?', (content_hash,))
+    # Kept originals of normalised images and the thumbnail go with the blob
+    return [path for path in (blob['file_path'], blob['original_path'], thumbnail_path(content_hash)) if path]
+
+def init_document_storage(app):
+    """Stream document uploads into the store and turn oversize uploads into a flash message"""
+    app.request_class = UploadRequest
+    os.makedirs(_spool_folder(), exist_ok=True)
+
+    @app.teardown_request
+    def remove_upload_spools(exception=None):
+        for spool in request.__dict__.get('upload_spools', []):
+            spool.close()
+
+    @app.errorhandler(DocumentTooLarge)
+    def document_too_large(error):
+        flash(f'Each document must be under {Config.MAX_DOCUMENT_SIZE // (1024 * 1024)}MB.', 'error')
+        user_id = (request.view_args or {}).get('user_id')
+        if user_id is not None:
+            return redirect(url_for('upload_documents', user_id=user_id))
+        return redirect(url_for('all_users'))
@@ -0,0 +1,154 @@
+import json
+import re
+from difflib import SequenceMatcher
+from config import Config
+
+# Probable duplicate applicants (same person, new email). Every user gets blocking keys:
+#   m:<mobile>                       normalised 10-digit mobile
+#   n:<soundex name>|<soundex mother> phonetic applicant name plus mother's name
+#   a:<pincode>|<token>              property pincode plus each property address token
+# A new user is scored only against users sharing a key, so the work per insert depends
+# on block sizes, not on the number of users. Blocks larger than
+# Config.DUPLICATE_MAX_BLOCK_SIZE (e.g. a whole locality) are too common to mean anything
+# and are skipped. Pairs scoring at least Config.DUPLICATE_SCORE_THRESHOLD are stored in
+# user_duplicates in both directions.
+
+_HONORIFICS = {'mr', 'mrs', 'ms', 'miss', 'dr', 'shri', 'smt', 'kumari', 'late'}
+_ADDRESS_STOPWORDS = {
+    'road', 'rd', 'nagar', 'flat', 'plot', 'house', 'no', 'near', 'opp', 'street', 'st', 'lane',
+    'society', 'soc', 'apartment', 'apartments', 'apt', 'building', 'bldg', 'sector', 'floor', 'the', 'and'
+}
+_SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ['', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters}
+
+# Score weights (sum to 1)
+_MOBILE_WEIGHT = 0.40
+_NAME_WEIGHT = 0.25
+_MOTHER_WEIGHT = 0.15
+_ADDRESS_WEIGHT = 0.20
+
+# Columns the scorer reads (from users_full)
+DUPLICATE_FIELDS = ['applicant_name', 'applicant_mother_name', 'mobile_no', 'property_pincode', 'property_address']
+
+def normalize_mobile(mobile):
+    """Last 10 digits of an Indian mobile ("+91 98765-43210" -> "9876543210"), or None"""
+    digits = re.sub(r'\D', '', str(mobile or ''))
+    return digits[-10:] if len(digits) >= 10 else None
+
+def normalize_name(name):
+    tokens = re.sub(r'[^a-z ]', ' ', str(name or '').lower()).split()
+    return ' '.join(token for token in tokens if token not in _HONORIFICS)
+
+def soundex(word):
+    """American Soundex code of a word ("Robert" -> "R163")"""
+    word = re.sub(r'[^a-z]', '', word.lower())
+    if not word:
+        return ''
+    code = word[0].upper()
+    previous = _SOUNDEX_CODES.get(word[0], '')
+    for letter in word[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+def _phonetic_name(name):
+    # First and last name only: middle names and initials come and go between applications
+    tokens = normalize_name(name).split()
+    if not tokens:
+        return ''
+    return soundex(tokens[0]) + (soundex(tokens[-1]) if len(tokens) > 1 else '')
+
+def address_tokens(address):
+    tokens = re.findall(r'[a-z0-9]+', str(address or '').lower())
+    return {token for token in tokens if token not in _ADDRESS_STOPWORDS and (len(token) >= 3 or token.isdigit())}
+
+def blocking_keys(user):
+    """Blocking keys of a user dict/row with DUPLICATE_FIELDS"""
+    keys = set()
+    mobile = normalize_mobile(user['mobile_no'])
+    if mobile:
+        keys.add(f'm:{mobile}')
+    name, mother = _phonetic_name(user['applicant_name']), _phonetic_name(user['applicant_mother_name'])
+    if name and mother:
+        keys.add(f'n:{name}|{mother}')
+    pincode = re.sub(r'\D', '', str(user['property_pincode'] or ''))
+    if pincode:
+        keys.update(f'a:{pincode}|{token}' for token in address_tokens(user['property_address']))
+    return keys
+
+def _similarity(first, second):
+    first, second = normalize_name(first), normalize_name(second)
+    if not first or not second:
+        return 0.0
+    # Token order differs between forms ("Sharma Rahul"), so compare sorted tokens too
+    return max(SequenceMatcher(None, first, second).ratio(),
+               SequenceMatcher(None, ' '.join(sorted(first.split())), ' '.join(sorted(second.split()))).ratio())
+
+def duplicate_score(user, other, minimum=0.0):
+    """(score 0..1, reasons) for two applicants; stops early once the score cannot reach minimum"""
+    score, reasons = 0.0, []
+    mobile = normalize_mobile(user['mobile_no'])
+    if mobile and mobile == normalize_mobile(other['mobile_no']):
+        score += _MOBILE_WEIGHT
+        reasons.append('same mobile')
+    pincode = re.sub(r'\D', '', str(user['property_pincode'] or ''))
+    if pincode and pincode == re.sub(r'\D', '', str(other['property_pincode'] or '')):
+        tokens, other_tokens = address_tokens(user['property_address']), address_tokens(other['property_address'])
+        overlap = len(tokens & other_tokens) / len(tokens | other_tokens) if tokens and other_tokens else 0.0
+        score += _ADDRESS_WEIGHT * overlap
+        reasons.append(f'same property pincode, address {overlap:.0%} similar')
+    # Name comparisons are the expensive part; most block members are ruled out before them
+    if score + _NAME_WEIGHT + _MOTHER_WEIGHT < minimum:
+        return round(score, 3), reasons
+    name = _similarity(user['applicant_name'], other['applicant_name'])
+    if name:
+        score += _NAME_WEIGHT * name
+        reasons.append(f'name {name:.0%} similar')
+    mother = _similarity(user['applicant_mother_name'], other['applicant_mother_name'])
+    if mother:
+        score += _MOTHER_WEIGHT * mother
+        reasons.append(f"mother's name {mother:.0%} similar")
+    return round(score, 3), reasons
+
+def index_user_duplicates(conn, user_id, user):
+    """Add a user's blocking keys and record probable duplicates among block members (caller commits)"""
+    keys = sorted(blocking_keys(user))
+    if not keys:
+        return []
+    placeholders = ','.join('?' * len(keys))
+    usable = [row['key'] for row in conn.execute(f'''
+        SELECT key FROM user_blocking_keys WHERE key IN ({placeholders})
+        GROUP BY key HAVING COUNT(*) < ?
+    ''', keys + [Config.DUPLICATE_MAX_BLOCK_SIZE])]
+    conn.executemany('INSERT OR IGNORE INTO user_blocking_keys (key, user_id) VALUES (?, ?)',
+                     [(key, user_id) for key in keys])
+    if not usable:
+        return []
+
+    candidates = conn.execute(f'''
+        SELECT id, {', '.join(DUPLICATE_FIELDS)} FROM users_full
+        WHERE id IN (SELECT user_id FROM user_blocking_keys WHERE key IN ({','.join('?' * len(usable))}))
+          AND id != ?
+    ''', usable + [user_id]).fetchall()
+
+    found = []
+    for candidate in candidates:
+        score, reasons = duplicate_score(user, candidate, Config.DUPLICATE_SCORE_THRESHOLD)
+        if score >= Config.DUPLICATE_SCORE_THRESHOLD:
+            found.append((candidate['id'], score))
+            reasons = json.dumps(reasons)
+            conn.executemany('''
+                INSERT OR REPLACE INTO user_duplicates (user_id, duplicate_user_id, score, reasons)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, candidate['id'], score, reasons), (candidate['id'], user_id, score, reasons)])
+    return found
+
+def backfill_duplicate_index(conn):
+    """Index every existing user in id order, as if each had just been inserted (caller commits)"""
+    users = conn.execute(f"SELECT id, {', '.join(DUPLICATE_FIELDS)} FROM users_full ORDER BY id").fetchall()
+    for user in users:
+        index_user_duplicates(conn, user['id'], user)
+    print(f"Indexed {len(users)} users for duplicate detection")
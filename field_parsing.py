@@ -0,0 +1,52 @@
+import re
+
+# Parsers for the free-text applicant fields that rules and filters need as numbers.
+# They run once when a user is written; the results live in typed users columns
+# (job_since_year, total_experience_years, carpet_area_sqft).
+
+_EXPERIENCE_YEARS = re.compile(r'(\d+)\s*(years|yrs)')
+_AREA = re.compile(r'(\d[\d,]*(?:\.\d+)?)\s*(sq(?:uare)?\.?\s*(?:ft|feet|foot|m|mt|mtr|met(?:er|re)s?|yd|yards?)'
+                   r'|sqft|sqm|sqyd|m2|gaj)?')
+
+def _sqft_per_unit(unit):
+    if not unit or 'f' in unit:
+        return 1.0  # feet, the default
+    if 'y' in unit or unit == 'gaj':
+        return 9.0  # square yards / gaj
+    return 10.7639  # square metres
+
+def parse_job_since_year(job_since):
+    """Year the applicant joined ("2015", "01-06-2015"), or None if missing/unparseable"""
+    if not job_since:
+        return None
+    try:
+        return int(job_since.split('-')[-1]) if '-' in job_since else int(job_since)
+    except (ValueError, TypeError):
+        return None
+
+def parse_experience_years(total_experience):
+    """Whole years in "8 years" / "12 yrs", or None"""
+    if not total_experience:
+        return None
+    match = _EXPERIENCE_YEARS.search(str(total_experience).lower())
+    return int(match.group(1)) if match else None
+
+def parse_carpet_area_sqft(carpet_area):
+    """Carpet area in square feet ("1200 sq ft", "110 sq m", "1,050"), or None"""
+    if not carpet_area:
+        return None
+    matches = list(_AREA.finditer(str(carpet_area).lower()))
+    if not matches:
+        return None
+    # "2 BHK, 950 sq ft": the number that carries a unit is the area
+    match = next((match for match in matches if match.group(2)), matches[0])
+    value = float(match.group(1).replace(',', ''))
+    return round(value * _sqft_per_unit(match.group(2)), 1) if value else None
+
+def parsed_user_columns(user):
+    """Typed column values for a users row or form/Excel dict"""
+    return {
+        'job_since_year': parse_job_since_year(user.get('job_since')),
+        'total_experience_years': parse_experience_years(user.get('total_experience')),
+        'carpet_area_sqft': parse_carpet_area_sqft(user.get('property_carpet_area')),
+    }
@@ -0,0 +1,192 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from db_writer import submit_write
+from document_storage import blob_path, thumbnail_path
+from metrics import IMAGES_PROCESSED_TOTAL, IMAGE_BYTES_SAVED_TOTAL
+
+# Optional: Pillow. Without it images are stored exactly as uploaded and get no thumbnails.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+def _work_folder():
+    return os.path.join(Config.DOCUMENT_STORE_FOLDER, 'tmp')
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def process_image(source_path, work_folder, max_dimension, quality, thumbnail_size):
+    """Downscale/re-encode an image and render its thumbnail. Runs in a worker process."""
+    with Image.open(source_path) as original:
+        # Phone photos carry their rotation in EXIF; bake it in before dropping metadata
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if has_alpha:
+            extension, save_options = 'png', {'format': 'PNG', 'optimize': True}
+        else:
+            image = image.convert('RGB')
+            extension, save_options = 'jpg', {'format': 'JPEG', 'quality': quality, 'optimize': True,
+                                              'progressive': True}
+        fd, normalized_path = tempfile.mkstemp(dir=work_folder, suffix=f'.{extension}')
+        with os.fdopen(fd, 'wb') as output:
+            image.save(output, **save_options)
+
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+        fd, thumbnail_file = tempfile.mkstemp(dir=work_folder, suffix='.jpg')
+        with os.fdopen(fd, 'wb') as output:
+            thumbnail.save(output, format='JPEG', quality=75, optimize=True)
+
+    return {
+        'normalized_path': normalized_path,
+        'normalized_hash': _hash_file(normalized_path),
+        'normalized_size': os.path.getsize(normalized_path),
+        'extension': extension,
+        'thumbnail_path': thumbnail_file
+    }
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=Config.IMAGE_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _place_thumbnail(temp_path, content_hash):
+    target = thumbnail_path(content_hash)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(temp_path, target)
+
+def _swap_blob(conn, old_hash, new_hash, normalized_path, new_size, extension, source_path, original_path):
+    """Point every document using old_hash at the normalised blob (runs on the writer thread).
+
+    Files are moved last, inside the write transaction, so an upload or delete of
+    either blob cannot run between the row changes and the file changes.
+    Returns False when every document using old_hash was deleted meanwhile.
+    """
+    old_blob = conn.execute('SELECT * FROM document_blobs WHERE content_hash = ?', (old_hash,)).fetchone()
+    if old_blob is None:
+        return False
+    new_path = blob_path(new_hash, extension)
+    conn.execute('''
+        INSERT OR IGNORE INTO document_blobs (content_hash, file_path, file_size, ref_count, original_path)
+        VALUES (?, ?, ?, 0, ?)
+    ''', (new_hash, new_path, new_size, original_path))
+    conn.execute('UPDATE document_blobs SET ref_count = ref_count + ? WHERE content_hash = ?',
+                 (old_blob['ref_count'], new_hash))
+    # Keep the visible name in step with the new format (scan.png -> scan.jpg)
+    conn.execute('''
+        UPDATE user_documents
+        SET content_hash = ?, file_path = ?, file_size = ?,
+            file_name = CASE WHEN instr(file_name, '.') > 0
+                             THEN rtrim(file_name, replace(file_name, '.', '')) || ?
+                             ELSE file_name END
+        WHERE content_hash = ?
+    ''', (new_hash, new_path, new_size, extension, old_hash))
+    # Anything already read from the original still applies to the re-encoded copy
+    conn.execute('''
+        INSERT OR IGNORE INTO document_extractions
+            (content_hash, document_type, extracted_text, fields, extractor, error, extracted_at)
+        SELECT ?, document_type, extracted_text, fields, extractor, error, extracted_at
+        FROM document_extractions WHERE content_hash = ?
+    ''', (new_hash, old_hash))
+    conn.execute('DELETE FROM document_blobs WHERE content_hash = ?', (old_hash,))
+
+    if os.path.exists(new_path):
+        os.remove(normalized_path)
+    else:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(normalized_path, new_path)
+    if original_path:
+        os.makedirs(os.path.dirname(original_path), exist_ok=True)
+        os.replace(source_path, original_path)
+    elif os.path.exists(source_path):
+        os.remove(source_path)
+    return True
+
+def _finish(content_hash, source_path, future):
+    """Done-callback: adopt the normalised image if it is smaller, file the thumbnail"""
+    with _in_flight_lock:
+        _in_flight.discard(content_hash)
+
+    try:
+        result = future.result()
+    except Exception as e:
+        IMAGES_PROCESSED_TOTAL.inc('failed')
+        print(f"Image processing failed for {content_hash[:12]}: {e}")
+        return
+
+    original_size = os.path.getsize(source_path) if os.path.exists(source_path) else 0
+    if result['normalized_size'] >= original_size or result['normalized_hash'] == content_hash:
+        # Already as small as it gets: keep the upload, only add the thumbnail
+        os.remove(result['normalized_path'])
+        _place_thumbnail(result['thumbnail_path'], content_hash)
+        IMAGES_PROCESSED_TOTAL.inc('kept')
+        return
+
+    original_path = None
+    if Config.KEEP_ORIGINAL_IMAGES:
+        original_path = os.path.join(Config.DOCUMENT_STORE_FOLDER, 'originals', os.path.basename(source_path))
+
+    try:
+        swapped = submit_write(_swap_blob, content_hash, result['normalized_hash'], result['normalized_path'],
+                               result['normalized_size'], result['extension'], source_path, original_path).result()
+    except Exception as e:
+        swapped = None
+        IMAGES_PROCESSED_TOTAL.inc('failed')
+        print(f"Failed to swap normalised image {content_hash[:12]}: {e}")
+    if not swapped:
+        if os.path.exists(result['normalized_path']):
+            os.remove(result['normalized_path'])
+        os.remove(result['thumbnail_path'])
+        if swapped is False:
+            # Every document using it was deleted while we worked
+            IMAGES_PROCESSED_TOTAL.inc('orphaned')
+        return
+
+    _place_thumbnail(result['thumbnail_path'], result['normalized_hash'])
+    IMAGES_PROCESSED_TOTAL.inc('normalized')
+    IMAGE_BYTES_SAVED_TOTAL.inc(amount=original_size - result['normalized_size'])
+
+def queue_image_processing(documents):
+    """Normalise and thumbnail the JPG/PNG blobs among (file_path, content_hash, document_type) tuples"""
+    if Image is None:
+        return
+    for file_path, content_hash, _ in documents:
+        if file_path.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        with _in_flight_lock:
+            if content_hash in _in_flight:
+                continue
+            _in_flight.add(content_hash)
+        try:
+            future = _get_pool().submit(process_image, file_path, _work_folder(), Config.IMAGE_MAX_DIMENSION,
+                                        Config.IMAGE_JPEG_QUALITY, Config.THUMBNAIL_SIZE)
+        except Exception as e:
+            with _in_flight_lock:
+                _in_flight.discard(content_hash)
+            print(f"Failed to queue image processing for {file_path}: {e}")
+            continue
+        future.add_done_callback(lambda done, content_hash=content_hash, file_path=file_path:
+                                 _finish(content_hash, file_path, done))
@@ -0,0 +1,374 @@
+"""
+HTTP load-testing harness for the loan management app.
+
+Seed a database and document folder, start the app against them with the fake AI
+backend, then drive concurrent traffic and print latency percentiles per route:
+
+    export DATABASE_PATH=loadtest.db DOCUMENT_UPLOAD_FOLDER=loadtest_documents
+    python load_test.py seed --users 500
+    USE_MOCK_AI=true flask --app app run --port 5000
+    python load_test.py run --scenario mixed --concurrency 16 --duration 60 \\
+        --report loadtest_report.json
+
+Lock contention is read from the server's db_lock_errors_total counter on /metrics.
+"""
+import argparse
+import io
+import json
+import os
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+
+from config import Config
+
+LOCK_ERROR_MARKER = b'database is locked'
+# base.html renders flash(..., 'error') as alert-danger; routes catch most failures and flash them
+ERROR_FLASH_MARKER = b'alert-danger'
+
+# Flask endpoint -> route label, for attributing server-side lock counters
+ENDPOINT_ROUTES = {
+    'dashboard': '/',
+    'all_users': '/all_users',
+    'view_user': '/user/<id>',
+    'upload_excel': '/upload_excel',
+    'upload_documents': '/user/<id>/upload_documents',
+}
+
+PROPERTY_TYPES = ['Flat', 'Villa', 'Plot', 'Row House', 'Commercial']
+DESIGNATIONS = ['Software Engineer', 'Manager', 'Accountant', 'Teacher', 'Business Owner', 'Proprietor']
+DEPARTMENTS = ['IT', 'Finance', 'Operations', 'Education', 'Business']
+DOCUMENT_TYPES = ['Aadhar Card', 'PAN Card', 'Salary Slip 1', 'Salary Slip 2', 'Salary Slip 3',
+                  'Form 16 Part A', 'Bank Statement 1', 'Bank Statement 2']
+
+# A minimal but well-formed PDF used for document uploads
+SAMPLE_PDF = (b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+              b'2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n')
+
+# Scenario scripts: (route label, weight) pairs picked at random by each virtual user
+SCENARIOS = {
+    'browse': [('/', 2), ('/all_users', 3), ('/user/<id>', 5)],
+    'upload': [('/upload_excel', 1), ('/user/<id>/upload_documents', 3), ('/user/<id>', 2)],
+    'mixed': [('/', 2), ('/all_users', 2), ('/user/<id>', 5),
+              ('/upload_excel', 1), ('/user/<id>/upload_documents', 2)],
+}
+
+def build_user_row(rng, index):
+    """Generate one realistic applicant record"""
+    designation = rng.choice(DESIGNATIONS)
+    loan_amount = rng.randrange(500000, 15000000, 50000)
+    return {
+        'applicant_name': f'Applicant {index}',
+        'applicant_mother_name': f'Mother {index}',
+        'current_address': f'{rng.randint(1, 999)} MG Road, Pune',
+        'mobile_no': f'9{rng.randint(100000000, 999999999)}',
+        'email_id': f'applicant{index}.{uuid.uuid4().hex[:8]}@example.com',
+        'qualification': rng.choice(['B.Tech', 'MBA', 'B.Com', 'M.Sc']),
+        'office_address': f'{rng.randint(1, 99)} Business Park, Pune',
+        'job_since': f'01-{rng.randint(1, 12):02d}-{rng.randint(2005, 2024)}',
+        'total_experience': f'{rng.randint(1, 30)} years',
+        'department': rng.choice(DEPARTMENTS),
+        'designation': designation,
+        'loan_amount': float(loan_amount),
+        'tenure': rng.choice([60, 120, 180, 240, 300, 360]),
+        'property_address': f'Plot {rng.randint(1, 500)}, Baner, Pune',
+        'property_type': rng.choice(PROPERTY_TYPES),
+        'property_pincode': str(rng.randint(411001, 411060)),
+        'property_carpet_area': f'{rng.randint(450, 2500)} sq ft',
+        'sale_deed_amount': float(loan_amount) / rng.uniform(0.5, 0.9),
+        'has_co_applicant': rng.random() < 0.3,
+    }
+
+def seed_database(num_users, seed=42):
+    """Populate Config.DATABASE and Config.DOCUMENT_UPLOAD_FOLDER with applicants and documents"""
+    from models import init_db, get_db_connection, insert_user
+    from completeness import refresh_completeness
+    from field_parsing import parsed_user_columns
+
+    init_db()
+    rng = random.Random(seed)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    user_ids = []
+
+    for index in range(num_users):
+        row = build_user_row(rng, index)
+        row.update(parsed_user_columns(row))
+        user_id = insert_user(conn, row)
+        user_ids.append(user_id)
+
+        user_folder = os.path.join(Config.DOCUMENT_UPLOAD_FOLDER, str(user_id))
+        os.makedirs(user_folder, exist_ok=True)
+        for doc_type in rng.sample(DOCUMENT_TYPES, rng.randint(0, len(DOCUMENT_TYPES))):
+            file_path = os.path.join(user_folder, f"{user_id}_{doc_type.replace(' ', '_')}_seed.pdf")
+            with open(file_path, 'wb') as f:
+                f.write(SAMPLE_PDF)
+            cursor.execute('''
+                INSERT INTO user_documents (user_id, document_type, file_name, file_path, file_size)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, doc_type, os.path.basename(file_path), file_path, len(SAMPLE_PDF)))
+
+    refresh_completeness(conn, user_ids)
+    conn.commit()
+    conn.close()
+    print(f"Seeded {num_users} users into {Config.DATABASE} (documents in {Config.DOCUMENT_UPLOAD_FOLDER})")
+
+def load_user_ids():
+    """Read existing user ids from the seeded database"""
+    from models import get_db_connection
+
+    conn = get_db_connection()
+    user_ids = [row['id'] for row in conn.execute('SELECT id FROM users')]
+    conn.close()
+    return user_ids
+
+def build_excel_payload(rng, rows=5):
+    """Build an in-memory .xlsx with unique applicants for /upload_excel"""
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Applicant Name', 'Email ID', 'Mobile No', 'Loan Amount', 'Tenure', 'Type', 'Sale Deed Amount'])
+    for _ in range(rows):
+        row = build_user_row(rng, rng.randint(0, 10 ** 6))
+        sheet.append([row['applicant_name'], row['email_id'], row['mobile_no'], row['loan_amount'],
+                      row['tenure'], row['property_type'], row['sale_deed_amount']])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def encode_multipart(fields, files):
+    """Encode form fields and (field, filename, content, content_type) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields:
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content, content_type in files:
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: {content_type}\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Surface redirects to the caller so the POST and its follow-up GET are timed separately"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class LoadTestRecorder:
+    """Thread-safe collector of per-route samples"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_errors = defaultdict(int)
+
+    def record(self, route, latency, ok, lock_error):
+        with self.lock:
+            self.samples[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+            if lock_error:
+                self.lock_errors[route] += 1
+
+class VirtualUser(threading.Thread):
+    """Runs scenario steps in a loop until the deadline"""
+
+    def __init__(self, base_url, scenario, user_ids, recorder, deadline, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.routes = [route for route, _ in scenario]
+        self.weights = [weight for _, weight in scenario]
+        self.user_ids = user_ids
+        self.recorder = recorder
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def request(self, route, path, data=None, content_type=None):
+        """Issue one request, follow a redirect like a browser would, and record both hops"""
+        req = urllib.request.Request(self.base_url + path, data=data)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=120) as response:
+                status, body, location = response.status, response.read(), None
+        except urllib.error.HTTPError as e:
+            status, body, location = e.code, e.read(), e.headers.get('Location')
+        except (urllib.error.URLError, OSError):
+            status, body, location = 0, b'', None
+        latency = time.perf_counter() - start
+
+        lock_error = LOCK_ERROR_MARKER in body
+        failed = ERROR_FLASH_MARKER in body
+        if location and status in (301, 302, 303):
+            split = urllib.parse.urlsplit(location)
+            follow_path = split.path + (f'?{split.query}' if split.query else '')
+            follow_body = self.request(self.label_for(follow_path), follow_path)
+            # The outcome of a POST is only visible in the flash on the page it redirects to
+            lock_error = lock_error or LOCK_ERROR_MARKER in follow_body
+            failed = failed or ERROR_FLASH_MARKER in follow_body
+
+        ok = 200 <= status < 400 and not lock_error and not failed
+        self.recorder.record(route, latency, ok, lock_error)
+        return body
+
+    def label_for(self, path):
+        """Collapse concrete paths into route labels"""
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        if parts and parts[0] == 'user' and len(parts) >= 2:
+            parts[1] = '<id>'
+        return '/' + '/'.join(parts)
+
+    def run_step(self, route):
+        user_id = self.rng.choice(self.user_ids) if self.user_ids else 1
+        if route == '/upload_excel':
+            body, content_type = encode_multipart([], [(
+                'file', 'applicants.xlsx', build_excel_payload(self.rng),
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')])
+            self.request(route, '/upload_excel', body, content_type)
+        elif route == '/user/<id>/upload_documents':
+            doc_type = self.rng.choice(DOCUMENT_TYPES)
+            body, content_type = encode_multipart(
+                [('document_types', doc_type)],
+                [('documents', f"{doc_type.replace(' ', '_').lower()}.pdf", SAMPLE_PDF, 'application/pdf')])
+            self.request(route, f'/user/{user_id}/upload_documents', body, content_type)
+        else:
+            self.request(route, route.replace('<id>', str(user_id)))
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.run_step(self.rng.choices(self.routes, weights=self.weights)[0])
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def fetch_lock_errors(base_url):
+    """Read db_lock_errors_total per endpoint from /metrics, or None if unavailable"""
+    try:
+        with urllib.request.urlopen(base_url.rstrip('/') + '/metrics', timeout=10) as response:
+            text = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return None
+
+    counts = {}
+    for line in text.splitlines():
+        if line.startswith('db_lock_errors_total{'):
+            labels, value = line.rsplit(' ', 1)
+            endpoint = labels.split('endpoint="', 1)[1].split('"', 1)[0]
+            counts[endpoint] = float(value)
+    return counts
+
+def build_report(recorder, elapsed, lock_errors=None):
+    """Summarise throughput, latency percentiles, error rate and lock contention per route
+
+    lock_errors maps Flask endpoints to server-side lock error counts for the run; when
+    given it replaces the lock errors the client could spot in response bodies.
+    """
+    report = {}
+    if lock_errors is not None:
+        server_locks = defaultdict(int)
+        for endpoint, count in lock_errors.items():
+            server_locks[ENDPOINT_ROUTES.get(endpoint, f'({endpoint})')] += int(count)
+    for route, latencies in sorted(recorder.samples.items()):
+        latencies = sorted(latencies)
+        count = len(latencies)
+        report[route] = {
+            'requests': count,
+            'throughput_rps': round(count / elapsed, 2) if elapsed else 0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1),
+            'error_rate': round(recorder.errors[route] / count, 4),
+            'lock_contention': server_locks.pop(route, 0) if lock_errors is not None else recorder.lock_errors[route],
+        }
+    # Lock errors outside the routes we drove, e.g. background analysis writes
+    if lock_errors is not None:
+        for route, count in server_locks.items():
+            if count:
+                report[route] = {'requests': 0, 'throughput_rps': 0, 'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0,
+                                 'max_ms': 0, 'error_rate': 0, 'lock_contention': count}
+    return report
+
+def print_report(report, elapsed, concurrency):
+    print(f"\nLoad test: {concurrency} virtual users for {elapsed:.1f}s")
+    header = f"{'route':32} {'reqs':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err %':>7} {'locks':>6}"
+    print(header)
+    print('-' * len(header))
+    for route, stats in report.items():
+        print(f"{route:32} {stats['requests']:>7} {stats['throughput_rps']:>8} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['error_rate'] * 100:>7.2f} {stats['lock_contention']:>6}")
+
+def run_load_test(base_url, scenario_name, concurrency, duration, seed=42):
+    """Drive the scenario with `concurrency` virtual users for `duration` seconds"""
+    user_ids = load_user_ids()
+    recorder = LoadTestRecorder()
+    locks_before = fetch_lock_errors(base_url)
+    deadline = time.monotonic() + duration
+
+    start = time.monotonic()
+    workers = [VirtualUser(base_url, SCENARIOS[scenario_name], user_ids, recorder, deadline, seed + i)
+               for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    locks_after = fetch_lock_errors(base_url)
+    lock_errors = None
+    if locks_before is not None and locks_after is not None:
+        lock_errors = {endpoint: count - locks_before.get(endpoint, 0) for endpoint, count in locks_after.items()}
+    else:
+        print("Warning: /metrics unavailable, lock contention is estimated from response bodies")
+
+    return build_report(recorder, elapsed, lock_errors), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the loan management app')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = subparsers.add_parser('seed', help='Seed Config.DATABASE (DATABASE_PATH) with applicants')
+    seed_parser.add_argument('--users', type=int, default=500)
+    seed_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = subparsers.add_parser('run', help='Run a load scenario against a running server')
+    run_parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    run_parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--report', help='write the JSON report to this path')
+
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        seed_database(args.users, args.seed)
+        return
+
+    report, elapsed = run_load_test(args.base_url, args.scenario, args.concurrency, args.duration, args.seed)
+    print_report(report, elapsed, args.concurrency)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'scenario': args.scenario, 'concurrency': args.concurrency,
+                       'duration_seconds': round(elapsed, 2), 'routes': report}, f, indent=2)
+        print(f"\nReport written to {args.report}")
+
+if __name__ == '__main__':
+    main()
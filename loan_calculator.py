@@ -0,0 +1,101 @@
+import numpy as np
+from config import Config
+
+# Vectorised home-loan arithmetic. Functions take scalars or equal-length sequences
+# (one element per loan) and return NumPy arrays, so a single applicant and a whole
+# portfolio go through the same code. Rates are annual percentages, tenures are months
+# (as stored in users.tenure). Invalid inputs (no tenure, missing amount) give NaN.
+
+def annual_rates(loan_amounts, property_types=None):
+    """Annual rate (%) per loan: the Config.LOAN_RATE_SLABS slab plus any Config.LOAN_RATE_SPREADS"""
+    amounts = np.asarray(loan_amounts, dtype=float)
+    bounds = np.array([bound for bound, _ in Config.LOAN_RATE_SLABS[:-1]], dtype=float)
+    slab_rates = np.array([rate for _, rate in Config.LOAN_RATE_SLABS], dtype=float)
+    # Slab upper bounds are inclusive
+    rates = slab_rates[np.searchsorted(bounds, amounts, side='left')]
+    if property_types is not None and Config.LOAN_RATE_SPREADS:
+        types = np.asarray(property_types, dtype=object)
+        for property_type, spread in Config.LOAN_RATE_SPREADS.items():
+            rates = rates + np.where(types == property_type, spread, 0.0)
+    return rates
+
+def monthly_instalments(principal, annual_rate, tenure_months):
+    """EMI = P·r·(1+r)^n / ((1+r)^n − 1) with r the monthly rate; P/n at zero interest"""
+    principal = np.asarray(principal, dtype=float)
+    rate = np.asarray(annual_rate, dtype=float) / 1200
+    months = np.asarray(tenure_months, dtype=float)
+    # (1+r)^n − 1 without losing precision for small r
+    growth = np.expm1(months * np.log1p(rate))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emi = np.where(rate > 0, principal * rate * (growth + 1) / growth, principal / months)
+    return np.where(months > 0, emi, np.nan)
+
+def loan_totals(principal, annual_rate, tenure_months):
+    """EMI, total repayment and total interest per loan"""
+    emi = monthly_instalments(principal, annual_rate, tenure_months)
+    total_payment = emi * np.asarray(tenure_months, dtype=float)
+    return {
+        'emi': emi,
+        'total_payment': total_payment,
+        'total_interest': total_payment - np.asarray(principal, dtype=float),
+    }
+
+def price_loans(loan_amounts, tenure_months, property_types=None):
+    """Rate from the tables, then EMI and totals, for any number of loans in one pass"""
+    rates = annual_rates(loan_amounts, property_types)
+    return dict(loan_totals(loan_amounts, rates, tenure_months), annual_rate=rates)
+
+def amortization_schedule(principal, annual_rate, tenure_months):
+    """Month-by-month instalment, interest, principal and closing balance.
+
+    Returns 2-D arrays (loans × longest tenure); months past a loan's tenure are zero.
+    Memory grows with loans × months, so use loan_totals for portfolio-wide figures.
+    """
+    principal = np.atleast_1d(np.asarray(principal, dtype=float))
+    annual_rate = np.atleast_1d(np.asarray(annual_rate, dtype=float))
+    tenure_months = np.atleast_1d(np.asarray(tenure_months, dtype=float))
+    principal, annual_rate, tenure_months = np.broadcast_arrays(principal, annual_rate, tenure_months)
+    rate = annual_rate[:, None] / 1200
+    emi = monthly_instalments(principal, annual_rate, tenure_months)[:, None]
+
+    longest = int(np.nanmax(tenure_months)) if tenure_months.size else 0
+    months = np.arange(max(longest, 0) + 1)[None, :]
+
+    # Closed-form balance after k payments: P(1+r)^k − EMI·((1+r)^k − 1)/r
+    growth = np.expm1(months * np.log1p(rate))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paid_factor = np.where(rate > 0, growth / rate, months)
+    balance = np.clip(principal[:, None] * (growth + 1) - emi * paid_factor, 0, None)
+    active = months[:, 1:] <= tenure_months[:, None]
+    interest = balance[:, :-1] * rate
+    return {
+        'month': months[0, 1:],
+        'instalment': np.where(active, emi, 0.0),
+        'interest': np.where(active, interest, 0.0),
+        'principal': np.where(active, balance[:, :-1] - balance[:, 1:], 0.0),
+        'balance': np.where(active, balance[:, 1:], 0.0),
+    }
+
+def foir_percentages(new_emi, monthly_income, existing_obligations=0):
+    """FOIR (%) = (existing monthly obligations + new EMI) / monthly income; NaN without income"""
+    income = np.asarray(monthly_income, dtype=float)
+    obligations = np.asarray(new_emi, dtype=float) + np.nan_to_num(np.asarray(existing_obligations, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(income > 0, obligations / income * 100, np.nan)
+
+def _scalar(value, digits=2):
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+def loan_metrics(loan_amount, tenure_months, property_type=None, monthly_income=None, monthly_obligations=None):
+    """Rate, EMI, interest and FOIR for one application (None where not computable)"""
+    if not loan_amount or not tenure_months:
+        return {'interest_rate': None, 'emi': None, 'total_interest': None, 'foir': None}
+    priced = price_loans([loan_amount], [tenure_months], [property_type])
+    foir = foir_percentages(priced['emi'], [monthly_income or np.nan], [monthly_obligations or 0])
+    return {
+        'interest_rate': _scalar(priced['annual_rate'][0]),
+        'emi': _scalar(priced['emi'][0]),
+        'total_interest': _scalar(priced['total_interest'][0]),
+        'foir': _scalar(foir[0]),
+    }
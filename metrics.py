@@ -0,0 +1,225 @@
+import bisect
+import functools
+import math
+import threading
+import time
+from flask import Response, g, request
+
+# Minimal Prometheus text-format (0.0.4) registry. Each metric keeps its own lock and
+# only holds it for a dictionary update, so recording from request and worker
+# threads stays cheap; rendering happens on scrape.
+
+_registry = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, label_values, extra=()):
+    pairs = list(zip(labelnames, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames and self.metric_type != 'histogram':
+            self._values[()] = 0
+        _registry.append(self)
+
+    def _samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for label_values, value in self._samples():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, label_values)} {_format_value(value)}')
+        return lines
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def set_function(self, function):
+        """Compute the gauge on scrape; function returns a number or {label_values: number}"""
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        result = self._function()
+        if isinstance(result, dict):
+            return list(result.items())
+        return [((), result)]
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket (non-cumulative) counts + [sum, count]
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        for label_values, series in self._samples():
+            series = list(series)
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, label_values, [('le', _format_value(upper_bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+def track_in_progress(gauge):
+    """Decorator that keeps `gauge` incremented while the wrapped function runs"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            gauge.inc()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                gauge.dec()
+        return wrapper
+    return decorator
+
+def render_metrics():
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# HTTP
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                            ('endpoint', 'method'))
+REQUESTS_TOTAL = Counter('http_requests_total', 'Requests by endpoint and status',
+                         ('endpoint', 'method', 'status'))
+
+# Database
+DB_CONNECTIONS_TOTAL = Counter('db_connections_total', 'SQLite connections opened')
+DB_QUERIES_TOTAL = Counter('db_queries_total', 'SQL statements executed by endpoint', ('endpoint',))
+DB_LOCK_ERRORS_TOTAL = Counter('db_lock_errors_total', '"database is locked" errors by endpoint', ('endpoint',))
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'SQL statement latency by endpoint', ('endpoint',),
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+DB_WRITE_QUEUE_DEPTH = Gauge('db_write_queue_depth', 'Write intents waiting for the writer thread')
+DB_WRITE_BATCH_SIZE = Histogram('db_write_batch_size', 'Write intents committed per group commit',
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+DB_WRITE_LATENCY = Histogram('db_write_duration_seconds', 'Time from queueing a write intent to its commit',
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+
+# AI analysis pipeline
+ANALYSES_QUEUED = Gauge('analysis_queued', 'Analyses waiting to start')
+ANALYSES_RUNNING = Gauge('analysis_running', 'Analyses in progress')
+ANALYSES_COMPLETED_TOTAL = Counter('analysis_completed_total', 'Analyses saved successfully')
+ANALYSES_FAILED_TOTAL = Counter('analysis_failed_total', 'Analyses that exhausted their retries')
+ANALYSIS_RETRIES_TOTAL = Counter('analysis_retries_total', 'Analysis retry attempts')
+FALLBACK_ANALYSES_TOTAL = Counter('analysis_fallback_total', 'Rule-based fallback analyses produced')
+ANALYSIS_PARSE_FAILURES_TOTAL = Counter('analysis_parse_failures_total',
+                                        'Model responses rejected by the schema ("Analysis Error")')
+
+# Document extraction
+DOCUMENT_EXTRACTIONS_TOTAL = Counter('document_extractions_total',
+                                     'Document extractions by outcome (extracted, cached, failed, unsupported)',
+                                     ('outcome',))
+DOCUMENT_EXTRACTION_LATENCY = Histogram('document_extraction_duration_seconds',
+                                        'Time from queueing an extraction to its result being cached')
+
+# Image normalisation
+IMAGES_PROCESSED_TOTAL = Counter('images_processed_total',
+                                 'Uploaded images by outcome (normalized, kept, orphaned, failed)', ('outcome',))
+IMAGE_BYTES_SAVED_TOTAL = Counter('image_bytes_saved_total', 'Bytes saved by re-encoding uploaded images')
+
+# Gemini
+# kind="analysis" for analysis calls; other kinds keep ad-hoc calls out of the analysis latency
+GEMINI_CALL_LATENCY = Histogram('gemini_call_duration_seconds', 'Gemini generate_content latency',
+                                ('model', 'kind'))
+GEMINI_CALL_ERRORS_TOTAL = Counter('gemini_call_errors_total', 'Failed Gemini calls', ('model', 'kind'))
+GEMINI_HEDGE_OUTCOMES_TOTAL = Counter('gemini_hedge_outcomes_total',
+                                      'Hedged call results per model (win, loss, error, invalid, timeout)',
+                                      ('model', 'outcome'))
+GEMINI_TOKENS_TOTAL = Counter('gemini_tokens_total', 'Gemini tokens used', ('direction',))
+GEMINI_PROMPT_TOKENS = Histogram('gemini_prompt_tokens', 'Prompt tokens per analysis',
+                                 buckets=(100, 200, 300, 400, 600, 800, 1200, 1600, 2400, 3200))
+GEMINI_BREAKER_STATE = Gauge('gemini_circuit_breaker_state', 'Gemini circuit breaker state (0 closed, 1 half-open, 2 open)')
+GEMINI_BREAKER_REJECTED_TOTAL = Counter('gemini_circuit_breaker_rejected_total',
+                                        'Analyses served by the fallback without calling Gemini')
+GEMINI_BREAKER_TRANSITIONS_TOTAL = Counter('gemini_circuit_breaker_transitions_total',
+                                           'Circuit breaker state changes', ('state',))
+
+def init_metrics(app):
+    """Time every request and expose /metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('request_start')
+        if start is not None and request.endpoint != 'metrics':
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint, request.method)
+            REQUESTS_TOTAL.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
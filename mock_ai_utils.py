@@ -0,0 +1,65 @@
+import time
+from config import Config
+from models import get_read_connection, save_analysis_result
+from utils import get_uploaded_documents
+from ai_utils import create_structured_prompt_data, create_fallback_analysis
+from analysis_jobs import submit_analysis, CALLING_MODEL, SAVED, FAILED
+from metrics import ANALYSES_RUNNING, ANALYSES_COMPLETED_TOTAL, track_in_progress
+
+# Fake AI backend with the same interface as ai_utils. Enabled with USE_MOCK_AI=true;
+# used by load_test.py and for local development without a Gemini API key.
+
+def queue_analysis(user_id):
+    """Queue a fake analysis on the worker pool and return its job id"""
+    return submit_analysis(user_id, analyze_loan_eligibility)
+
+def trigger_ai_analysis(user_id):
+    """Queue automatic fake analysis when it is enabled"""
+    if not Config.AUTO_ANALYSIS_ENABLED:
+        return None
+    return queue_analysis(user_id)
+
+def _no_progress(stage, message=''):
+    pass
+
+@track_in_progress(ANALYSES_RUNNING)
+def analyze_loan_eligibility(user_id, progress=_no_progress):
+    """Produce a deterministic rule-based analysis after a simulated model latency"""
+    conn = get_read_connection()
+    user = conn.execute('SELECT * FROM users_full WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+
+    if not user:
+        progress(FAILED, 'User not found')
+        return {"error": "User not found"}
+
+    uploaded_documents = get_uploaded_documents(user_id)
+    prompt_data = create_structured_prompt_data(dict(user), uploaded_documents)
+
+    # Simulate the time a Gemini round trip holds the caller
+    progress(CALLING_MODEL, 'Waiting for the model')
+    time.sleep(Config.MOCK_AI_LATENCY_SECONDS)
+
+    analysis_result = create_fallback_analysis(prompt_data)
+    analysis_result['reasoning'] = analysis_result['reasoning'].replace('FALLBACK ANALYSIS', 'MOCK ANALYSIS', 1)
+
+    save_analysis_result(
+        user_id=user_id,
+        eligibility_status=analysis_result.get('eligibility', 'Pending'),
+        foir=analysis_result.get('foir_used'),
+        ltv=analysis_result.get('ltv_used'),
+        ai_summary=analysis_result.get('reasoning', ''),
+        ai_queries='\n'.join(analysis_result.get('queries', [])),
+        missing_docs='\n'.join(analysis_result.get('missing_documents', [])),
+        risk_level=analysis_result.get('risk_level', 'Medium'),
+        recommendation=analysis_result.get('recommendation', '')
+    ).result()
+    ANALYSES_COMPLETED_TOTAL.inc()
+    progress(SAVED, analysis_result.get('eligibility', 'Pending'))
+
+    return analysis_result
+
+def trigger_bulk_analysis(user_ids):
+    """Trigger fake AI analysis for multiple users"""
+    for user_id in user_ids:
+        trigger_ai_analysis(user_id)
@@ -1,43 +1,107 @@
+import json
+import os
 import sqlite3
+from datetime import datetime, timezone
+from urllib.parse import quote
 from config import Config
+from query_instrumentation import InstrumentedConnection
+from metrics import DB_CONNECTIONS_TOTAL
+from db_writer import submit_write
+from field_parsing import parsed_user_columns
+from duplicates import DUPLICATE_FIELDS, backfill_duplicate_index, index_user_duplicates
+from contact_graph import CONTACT_FIELDS, backfill_contact_graph, index_user_contacts
+from valuation_index import backfill_valuation_index, update_valuation_index, valuation_check
 
 def get_db_connection():
-    conn = sqlite3.connect(Config.DATABASE)
+    DB_CONNECTIONS_TOTAL.inc()
+    conn = sqlite3.connect(Config.DATABASE, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_read_connection():
+    """Read-only connection; under WAL it never blocks, or is blocked by, the writer"""
+    DB_CONNECTIONS_TOTAL.inc()
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(Config.DATABASE))}?mode=ro", uri=True,
+                           factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def enable_wal():
+    """Switch the database to write-ahead logging (persistent, so once at startup is enough)"""
+    conn = get_db_connection()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
 def init_db():
     """Initialize database with all required tables"""
-    # Create users table
+    # Readers and the background writer work concurrently under WAL
+    enable_wal()
+    
+    # Create users table and its cold side tables
     create_users_table()
+    create_user_side_tables()
     
     # Create documents table
     create_documents_table()
     
+    # Extracted document text, keyed by file content hash
+    create_document_extractions_table()
+    
+    # Content-addressed document files and their reference counts
+    create_document_blobs_table()
+    
     # Create or update analysis table
     create_analysis_table()
     
+    # Pre-aggregated analytics (maintained on write, rebuilt by rollups.rebuild_rollups)
+    create_rollup_tables()
+    
     # Run migration for existing tables
     migrate_analysis_table()
+    migrate_documents_table()
+    split_users_table()
+    migrate_users_table()
+    
+    # Compatibility view over users + side tables
+    create_users_full_view()
+    
+    # Blocking index for duplicate-applicant detection (reads users_full)
+    create_duplicate_tables()
+    
+    # Shared-contact graph and its union-find clusters (reads users_full)
+    create_contact_graph_tables()
+    
+    # Streaming price-per-sq-ft quantiles per pincode (reads the typed carpet area)
+    create_valuation_index_table()
+
+# Rarely read, wide columns live in 1:1 side tables keyed by user_id so the hot users
+# table stays narrow; the users_full view joins them back for pages that show everything.
+USER_SIDE_TABLES = {
+    'user_addresses': ('current_address', 'office_address', 'property_address', 'investment_details'),
+    'user_references': ('ref1_name', 'ref1_mobile', 'ref1_email', 'ref1_address',
+                        'ref2_name', 'ref2_mobile', 'ref2_email', 'ref2_address'),
+    'user_co_applicants': ('co_applicant_name', 'co_applicant_spouse_name', 'co_applicant_mother_name',
+                           'co_applicant_mobile', 'co_applicant_address', 'co_applicant_email',
+                           'co_applicant_qualification'),
+}
+COLD_USER_COLUMNS = {column for columns in USER_SIDE_TABLES.values() for column in columns}
 
-def create_users_table():
-    """Create the users table with Version 2 schema"""
+def create_users_table(table_name='users'):
+    """Create the hot users table (Version 3 schema: cold columns moved to USER_SIDE_TABLES)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             -- Applicant Details
             applicant_name TEXT NOT NULL,
             applicant_spouse_name TEXT,
             applicant_mother_name TEXT,
-            current_address TEXT,
             mobile_no TEXT,
             email_id TEXT UNIQUE NOT NULL,
             children TEXT,
             qualification TEXT,
-            office_address TEXT,
             office_landline TEXT,
             official_email_id TEXT,
             job_since TEXT,
@@ -46,37 +110,70 @@ def create_users_table():
             designation TEXT,
             loan_amount REAL NOT NULL,
             tenure INTEGER NOT NULL,
-            investment_details TEXT,
-            property_address TEXT,
             property_type TEXT,
             property_pincode TEXT,
             property_carpet_area TEXT,
             sale_deed_amount REAL,
-            -- Reference 1
-            ref1_name TEXT,
-            ref1_mobile TEXT,
-            ref1_email TEXT,
-            ref1_address TEXT,
-            -- Reference 2
-            ref2_name TEXT,
-            ref2_mobile TEXT,
-            ref2_email TEXT,
-            ref2_address TEXT,
-            -- Co-Applicant Details
             has_co_applicant BOOLEAN DEFAULT FALSE,
-            co_applicant_name TEXT,
-            co_applicant_spouse_name TEXT,
-            co_applicant_mother_name TEXT,
-            co_applicant_mobile TEXT,
-            co_applicant_address TEXT,
-            co_applicant_email TEXT,
-            co_applicant_qualification TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     conn.commit()
     conn.close()
 
+def create_user_side_tables():
+    """Create the cold 1:1 side tables of users"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    for table_name, columns in USER_SIDE_TABLES.items():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+                {', '.join(f'{column} TEXT' for column in columns)}
+            )
+        ''')
+    conn.commit()
+    conn.close()
+
+def create_users_full_view():
+    """(Re)create users_full: every users column plus the side-table columns, as one row per user"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    select_columns = ['u.*']
+    joins = []
+    for alias, (table_name, columns) in enumerate(USER_SIDE_TABLES.items()):
+        select_columns.extend(f's{alias}.{column}' for column in columns)
+        joins.append(f'LEFT JOIN {table_name} s{alias} ON s{alias}.user_id = u.id')
+    # Recreated on every start so columns added to users by migrations show up
+    cursor.execute('DROP VIEW IF EXISTS users_full')
+    cursor.execute(f"CREATE VIEW users_full AS SELECT {', '.join(select_columns)} FROM users u {' '.join(joins)}")
+    conn.commit()
+    conn.close()
+
+def insert_user(conn, user_data):
+    """Insert an applicant dict across users and its side tables; returns the new id (caller commits)"""
+    hot = {column: value for column, value in user_data.items() if column not in COLD_USER_COLUMNS}
+    cursor = conn.execute(f"INSERT INTO users ({', '.join(hot)}) VALUES ({', '.join('?' * len(hot))})",
+                          list(hot.values()))
+    user_id = cursor.lastrowid
+    for table_name, columns in USER_SIDE_TABLES.items():
+        values = [user_data.get(column) for column in columns]
+        # Side rows are sparse: no row means every column is empty
+        if any(value not in (None, '') for value in values):
+            conn.execute(f"INSERT INTO {table_name} (user_id, {', '.join(columns)}) "
+                         f"VALUES (?, {', '.join('?' * len(columns))})", [user_id] + values)
+    bump_rollup(conn, 'rollup_applications',
+                {'day': str(user_data.get('created_at') or utc_day())[:10], 'property_type': user_data.get('property_type'),
+                 'property_pincode': user_data.get('property_pincode')},
+                {'applications': 1, 'loan_amount': user_data.get('loan_amount') or 0})
+    index_user_duplicates(conn, user_id, {field: user_data.get(field) for field in DUPLICATE_FIELDS})
+    index_user_contacts(conn, user_id, {field: user_data.get(field) for field in CONTACT_FIELDS})
+    update_valuation_index(conn, user_data.get('property_pincode'), user_data.get('property_type'),
+                           user_data.get('sale_deed_amount'), user_data.get('carpet_area_sqft'))
+    return user_id
+
 def create_documents_table():
     """Create the user_documents table"""
     conn = get_db_connection()
@@ -90,6 +187,7 @@ def create_documents_table():
             file_name TEXT NOT NULL,
             file_path TEXT NOT NULL,
             file_size INTEGER,
+            content_hash TEXT,
             upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
         )
@@ -97,16 +195,253 @@ def create_documents_table():
     conn.commit()
     conn.close()
 
+def create_document_extractions_table():
+    """Create the document_extractions cache (one row per distinct file content)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_extractions (
+            content_hash TEXT PRIMARY KEY,
+            document_type TEXT,
+            extracted_text TEXT,
+            fields TEXT,
+            extractor TEXT,
+            error TEXT,
+            extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def create_document_blobs_table():
+    """Create the document_blobs table (one stored file per distinct content hash)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_blobs (
+            content_hash TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            file_size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            original_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def create_rollup_tables():
+    """Create the analytics rollup tables (daily buckets keyed by their dimensions)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    # Dimension columns are NOT NULL ('' for unknown) so upserts always hit the same row
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_applications (
+            day TEXT NOT NULL,
+            property_type TEXT NOT NULL,
+            property_pincode TEXT NOT NULL,
+            applications INTEGER NOT NULL DEFAULT 0,
+            loan_amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, property_type, property_pincode)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_analyses (
+            day TEXT NOT NULL,
+            eligibility_status TEXT NOT NULL,
+            risk_level TEXT NOT NULL,
+            analyses INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, eligibility_status, risk_level)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_document_funnel (
+            stage TEXT PRIMARY KEY,
+            users INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+    conn.close()
+
+def create_duplicate_tables():
+    """Create the duplicate-detection tables, indexing existing users the first time"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_blocking_keys'"
+    ).fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_blocking_keys (
+            key TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (key, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # One row per direction so either applicant's page reads its own rows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_duplicates (
+            user_id INTEGER NOT NULL,
+            duplicate_user_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            reasons TEXT,
+            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, duplicate_user_id)
+        ) WITHOUT ROWID
+    ''')
+    if is_new:
+        backfill_duplicate_index(conn)
+    conn.commit()
+    conn.close()
+
+def get_probable_duplicates(user_id):
+    """Probable duplicates of a user, best match first"""
+    conn = get_read_connection()
+    duplicates = conn.execute('''
+        SELECT d.duplicate_user_id, d.score, d.reasons, d.detected_at,
+               u.applicant_name, u.email_id, u.mobile_no, u.created_at
+        FROM user_duplicates d JOIN users u ON u.id = d.duplicate_user_id
+        WHERE d.user_id = ?
+        ORDER BY d.score DESC
+    ''', (user_id,)).fetchall()
+    conn.close()
+    
+    return [dict(row, reasons=json.loads(row['reasons'] or '[]')) for row in duplicates]
+
+def create_contact_graph_tables():
+    """Create the shared-contact index and cluster sizes, adding users not yet in the graph"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contact_identifiers (
+            identifier TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (identifier, user_id, source)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_identifiers_user_id ON contact_identifiers (user_id)')
+    # users.contact_cluster_id points at the cluster root; only roots have a row here
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contact_clusters (
+            cluster_id INTEGER PRIMARY KEY,
+            size INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_clusters_size ON contact_clusters (size)')
+    backfill_contact_graph(conn)
+    conn.commit()
+    conn.close()
+
+def get_contact_cluster(user_id):
+    """The user's shared-contact cluster when it has at least Config.CONTACT_CLUSTER_ALERT_SIZE
+    applications, else None"""
+    conn = get_read_connection()
+    cluster = conn.execute('''
+        SELECT c.cluster_id, c.size FROM users u JOIN contact_clusters c ON c.cluster_id = u.contact_cluster_id
+        WHERE u.id = ?
+    ''', (user_id,)).fetchone()
+    if cluster is None or cluster['size'] < Config.CONTACT_CLUSTER_ALERT_SIZE:
+        conn.close()
+        return None
+    
+    linked_user_ids = [row['id'] for row in conn.execute(
+        'SELECT id FROM users WHERE contact_cluster_id = ? AND id != ? ORDER BY id LIMIT ?',
+        (cluster['cluster_id'], user_id, Config.CONTACT_CLUSTER_LIST_LIMIT)
+    )]
+    # This applicant's contacts that other applications also gave
+    shared_contacts = [dict(row) for row in conn.execute('''
+        SELECT mine.source, COUNT(DISTINCT other.user_id) AS other_applications
+        FROM contact_identifiers mine
+        JOIN contact_identifiers other ON other.identifier = mine.identifier AND other.user_id != mine.user_id
+        WHERE mine.user_id = ?
+        GROUP BY mine.source ORDER BY other_applications DESC
+    ''', (user_id,))]
+    conn.close()
+    
+    return {
+        'cluster_id': cluster['cluster_id'],
+        'size': cluster['size'],
+        'linked_user_ids': linked_user_ids,
+        'shared_contacts': shared_contacts,
+    }
+
+def create_valuation_index_table():
+    """Create the per-pincode valuation sketches, indexing existing applications the first time"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'valuation_index'"
+    ).fetchone() is None
+    # P² marker heights (price per sq ft) and positions; property_type '' is the whole pincode
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS valuation_index (
+            property_pincode TEXT NOT NULL,
+            property_type TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            price_min REAL,
+            price_q1 REAL,
+            price_median REAL,
+            price_q3 REAL,
+            price_max REAL,
+            pos_q1 INTEGER,
+            pos_median INTEGER,
+            pos_q3 INTEGER,
+            PRIMARY KEY (property_pincode, property_type)
+        ) WITHOUT ROWID
+    ''')
+    if is_new:
+        backfill_valuation_index(conn)
+    conn.commit()
+    conn.close()
+
+def get_valuation_check(user):
+    """valuation_index.valuation_check for a users row/dict, or None without enough comparables"""
+    if not user.get('property_pincode'):
+        return None
+    conn = get_read_connection()
+    buckets = {row['property_type']: row for row in conn.execute(
+        "SELECT * FROM valuation_index WHERE property_pincode = ? AND property_type IN ('', ?)",
+        (str(user['property_pincode']).strip(), user.get('property_type') or '')
+    )}
+    conn.close()
+    
+    return valuation_check(buckets, user.get('property_type'), user.get('sale_deed_amount'),
+                           user.get('carpet_area_sqft'), user.get('loan_amount'))
+
+def bump_rollup(conn, table_name, key, deltas):
+    """Add deltas to the rollup row for key, creating it on first use (caller commits)"""
+    columns = list(key) + list(deltas)
+    conn.execute(f'''
+        INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(f'{column} = {column} + excluded.{column}' for column in deltas)}
+    ''', [value if value is not None else '' for value in key.values()] + list(deltas.values()))
+
+def utc_day():
+    """Today's bucket, in the same UTC calendar as CURRENT_TIMESTAMP columns"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+def _bump_analysis_rollup(conn, previous, eligibility_status, risk_level):
+    # An analysis row is rewritten in place: move it from its old day/status bucket to today's
+    if previous is not None:
+        bump_rollup(conn, 'rollup_analyses', {'day': previous['day'], 'eligibility_status': previous['eligibility_status'],
+                                              'risk_level': previous['risk_level']}, {'analyses': -1})
+    bump_rollup(conn, 'rollup_analyses', {'day': utc_day(), 'eligibility_status': eligibility_status,
+                                          'risk_level': risk_level}, {'analyses': 1})
+
 def create_analysis_table():
     """Create the user_analysis table for AI results"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Drop and recreate the table to ensure all columns exist
-    cursor.execute('DROP TABLE IF EXISTS user_analysis')
-    
+    # Columns added later are filled in by migrate_analysis_table
     cursor.execute('''
-        CREATE TABLE user_analysis (
+        CREATE TABLE IF NOT EXISTS user_analysis (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             eligibility_status TEXT DEFAULT 'Pending',
@@ -120,15 +455,18 @@ def create_analysis_table():
             analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             retry_count INTEGER DEFAULT 0,
             last_error TEXT,
+            needs_reanalysis INTEGER DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
         )
     ''')
+    # Latest-analysis lookups per user (listing status, exports)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_analysis_user_date ON user_analysis (user_id, analysis_date)')
     conn.commit()
     conn.close()
 
 def get_user_analysis(user_id):
     """Get the latest analysis for a user as dictionary"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     analysis = conn.execute(
         'SELECT * FROM user_analysis WHERE user_id = ? ORDER BY analysis_date DESC LIMIT 1',
         (user_id,)
@@ -138,60 +476,71 @@ def get_user_analysis(user_id):
     # Convert to dictionary if analysis exists
     return dict(analysis) if analysis else None
 
-def save_analysis_result(user_id, eligibility_status, ai_summary, ai_queries, 
-                        foir=None, ltv=None, missing_docs=None, risk_level=None, 
-                        recommendation=None, retry_count=0, last_error=None):
-    """Save AI analysis result to database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def _write_analysis_result(conn, user_id, eligibility_status, ai_summary, ai_queries, foir, ltv,
+                           missing_docs, risk_level, recommendation, retry_count, last_error,
+                           needs_reanalysis):
+    """Upsert a user's analysis row (runs on the writer thread)"""
     # Check if analysis already exists
-    existing = cursor.execute(
-        'SELECT id FROM user_analysis WHERE user_id = ?', (user_id,)
+    existing = conn.execute(
+        'SELECT id, eligibility_status, risk_level, date(analysis_date) AS day FROM user_analysis WHERE user_id = ?',
+        (user_id,)
     ).fetchone()
     
     if existing:
         # Update existing analysis
-        cursor.execute('''
+        conn.execute('''
             UPDATE user_analysis 
             SET eligibility_status=?, foir_used=?, ltv_used=?, ai_summary=?, 
                 ai_queries=?, missing_docs=?, risk_level=?, recommendation=?,
-                analysis_date=CURRENT_TIMESTAMP, retry_count=?, last_error=?
+                analysis_date=CURRENT_TIMESTAMP, retry_count=?, last_error=?, needs_reanalysis=?
             WHERE user_id=?
         ''', (eligibility_status, foir, ltv, ai_summary, ai_queries, 
-              missing_docs, risk_level, recommendation, retry_count, last_error, user_id))
+              missing_docs, risk_level, recommendation, retry_count, last_error,
+              int(needs_reanalysis), user_id))
     else:
         # Insert new analysis
-        cursor.execute('''
+        conn.execute('''
             INSERT INTO user_analysis 
             (user_id, eligibility_status, foir_used, ltv_used, ai_summary, 
-             ai_queries, missing_docs, risk_level, recommendation, retry_count, last_error)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             ai_queries, missing_docs, risk_level, recommendation, retry_count, last_error,
+             needs_reanalysis)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, eligibility_status, foir, ltv, ai_summary, ai_queries, 
-              missing_docs, risk_level, recommendation, retry_count, last_error))
-    
-    conn.commit()
-    conn.close()
+              missing_docs, risk_level, recommendation, retry_count, last_error,
+              int(needs_reanalysis)))
+    _bump_analysis_rollup(conn, existing, eligibility_status, risk_level)
 
-def update_analysis_error(user_id, error_message, retry_count):
-    """Update analysis with error information"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+def save_analysis_result(user_id, eligibility_status, ai_summary, ai_queries, 
+                        foir=None, ltv=None, missing_docs=None, risk_level=None, 
+                        recommendation=None, retry_count=0, last_error=None,
+                        needs_reanalysis=False):
+    """Queue an AI analysis result for the writer; returns a Future resolved once committed"""
+    return submit_write(_write_analysis_result, user_id, eligibility_status, ai_summary, ai_queries,
+                        foir, ltv, missing_docs, risk_level, recommendation, retry_count, last_error,
+                        needs_reanalysis)
+
+def _write_analysis_error(conn, user_id, error_message, retry_count):
+    existing = conn.execute(
+        'SELECT eligibility_status, risk_level, date(analysis_date) AS day FROM user_analysis WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    if existing is None:
+        return
+    conn.execute('''
         UPDATE user_analysis 
         SET eligibility_status=?, last_error=?, retry_count=?, analysis_date=CURRENT_TIMESTAMP
         WHERE user_id=?
     ''', ('AI Analysis Failed', error_message, retry_count, user_id))
-    
-    conn.commit()
-    conn.close()
-    
+    _bump_analysis_rollup(conn, existing, 'AI Analysis Failed', existing['risk_level'])
+
+def update_analysis_error(user_id, error_message, retry_count):
+    """Queue error information for the writer; returns a Future resolved once committed"""
     print(f"Analysis failed for user {user_id}: {error_message}")
+    return submit_write(_write_analysis_error, user_id, error_message, retry_count)
 
 def get_analysis_stats():
     """Get statistics for dashboard"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     
     stats = conn.execute('''
         SELECT 
@@ -220,18 +569,86 @@ def get_analysis_stats():
         'failed_users': 0
     }
 
+def get_users_needing_reanalysis(limit=20):
+    """Get ids of users whose analysis was a fallback served while Gemini was unavailable"""
+    conn = get_read_connection()
+    rows = conn.execute(
+        'SELECT user_id FROM user_analysis WHERE needs_reanalysis = 1 ORDER BY analysis_date LIMIT ?',
+        (limit,)
+    ).fetchall()
+    conn.close()
+    return [row['user_id'] for row in rows]
+
+def listing_conditions(alias, missing_mask=0, max_completeness=None, experience_under=None,
+                       min_carpet_area=None, max_carpet_area=None, min_cluster_size=None):
+    """' AND ...' SQL and params for the listing filters on maintained/typed users columns"""
+    sql, params = '', []
+    if missing_mask:
+        # x & bits != 0 implies x >= lowest bit, which lets idx_users_doc_missing_mask narrow the scan
+        sql += f' AND {alias}doc_missing_mask >= ? AND {alias}doc_missing_mask & ? != 0'
+        params.extend([missing_mask & -missing_mask, missing_mask])
+    if max_completeness is not None:
+        sql += f' AND {alias}completeness_score <= ?'
+        params.append(max_completeness)
+    if experience_under is not None:
+        sql += f' AND {alias}total_experience_years < ?'
+        params.append(experience_under)
+    if min_carpet_area is not None:
+        sql += f' AND {alias}carpet_area_sqft >= ?'
+        params.append(min_carpet_area)
+    if max_carpet_area is not None:
+        sql += f' AND {alias}carpet_area_sqft <= ?'
+        params.append(max_carpet_area)
+    if min_cluster_size is not None:
+        sql += f' AND {alias}contact_cluster_id IN (SELECT cluster_id FROM contact_clusters WHERE size >= ?)'
+        params.append(min_cluster_size)
+    return sql, params
+
+def get_filtered_users(search='', status='', limit=None, **filters):
+    """Users matching the all_users listing filters (name/email/mobile search, latest AI status,
+    and the listing_conditions filters)"""
+    conn = get_read_connection()
+    
+    query = '''
+        SELECT * FROM (
+            SELECT u.id, u.applicant_name, u.email_id, u.mobile_no, u.completeness_score, u.doc_missing_mask,
+                   u.total_experience_years, u.carpet_area_sqft,
+                   COALESCE((SELECT eligibility_status FROM user_analysis
+                             WHERE user_id = u.id ORDER BY analysis_date DESC LIMIT 1), 'Pending') AS ai_status
+            FROM users u
+        )
+        WHERE 1 = 1
+    '''
+    conditions, params = listing_conditions('', **filters)
+    query += conditions
+    if search:
+        query += ' AND (applicant_name LIKE ? OR email_id LIKE ? OR mobile_no LIKE ?)'
+        params.extend([f'%{search}%'] * 3)
+    if status:
+        query += ' AND ai_status = ?'
+        params.append(status)
+    query += ' ORDER BY id DESC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    
+    users = conn.execute(query, params).fetchall()
+    conn.close()
+    return users
+
 def get_users_for_bulk_analysis(limit=10):
-    """Get users that need AI analysis"""
-    conn = get_db_connection()
+    """Get ids of users that need AI analysis"""
+    conn = get_read_connection()
     
     try:
         users = conn.execute('''
-            SELECT u.id, u.applicant_name, u.email_id
+            SELECT u.id
             FROM users u
             LEFT JOIN user_analysis ua ON u.id = ua.user_id 
             WHERE ua.id IS NULL 
                OR ua.eligibility_status IN ('Pending', 'AI Analysis Failed')
                OR (ua.retry_count IS NULL OR ua.retry_count < ?)
+               OR ua.needs_reanalysis = 1
             ORDER BY u.id DESC
             LIMIT ?
         ''', (Config.AI_RETRY_ATTEMPTS, limit)).fetchall()
@@ -239,7 +656,7 @@ def get_users_for_bulk_analysis(limit=10):
         # If retry_count column doesn't exist yet, use simpler query
         print(f"Using fallback query due to: {e}")
         users = conn.execute('''
-            SELECT u.id, u.applicant_name, u.email_id
+            SELECT u.id
             FROM users u
             LEFT JOIN user_analysis ua ON u.id = ua.user_id 
             WHERE ua.id IS NULL 
@@ -252,12 +669,12 @@ def get_users_for_bulk_analysis(limit=10):
     return users
 
 def check_table_schema():
-    """Check if the users table has the correct schema"""
+    """Check if the users table (with its side tables, via users_full) has the correct schema"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Get table info
-    cursor.execute("PRAGMA table_info(users)")
+    cursor.execute("PRAGMA table_info(users_full)")
     columns = [column[1] for column in cursor.fetchall()]
     
     # Required columns
@@ -296,7 +713,8 @@ def migrate_analysis_table():
         ('risk_level', 'TEXT'),
         ('recommendation', 'TEXT'),
         ('retry_count', 'INTEGER DEFAULT 0'),
-        ('last_error', 'TEXT')
+        ('last_error', 'TEXT'),
+        ('needs_reanalysis', 'INTEGER DEFAULT 0')
     ]
     
     for column_name, column_type in columns_to_add:
@@ -308,3 +726,139 @@ def migrate_analysis_table():
     
     conn.commit()
     conn.close()
+
+def migrate_documents_table():
+    """Add the content hash column used to look up cached extractions and blob bookkeeping columns"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(user_documents)")
+    existing_columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'content_hash' not in existing_columns:
+        try:
+            cursor.execute('ALTER TABLE user_documents ADD COLUMN content_hash TEXT')
+        except sqlite3.OperationalError as e:
+            print(f"Column content_hash might already exist: {e}")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_documents_content_hash ON user_documents (content_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_documents_user_type ON user_documents (user_id, document_type)')
+    
+    # Pre-normalisation originals kept when Config.KEEP_ORIGINAL_IMAGES is on
+    cursor.execute("PRAGMA table_info(document_blobs)")
+    if 'original_path' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE document_blobs ADD COLUMN original_path TEXT')
+    
+    conn.commit()
+    conn.close()
+
+def migrate_users_table():
+    """Add the completeness columns maintained by completeness.py, the typed copies of
+    free-text fields (field_parsing.py), and their indexes"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(users)")
+    existing_columns = [column[1] for column in cursor.fetchall()]
+    
+    # Backfilled by completeness.refresh_stale_completeness() at startup
+    columns_to_add = [
+        ('completeness_fields', 'INTEGER'),
+        ('doc_required_mask', 'INTEGER'),
+        ('doc_uploaded_mask', 'INTEGER'),
+        ('doc_missing_mask', 'INTEGER'),
+        ('completeness_score', 'INTEGER'),
+        ('completeness_year', 'INTEGER'),
+        ('job_since_year', 'INTEGER'),
+        ('total_experience_years', 'INTEGER'),
+        ('carpet_area_sqft', 'REAL'),
+        ('contact_cluster_id', 'INTEGER')  # maintained by contact_graph.py
+    ]
+    
+    added_columns = []
+    for column_name, column_type in columns_to_add:
+        if column_name not in existing_columns:
+            try:
+                cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_type}')
+                added_columns.append(column_name)
+            except sqlite3.OperationalError as e:
+                print(f"Column {column_name} might already exist: {e}")
+    
+    # Also repairs rows imported without their typed columns
+    backfill_typed_user_columns(conn)
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_completeness_score ON users (completeness_score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_doc_missing_mask ON users (doc_missing_mask)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_job_since_year ON users (job_since_year)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_total_experience_years ON users (total_experience_years)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_carpet_area_sqft ON users (carpet_area_sqft)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_contact_cluster_id ON users (contact_cluster_id)')
+    
+    conn.commit()
+    conn.close()
+
+def backfill_typed_user_columns(conn):
+    """Parse job_since / total_experience / property_carpet_area of rows with none of the
+    typed columns set (caller commits)"""
+    rows = conn.execute('''
+        SELECT id, job_since, total_experience, property_carpet_area, property_pincode, property_type,
+               sale_deed_amount
+        FROM users
+        WHERE job_since_year IS NULL AND total_experience_years IS NULL AND carpet_area_sqft IS NULL
+          AND (job_since != '' OR total_experience != '' OR property_carpet_area != '')
+    ''').fetchall()
+    parsed = [dict(parsed_user_columns(dict(row)), id=row['id']) for row in rows]
+    conn.executemany('''
+        UPDATE users SET job_since_year = :job_since_year, total_experience_years = :total_experience_years,
+                         carpet_area_sqft = :carpet_area_sqft
+        WHERE id = :id
+    ''', parsed)
+    
+    # Rows that now have a carpet area join an existing valuation index (a new one indexes everything)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'valuation_index'").fetchone():
+        for row, columns in zip(rows, parsed):
+            update_valuation_index(conn, row['property_pincode'], row['property_type'],
+                                   row['sale_deed_amount'], columns['carpet_area_sqft'])
+    if rows:
+        print(f"Backfilled typed columns for {len(rows)} users")
+
+def split_users_table():
+    """Move the cold columns of a Version 2 (single wide) users table into the side tables"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(users)")
+    existing_columns = [column[1] for column in cursor.fetchall()]
+    if not COLD_USER_COLUMNS & set(existing_columns):
+        conn.close()
+        return
+    
+    print("Splitting users into hot and cold tables...")
+    for table_name, columns in USER_SIDE_TABLES.items():
+        present = [column for column in columns if column in existing_columns]
+        if present:
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO {table_name} (user_id, {', '.join(present)})
+                SELECT id, {', '.join(present)} FROM users
+                WHERE {' OR '.join(f"COALESCE({column}, '') != ''" for column in present)}
+            ''')
+    conn.commit()
+    conn.close()
+    
+    # Rebuild users with the hot columns only. Maintained columns (completeness, typed
+    # copies) are re-added and recomputed by migrate_users_table / refresh_stale_completeness.
+    create_users_table('users_hot')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(users_hot)")
+    hot_columns = [column[1] for column in cursor.fetchall() if column[1] in existing_columns]
+    cursor.execute(f"INSERT INTO users_hot ({', '.join(hot_columns)}) SELECT {', '.join(hot_columns)} FROM users")
+    cursor.execute('DROP VIEW IF EXISTS users_full')
+    cursor.execute('DROP TABLE users')
+    cursor.execute('ALTER TABLE users_hot RENAME TO users')
+    conn.commit()
+    conn.close()
+    
+    # Give the dropped pages back and repack the narrower rows
+    conn = get_db_connection()
+    conn.execute('VACUUM')
+    conn.close()
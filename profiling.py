@@ -0,0 +1,122 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import time
+import uuid
+from datetime import datetime
+from flask import g, request, render_template, send_from_directory, abort
+from config import Config
+from admin_auth import ADMIN_TOKEN_HEADER, ADMIN_TOKEN_PARAM, admin_token_required, token_matches
+
+PROFILE_EXTENSION = '.prof'
+
+# Never profile the profiler's own pages, telemetry scrapes or static assets
+_EXCLUDED_ENDPOINTS = {'list_profiles', 'download_profile', 'metrics', 'static'}
+
+def _profile_requested():
+    """Whether the current request should be profiled (admin token or sampling)"""
+    if request.endpoint in _EXCLUDED_ENDPOINTS:
+        return False
+
+    if token_matches(request.headers.get(ADMIN_TOKEN_HEADER) or request.args.get(ADMIN_TOKEN_PARAM)):
+        return True
+
+    return Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE
+
+def _profile_filename(endpoint, user_id, elapsed_ms):
+    """Encode endpoint, user id and timing into the dump name"""
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return f"{timestamp}__{endpoint}__u{user_id if user_id is not None else '-'}__{elapsed_ms}ms__{uuid.uuid4().hex[:6]}{PROFILE_EXTENSION}"
+
+def _prune_profiles():
+    """Keep only the newest Config.PROFILE_MAX_FILES dumps"""
+    names = sorted(name for name in os.listdir(Config.PROFILES_FOLDER) if name.endswith(PROFILE_EXTENSION))
+    for name in names[:-Config.PROFILE_MAX_FILES]:
+        try:
+            os.remove(os.path.join(Config.PROFILES_FOLDER, name))
+        except OSError:
+            pass
+
+def list_recent_profiles(limit=50):
+    """Parse metadata for the newest profile dumps"""
+    profiles = []
+    names = sorted((name for name in os.listdir(Config.PROFILES_FOLDER) if name.endswith(PROFILE_EXTENSION)),
+                   reverse=True)
+    for name in names[:limit]:
+        parts = name[:-len(PROFILE_EXTENSION)].split('__')
+        if len(parts) != 5:
+            continue
+        timestamp, endpoint, user, elapsed, _ = parts
+        profiles.append({
+            'name': name,
+            'created_at': datetime.strptime(timestamp, '%Y%m%d-%H%M%S'),
+            'endpoint': endpoint,
+            'user_id': user[1:] if user != 'u-' else None,
+            'elapsed_ms': int(elapsed.rstrip('ms')),
+            'size_kb': round(os.path.getsize(os.path.join(Config.PROFILES_FOLDER, name)) / 1024, 1),
+        })
+    return profiles
+
+def summarize_profile(name, limit=40):
+    """Top functions of a dump by cumulative time, as text"""
+    output = io.StringIO()
+    stats = pstats.Stats(os.path.join(Config.PROFILES_FOLDER, name), stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+def init_profiling(app):
+    """Wrap selected requests in cProfile and expose the admin listing"""
+
+    @app.before_request
+    def start_profiler():
+        if not _profile_requested():
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        g.profiler = profiler
+        g.profile_start = time.perf_counter()
+
+    @app.after_request
+    def stop_profiler(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+
+        elapsed_ms = int((time.perf_counter() - g.pop('profile_start')) * 1000)
+        user_id = (request.view_args or {}).get('user_id')
+        name = _profile_filename(request.endpoint or 'unmatched', user_id, elapsed_ms)
+        try:
+            profiler.dump_stats(os.path.join(Config.PROFILES_FOLDER, name))
+            _prune_profiles()
+            response.headers['X-Profile-Id'] = name
+        except OSError as e:
+            print(f"Failed to write profile {name}: {e}")
+        return response
+
+    @app.route('/admin/profiles')
+    @admin_token_required
+    def list_profiles():
+        """List recent request profiles, optionally showing one in detail"""
+        selected = request.args.get('name')
+        summary = None
+        if selected:
+            if selected != os.path.basename(selected) or not os.path.exists(os.path.join(Config.PROFILES_FOLDER, selected)):
+                abort(404)
+            summary = summarize_profile(selected)
+        return render_template('admin_profiles.html',
+                               profiles=list_recent_profiles(),
+                               selected=selected,
+                               summary=summary)
+
+    @app.route('/admin/profiles/<name>/download')
+    @admin_token_required
+    def download_profile(name):
+        """Download a raw pstats dump (open with snakeviz, gprof2dot or flameprof)"""
+        return send_from_directory(os.path.abspath(Config.PROFILES_FOLDER), name, as_attachment=True)
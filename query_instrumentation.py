@@ -0,0 +1,178 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from flask import g, has_request_context, request, jsonify
+from config import Config
+from metrics import DB_QUERIES_TOTAL, DB_QUERY_LATENCY, DB_LOCK_ERRORS_TOTAL
+from admin_auth import admin_token_required
+
+# Per-endpoint aggregates shared by all threads: endpoint -> normalised SQL -> stats
+_query_stats = defaultdict(lambda: defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}))
+_stats_lock = threading.Lock()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_COMMENT = re.compile(r'--[^\n]*')
+_WHITESPACE = re.compile(r'\s+')
+_TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+class QueryBudgetExceeded(Exception):
+    """Raised in dev/test when a request runs more queries than its budget allows"""
+
+def normalize_sql(sql):
+    """Reduce a statement to its shape so identical queries aggregate together"""
+    sql = _COMMENT.sub(' ', sql)
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)
+
+def current_endpoint():
+    """Flask endpoint the current query belongs to, or 'background' outside a request"""
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+def _trace_statement(statement):
+    """sqlite3 trace callback: counts every statement run for the current request"""
+    if not has_request_context():
+        return
+    # Skip transaction control and statements traced from inside triggers ("-- TRIGGER ...")
+    statement = statement.lstrip().upper()
+    if statement.startswith(_TRANSACTION_STATEMENTS) or statement.startswith('--'):
+        return
+    g.query_count = g.get('query_count', 0) + 1
+
+def _record_query(sql, elapsed_ms):
+    """Attribute a timed statement to the current endpoint"""
+    endpoint = current_endpoint()
+    normalized = normalize_sql(sql)
+
+    DB_QUERIES_TOTAL.inc(endpoint)
+    DB_QUERY_LATENCY.observe(elapsed_ms / 1000, endpoint)
+
+    with _stats_lock:
+        endpoint_stats = _query_stats[endpoint]
+        # Bound memory: past the cap, new shapes fold into one bucket
+        if normalized not in endpoint_stats and len(endpoint_stats) >= Config.QUERY_STATS_MAX_SHAPES:
+            normalized = '<other>'
+        stats = endpoint_stats[normalized]
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    if elapsed_ms >= Config.SLOW_QUERY_THRESHOLD_MS:
+        print(f"Slow query ({elapsed_ms:.1f} ms) in {endpoint}: {normalized}")
+
+    if has_request_context():
+        g.query_time_ms = g.get('query_time_ms', 0.0) + elapsed_ms
+
+def _record_lock_error(error):
+    """Count SQLite lock contention against the current endpoint"""
+    if 'locked' in str(error):
+        DB_LOCK_ERRORS_TOTAL.inc(current_endpoint())
+
+def _check_query_budget(sql):
+    """Raise QueryBudgetExceeded (dev/test only) once a request runs past its budget"""
+    if not Config.QUERY_BUDGET_ENFORCED or not has_request_context():
+        return
+    endpoint = current_endpoint()
+    budget = Config.QUERY_BUDGETS.get(endpoint, Config.DEFAULT_QUERY_BUDGET)
+    query_count = g.get('query_count', 0)
+    if budget is not None and query_count > budget:
+        raise QueryBudgetExceeded(
+            f"Endpoint '{endpoint}' ran {query_count} queries (budget {budget}); last: {normalize_sql(sql)}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times every statement it executes"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            cursor = super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            _record_lock_error(e)
+            raise
+        finally:
+            _record_query(sql, (time.perf_counter() - start) * 1000)
+        _check_query_budget(sql)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            cursor = super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            _record_lock_error(e)
+            raise
+        finally:
+            _record_query(sql, (time.perf_counter() - start) * 1000)
+        _check_query_budget(sql)
+        return cursor
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose statements are counted (trace callback) and timed (cursor hooks)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_trace_statement)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute() bypasses Cursor.execute() in C, so route it explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _record_lock_error(e)
+            raise
+
+def get_query_stats():
+    """Snapshot of per-endpoint query aggregates, slowest total time first"""
+    with _stats_lock:
+        snapshot = {
+            endpoint: {sql: dict(stats) for sql, stats in queries.items()}
+            for endpoint, queries in _query_stats.items()
+        }
+    return {
+        endpoint: dict(sorted(queries.items(), key=lambda item: item[1]['total_ms'], reverse=True))
+        for endpoint, queries in snapshot.items()
+    }
+
+def reset_query_stats():
+    """Clear the aggregated query statistics"""
+    with _stats_lock:
+        _query_stats.clear()
+
+def init_query_instrumentation(app):
+    """Reset per-request counters and report them on every response"""
+
+    @app.before_request
+    def start_query_accounting():
+        g.query_count = 0
+        g.query_time_ms = 0.0
+
+    @app.after_request
+    def report_query_accounting(response):
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+        response.headers['X-Query-Time-Ms'] = f"{g.get('query_time_ms', 0.0):.1f}"
+        return response
+
+    @app.route('/admin/queries')
+    @admin_token_required
+    def query_stats():
+        """Per-endpoint SQL aggregates as JSON; ?reset=1 clears them after reading"""
+        stats = get_query_stats()
+        if request.args.get('reset') == '1':
+            reset_query_stats()
+        return jsonify(stats)
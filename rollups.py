@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+from config import Config
+from models import get_db_connection, get_read_connection
+from completeness import FUNNEL_STAGES, funnel_stages
+
+# Portfolio analytics read only pre-aggregated rows:
+#   rollup_applications    applications and loan amount per day × property type × pincode
+#   rollup_analyses        latest analysis per user, per day × eligibility status × risk level
+#   rollup_document_funnel users per document-funnel stage
+# The rows are adjusted in the same transaction as the write that changes them
+# (models.insert_user, the analysis writes, completeness._store). rebuild_rollups
+# recomputes them from the base tables at startup, which also drops emptied buckets.
+
+def rebuild_rollups():
+    """Recompute every rollup table from the base tables"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('DELETE FROM rollup_applications')
+    cursor.execute('''
+        INSERT INTO rollup_applications (day, property_type, property_pincode, applications, loan_amount)
+        SELECT COALESCE(date(created_at), ''), COALESCE(property_type, ''), COALESCE(property_pincode, ''),
+               COUNT(*), COALESCE(SUM(loan_amount), 0)
+        FROM users GROUP BY 1, 2, 3
+    ''')
+
+    cursor.execute('DELETE FROM rollup_analyses')
+    cursor.execute('''
+        INSERT INTO rollup_analyses (day, eligibility_status, risk_level, analyses)
+        SELECT COALESCE(date(analysis_date), ''), COALESCE(eligibility_status, ''), COALESCE(risk_level, ''), COUNT(*)
+        FROM user_analysis GROUP BY 1, 2, 3
+    ''')
+
+    # Few distinct mask pairs exist, so stage membership is evaluated per pair
+    funnel = {stage: 0 for stage, _ in FUNNEL_STAGES}
+    for row in cursor.execute('''
+        SELECT doc_required_mask, doc_uploaded_mask, COUNT(*) AS users FROM users
+        WHERE doc_required_mask IS NOT NULL GROUP BY doc_required_mask, doc_uploaded_mask
+    ''').fetchall():
+        for stage in funnel_stages(row['doc_required_mask'], row['doc_uploaded_mask']):
+            funnel[stage] += row['users']
+    cursor.execute('DELETE FROM rollup_document_funnel')
+    cursor.executemany('INSERT INTO rollup_document_funnel (stage, users) VALUES (?, ?)', funnel.items())
+
+    conn.commit()
+    conn.close()
+
+def _pivot(rows, column):
+    """[{day, <column>, count}] -> series names and [{'day': ..., <series>: count, ...}] in day order"""
+    by_day = {}
+    series = set()
+    for row in rows:
+        name = row[column] or 'Unspecified'
+        series.add(name)
+        by_day.setdefault(row['day'], {'day': row['day']})[name] = row['count']
+    return {'series': sorted(series), 'days': [by_day[day] for day in sorted(by_day)]}
+
+def get_portfolio_analytics(days=None):
+    """Time series and breakdowns for the analytics page, read from the rollup tables"""
+    days = min(max(days or Config.ANALYTICS_DAYS, 1), 366)
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    conn = get_read_connection()
+
+    applications_per_day = [dict(row) for row in conn.execute('''
+        SELECT day, SUM(applications) AS applications, SUM(loan_amount) AS loan_amount
+        FROM rollup_applications WHERE day >= ? GROUP BY day HAVING SUM(applications) > 0 ORDER BY day
+    ''', (since,))]
+    by_property_type = [dict(row, property_type=row['property_type'] or 'Unspecified') for row in conn.execute('''
+        SELECT property_type, SUM(applications) AS applications, SUM(loan_amount) AS loan_amount
+        FROM rollup_applications GROUP BY property_type HAVING SUM(applications) > 0 ORDER BY loan_amount DESC
+    ''')]
+    by_pincode = [dict(row, property_pincode=row['property_pincode'] or 'Unspecified') for row in conn.execute('''
+        SELECT property_pincode, SUM(applications) AS applications, SUM(loan_amount) AS loan_amount
+        FROM rollup_applications GROUP BY property_pincode HAVING SUM(applications) > 0
+        ORDER BY loan_amount DESC LIMIT ?
+    ''', (Config.ANALYTICS_TOP_PINCODES,))]
+
+    eligibility_per_day = _pivot(conn.execute('''
+        SELECT day, eligibility_status, SUM(analyses) AS count FROM rollup_analyses
+        WHERE day >= ? GROUP BY day, eligibility_status HAVING SUM(analyses) > 0
+    ''', (since,)).fetchall(), 'eligibility_status')
+    risk_per_day = _pivot(conn.execute('''
+        SELECT day, risk_level, SUM(analyses) AS count FROM rollup_analyses
+        WHERE day >= ? GROUP BY day, risk_level HAVING SUM(analyses) > 0
+    ''', (since,)).fetchall(), 'risk_level')
+
+    funnel_counts = {row['stage']: row['users'] for row in conn.execute('SELECT stage, users FROM rollup_document_funnel')}
+    conn.close()
+
+    applied = funnel_counts.get('applied') or 0
+    document_funnel = [{
+        'stage': stage,
+        'users': funnel_counts.get(stage, 0),
+        'percent': round(funnel_counts.get(stage, 0) / applied * 100, 1) if applied else 0
+    } for stage, _ in FUNNEL_STAGES]
+
+    return {
+        'days': days,
+        'since': since,
+        'applications_per_day': applications_per_day,
+        'loan_amount_by_property_type': by_property_type,
+        'loan_amount_by_pincode': by_pincode,
+        'eligibility_per_day': eligibility_per_day,
+        'risk_per_day': risk_per_day,
+        'document_funnel': document_funnel,
+    }
@@ -1,27 +1,78 @@
-from flask import render_template, request, redirect, url_for, flash, send_file
+from flask import render_template, request, redirect, url_for, flash, send_file, jsonify, Response
+import json
 import sqlite3
+import zipfile
+from itertools import groupby
 import pandas as pd
 import os
 from werkzeug.utils import secure_filename
-import uuid
 
-from models import get_db_connection, check_table_schema, get_user_analysis, get_analysis_stats, get_users_for_bulk_analysis
+from models import (
+    get_db_connection, get_read_connection, check_table_schema, get_user_analysis, get_analysis_stats,
+    get_users_for_bulk_analysis, get_filtered_users, listing_conditions, insert_user, get_probable_duplicates,
+    get_contact_cluster
+)
 from utils import (
     allowed_file, get_required_documents, get_uploaded_documents, 
     get_document_status, validate_excel_columns, map_excel_to_db,
-    analyze_user_data, get_user_completeness_score
+    analyze_user_data, get_user_completeness_score, classify_document_filename, DOCUMENT_TYPES,
+    DOCUMENT_TYPE_BITS
 )
-from ai_utils import trigger_ai_analysis, trigger_bulk_analysis, analyze_loan_eligibility
+from completeness import refresh_completeness, record_documents_added, record_document_removed
+from rollups import get_portfolio_analytics
+from field_parsing import parsed_user_columns
 from config import Config
-
-# from mock_ai_utils import trigger_ai_analysis, trigger_bulk_analysis
+from analysis_jobs import get_job, wait_for_job
+from document_extraction import queue_extractions
+from document_storage import (
+    store_upload, store_stream, add_reference, release_reference, thumbnail_path, DocumentTooLarge
+)
+from image_processing import queue_image_processing
+from zip_streaming import stream_zip, document_archive_entries
+from applicant_export import iter_applicant_rows, stream_csv, stream_xlsx
+
+if Config.USE_MOCK_AI:
+    from mock_ai_utils import trigger_ai_analysis, trigger_bulk_analysis, queue_analysis
+else:
+    from ai_utils import trigger_ai_analysis, trigger_bulk_analysis, queue_analysis
+
+def process_new_documents(user_id, documents):
+    """Background work after (file_path, content_hash, document_type) uploads are saved"""
+    def extracted():
+        # Images are re-encoded only after text extraction has read the originals
+        queue_image_processing(documents)
+        trigger_ai_analysis(user_id)
+    
+    queue_extractions(documents, on_complete=extracted)
+
+# Columns the document pages need: the required-document rules and the page header
+USER_DOCUMENT_COLUMNS_QUERY = '''
+    SELECT id, applicant_name, job_since, job_since_year, has_co_applicant, doc_required_mask, doc_uploaded_mask
+    FROM users WHERE id = ?
+'''
+
+def _float_arg(args, name):
+    try:
+        return float(args[name]) if args.get(name, '').strip() else None
+    except ValueError:
+        return None
+
+def listing_filters(args):
+    """listing_conditions keyword arguments from the listing's query string"""
+    return {
+        'missing_mask': DOCUMENT_TYPE_BITS.get(args.get('missing', ''), 0),
+        'experience_under': _float_arg(args, 'experience_under'),
+        'min_carpet_area': _float_arg(args, 'carpet_min'),
+        'max_carpet_area': _float_arg(args, 'carpet_max'),
+        'min_cluster_size': Config.CONTACT_CLUSTER_ALERT_SIZE if args.get('rings') else None,
+    }
 
 def configure_routes(app):
     
     @app.route('/')
     def dashboard():
         # Get basic stats
-        conn = get_db_connection()
+        conn = get_read_connection()
         total_users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
         total_loan_amount = conn.execute('SELECT SUM(loan_amount) FROM users').fetchone()[0]
         total_loan_amount = total_loan_amount if total_loan_amount else 0
@@ -46,6 +97,16 @@ def configure_routes(app):
                              analytics=analytics,
                              ai_stats=ai_stats)
 
+    @app.route('/analytics')
+    def analytics():
+        """Portfolio trends and breakdowns (pre-aggregated rollups only); ?days= sets the window"""
+        return render_template('analytics.html', data=get_portfolio_analytics(request.args.get('days', type=int)))
+
+    @app.route('/analytics/data')
+    def analytics_data():
+        """The analytics page data as JSON"""
+        return jsonify(get_portfolio_analytics(request.args.get('days', type=int)))
+
     @app.route('/create_user')
     def create_user():
         return render_template('create_user.html')
@@ -54,7 +115,7 @@ def configure_routes(app):
     def create_manually():
         if request.method == 'POST':
             # Initialize variables
-            new_user = None
+            new_user_id = None
             user_created = False
 
             try:
@@ -108,42 +169,37 @@ def configure_routes(app):
                 conn = get_db_connection()
 
                 try:
-                    # Insert user
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        INSERT INTO users (
-                            applicant_name, applicant_spouse_name, applicant_mother_name, current_address,
-                            mobile_no, email_id, children, qualification, office_address, office_landline,
-                            official_email_id, job_since, total_experience, department, designation,
-                            loan_amount, tenure, investment_details, property_address, property_type,
-                            property_pincode, property_carpet_area, sale_deed_amount,
-                            ref1_name, ref1_mobile, ref1_email, ref1_address,
-                            ref2_name, ref2_mobile, ref2_email, ref2_address,
-                            has_co_applicant, co_applicant_name, co_applicant_spouse_name, co_applicant_mother_name,
-                            co_applicant_mobile, co_applicant_address, co_applicant_email, co_applicant_qualification
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        applicant_name, applicant_spouse_name, applicant_mother_name, current_address,
-                        mobile_no, email_id, children, qualification, office_address, office_landline,
-                        official_email_id, job_since, total_experience, department, designation,
-                        loan_amount, tenure, investment_details, property_address, property_type,
-                        property_pincode, property_carpet_area, sale_deed_amount,
-                        ref1_name, ref1_mobile, ref1_email, ref1_address,
-                        ref2_name, ref2_mobile, ref2_email, ref2_address,
-                        has_co_applicant, co_applicant_name, co_applicant_spouse_name, co_applicant_mother_name,
-                        co_applicant_mobile, co_applicant_address, co_applicant_email, co_applicant_qualification
-                    ))
-
-                    # Get the new user ID
-                    new_user_id = cursor.lastrowid
+                    user_data = {
+                        'applicant_name': applicant_name, 'applicant_spouse_name': applicant_spouse_name,
+                        'applicant_mother_name': applicant_mother_name, 'current_address': current_address,
+                        'mobile_no': mobile_no, 'email_id': email_id, 'children': children,
+                        'qualification': qualification, 'office_address': office_address,
+                        'office_landline': office_landline, 'official_email_id': official_email_id,
+                        'job_since': job_since, 'total_experience': total_experience,
+                        'department': department, 'designation': designation,
+                        'loan_amount': loan_amount, 'tenure': tenure, 'investment_details': investment_details,
+                        'property_address': property_address, 'property_type': property_type,
+                        'property_pincode': property_pincode, 'property_carpet_area': property_carpet_area,
+                        'sale_deed_amount': sale_deed_amount,
+                        'ref1_name': ref1_name, 'ref1_mobile': ref1_mobile, 'ref1_email': ref1_email,
+                        'ref1_address': ref1_address,
+                        'ref2_name': ref2_name, 'ref2_mobile': ref2_mobile, 'ref2_email': ref2_email,
+                        'ref2_address': ref2_address,
+                        'has_co_applicant': has_co_applicant, 'co_applicant_name': co_applicant_name,
+                        'co_applicant_spouse_name': co_applicant_spouse_name,
+                        'co_applicant_mother_name': co_applicant_mother_name,
+                        'co_applicant_mobile': co_applicant_mobile, 'co_applicant_address': co_applicant_address,
+                        'co_applicant_email': co_applicant_email,
+                        'co_applicant_qualification': co_applicant_qualification
+                    }
+                    # Typed copies of the free-text fields
+                    user_data.update(parsed_user_columns(user_data))
+                    # Insert user (hot columns into users, the rest into its side tables)
+                    new_user_id = insert_user(conn, user_data)
+                    refresh_completeness(conn, [new_user_id])
                     conn.commit()
                     user_created = True
 
-                    # Get the complete user record
-                    new_user = conn.execute(
-                        'SELECT * FROM users WHERE id = ?', (new_user_id,)
-                    ).fetchone()
-
                     flash('User created successfully! AI analysis started automatically.', 'success')
 
                 except sqlite3.IntegrityError:
@@ -157,9 +213,9 @@ def configure_routes(app):
                 flash(f'Form processing error: {str(e)}', 'error')
 
             # Trigger automatic AI analysis for the new user only if creation was successful
-            if user_created and new_user:
+            if user_created and new_user_id:
                 try:
-                    trigger_ai_analysis(new_user['id'])
+                    trigger_ai_analysis(new_user_id)
                 except Exception as e:
                     flash(f'User created but AI analysis failed to start: {str(e)}', 'warning')
 
@@ -212,28 +268,10 @@ def configure_routes(app):
                             # Map Excel data to database columns
                             db_data = map_excel_to_db(row)
                             
-                            # Build dynamic SQL query based on available data
-                            columns = []
-                            placeholders = []
-                            values = []
-                            
-                            for col, value in db_data.items():
-                                columns.append(col)
-                                placeholders.append('?')
-                                values.append(value)
-                            
-                            if not columns:
+                            if not db_data:
                                 continue
-                                
-                            query = f'''
-                                INSERT INTO users ({', '.join(columns)})
-                                VALUES ({', '.join(placeholders)})
-                            '''
                             
-                            cursor = conn.cursor()
-                            cursor.execute(query, values)
-                            new_user_id = cursor.lastrowid
-                            new_user_ids.append(new_user_id)
+                            new_user_ids.append(insert_user(conn, db_data))
                             success_count += 1
                             
                         except (sqlite3.IntegrityError, ValueError, KeyError) as e:
@@ -241,6 +279,7 @@ def configure_routes(app):
                             error_details.append(f"Row {index + 2}: {str(e)}")
                             print(f"Error inserting row {index + 2}: {e}")
                     
+                    refresh_completeness(conn, new_user_ids)
                     conn.commit()
                     conn.close()
                     
@@ -273,45 +312,38 @@ def configure_routes(app):
 
     @app.route('/all_users')
     def all_users():
-        conn = get_db_connection()
-        users = conn.execute('''
-            SELECT u.*, 
-                   COUNT(d.id) as document_count
+        # Server-side filters on maintained and typed columns (indexed)
+        sort = request.args.get('sort', '')
+        conditions, params = listing_conditions('u.', **listing_filters(request.args))
+        order = 'u.completeness_score, u.id DESC' if sort == 'completeness' else 'u.id DESC'
+        
+        conn = get_read_connection()
+        # Latest analysis joined in the same statement (one query however many users)
+        users = conn.execute(f'''
+            SELECT u.id, u.applicant_name, u.designation, u.mobile_no, u.email_id, u.loan_amount, u.tenure,
+                   COALESCE(u.completeness_score, 0) AS completeness_score, c.size AS contact_cluster_size,
+                   (SELECT COUNT(*) FROM user_documents d WHERE d.user_id = u.id) as document_count,
+                   ua.id IS NOT NULL AS has_analysis,
+                   COALESCE(ua.eligibility_status, 'Pending') AS ai_status, ua.risk_level
             FROM users u 
-            LEFT JOIN user_documents d ON u.id = d.user_id 
-            GROUP BY u.id 
-            ORDER BY u.id DESC
-        ''').fetchall()
+            LEFT JOIN contact_clusters c ON c.cluster_id = u.contact_cluster_id
+            LEFT JOIN user_analysis ua ON ua.id = (
+                SELECT id FROM user_analysis WHERE user_id = u.id ORDER BY analysis_date DESC LIMIT 1
+            )
+            WHERE 1 = 1 {conditions}
+            ORDER BY {order}
+        ''', params).fetchall()
         conn.close()
-    
-        # Add completeness score and AI analysis status to each user
-        users_with_scores = []
-        for user in users:
-            # Convert sqlite3.Row to dict
-            user_dict = dict(user)
-            user_dict['completeness_score'] = get_user_completeness_score(user['id'])
-
-            # Get AI analysis status
-            user_analysis = get_user_analysis(user['id'])
-            if user_analysis:
-                # Use dictionary-style access for sqlite3.Row
-                user_dict['ai_status'] = user_analysis['eligibility_status'] if 'eligibility_status' in user_analysis.keys() else 'Pending'
-                user_dict['risk_level'] = user_analysis['risk_level'] if 'risk_level' in user_analysis.keys() else None
-                user_dict['has_analysis'] = True
-            else:
-                user_dict['ai_status'] = 'Pending'
-                user_dict['risk_level'] = None
-                user_dict['has_analysis'] = False
+        users_with_scores = [dict(user) for user in users]
 
-            users_with_scores.append(user_dict)
-
-        return render_template('all_users.html', users=users_with_scores)
+        return render_template('all_users.html', users=users_with_scores, document_types=DOCUMENT_TYPES,
+                               filters=request.args, sort=sort, cluster_alert_size=Config.CONTACT_CLUSTER_ALERT_SIZE)
 
     @app.route('/user/<int:user_id>')
     def view_user(user_id):
         """View individual user details"""
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn = get_read_connection()
+        user = conn.execute('SELECT * FROM users_full WHERE id = ?', (user_id,)).fetchone()
         conn.close()
 
         if user is None:
@@ -321,7 +353,9 @@ def configure_routes(app):
         # Get uploaded documents and document status
         uploaded_documents = get_uploaded_documents(user_id)
         document_status = get_document_status(user_id, user)
-        completeness_score = get_user_completeness_score(user_id)
+        completeness_score = user['completeness_score']
+        if completeness_score is None:
+            completeness_score = get_user_completeness_score(user_id)
 
         # Get AI analysis status
         user_analysis = get_user_analysis(user_id)
@@ -342,13 +376,16 @@ def configure_routes(app):
                              uploaded_documents=uploaded_documents,
                              document_status=document_status,
                              completeness_score=completeness_score,
-                             user_analysis=user_analysis)
+                             user_analysis=user_analysis,
+                             duplicates=get_probable_duplicates(user_id),
+                             contact_cluster=get_contact_cluster(user_id))
 
     @app.route('/user/<int:user_id>/upload_documents', methods=['GET', 'POST'])
     def upload_documents(user_id):
         """Handle document upload for a specific user"""
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn = get_read_connection()
+        # Only what the required-document rules and the page need
+        user = conn.execute(USER_DOCUMENT_COLUMNS_QUERY, (user_id,)).fetchone()
         conn.close()
         
         if user is None:
@@ -361,36 +398,30 @@ def configure_routes(app):
             
             success_count = 0
             error_count = 0
+            saved_documents = []
             
             for file, doc_type in zip(uploaded_files, document_types):
                 if file and file.filename != '' and doc_type:
                     if allowed_file(file.filename, 'document'):
-                        # Generate unique filename
                         original_filename = secure_filename(file.filename)
                         file_extension = original_filename.rsplit('.', 1)[1].lower()
-                        unique_filename = f"{user_id}_{doc_type.replace(' ', '_')}_{uuid.uuid4().hex[:8]}.{file_extension}"
-                        
-                        # Create user-specific folder
-                        user_folder = os.path.join(Config.DOCUMENT_UPLOAD_FOLDER, str(user_id))
-                        if not os.path.exists(user_folder):
-                            os.makedirs(user_folder)
-                        
-                        file_path = os.path.join(user_folder, unique_filename)
                         
                         try:
-                            # Save file
-                            file.save(file_path)
-                            file_size = os.path.getsize(file_path)
+                            # Hashed while streaming in; identical files share one stored copy
+                            content_hash, file_path, file_size, spool = store_upload(file, file_extension)
                             
                             # Save to database
                             conn = get_db_connection()
                             conn.execute('''
-                                INSERT INTO user_documents (user_id, document_type, file_name, file_path, file_size)
-                                VALUES (?, ?, ?, ?, ?)
-                            ''', (user_id, doc_type, original_filename, file_path, file_size))
+                                INSERT INTO user_documents (user_id, document_type, file_name, file_path, file_size, content_hash)
+                                VALUES (?, ?, ?, ?, ?, ?)
+                            ''', (user_id, doc_type, original_filename, file_path, file_size, content_hash))
+                            add_reference(conn, content_hash, file_path, file_size, spool)
+                            record_documents_added(conn, user_id, [doc_type])
                             conn.commit()
                             conn.close()
                             
+                            saved_documents.append((file_path, content_hash, doc_type))
                             success_count += 1
                             
                         except Exception as e:
@@ -402,8 +433,7 @@ def configure_routes(app):
             
             if success_count > 0:
                 flash(f'Successfully uploaded {success_count} document(s)!', 'success')
-                # Trigger re-analysis if documents were uploaded
-                trigger_ai_analysis(user_id)
+                process_new_documents(user_id, saved_documents)
             if error_count > 0:
                 flash(f'Failed to upload {error_count} document(s). Please check file types and try again.', 'error')
             
@@ -420,9 +450,95 @@ def configure_routes(app):
                              document_status=document_status,
                              required_documents=required_documents)
 
-    @app.route('/download_document/<int:doc_id>')
-    def download_document(doc_id):
-        """Download a specific document"""
+    @app.route('/user/<int:user_id>/upload_documents/bulk', methods=['POST'])
+    def upload_documents_bulk(user_id):
+        """Upload a ZIP or several files at once, typed by filename, saved together, analysed once"""
+        conn = get_read_connection()
+        user = conn.execute(USER_DOCUMENT_COLUMNS_QUERY, (user_id,)).fetchone()
+        conn.close()
+        
+        if user is None:
+            flash('User not found!', 'error')
+            return redirect(url_for('all_users'))
+        
+        required_docs = get_required_documents(user)
+        taken_types = {doc['document_type'] for doc in get_uploaded_documents(user_id)}
+        stored = []
+        unrecognised = []
+        
+        def store_file(filename, stream):
+            filename = secure_filename(os.path.basename(filename))
+            if not filename or not allowed_file(filename, 'document'):
+                unrecognised.append(filename or '(unnamed)')
+                return
+            doc_type = classify_document_filename(filename, required_docs, taken_types)
+            if doc_type is None:
+                unrecognised.append(filename)
+                return
+            try:
+                content_hash, file_path, file_size, spool = store_stream(stream, filename.rsplit('.', 1)[1].lower())
+            except DocumentTooLarge:
+                unrecognised.append(f"{filename} (too large)")
+                return
+            stored.append((doc_type, filename, file_path, file_size, content_hash, spool))
+        
+        for upload in request.files.getlist('bulk_files'):
+            if not upload or upload.filename == '':
+                continue
+            if upload.filename.lower().endswith('.zip'):
+                try:
+                    archive = zipfile.ZipFile(upload.stream)
+                except zipfile.BadZipFile:
+                    unrecognised.append(f"{upload.filename} (not a valid ZIP)")
+                    continue
+                with archive:
+                    members = [member for member in archive.infolist()
+                               if not member.is_dir() and not member.filename.startswith('__MACOSX/')]
+                    for member in members[:Config.BULK_UPLOAD_MAX_FILES]:
+                        # Members are decompressed chunk by chunk straight into the store
+                        with archive.open(member) as member_stream:
+                            store_file(member.filename, member_stream)
+                    unrecognised.extend(member.filename for member in members[Config.BULK_UPLOAD_MAX_FILES:])
+            else:
+                store_file(upload.filename, upload.stream)
+        
+        if stored:
+            conn = get_db_connection()
+            try:
+                # One transaction for the whole batch
+                for doc_type, filename, file_path, file_size, content_hash, spool in stored:
+                    conn.execute('''
+                        INSERT INTO user_documents (user_id, document_type, file_name, file_path, file_size, content_hash)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (user_id, doc_type, filename, file_path, file_size, content_hash))
+                    add_reference(conn, content_hash, file_path, file_size, spool)
+                record_documents_added(conn, user_id, [doc[0] for doc in stored])
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                flash(f'Error saving documents: {str(e)}', 'error')
+                return redirect(url_for('upload_documents', user_id=user_id))
+            finally:
+                conn.close()
+                # Spools not filed in the store (ZIP members are not request spools)
+                for *_, spool in stored:
+                    spool.close()
+            
+            flash(f'Uploaded {len(stored)} document(s): {", ".join(sorted(doc[0] for doc in stored))}', 'success')
+            # A single analysis for the batch
+            process_new_documents(user_id, [(file_path, content_hash, doc_type)
+                                            for doc_type, _, file_path, _, content_hash, _ in stored])
+        
+        if unrecognised:
+            flash(f'Could not match these files to a required document: {", ".join(unrecognised)}. '
+                  'Upload them individually with a document type.', 'warning')
+        elif not stored:
+            flash('No files selected.', 'warning')
+        
+        return redirect(url_for('upload_documents', user_id=user_id))
+
+    def serve_document(doc_id, as_attachment):
+        """Send a stored document with validators, Range support and the server's file wrapper"""
         conn = get_db_connection()
         document = conn.execute(
             'SELECT * FROM user_documents WHERE id = ?', (doc_id,)
@@ -434,13 +550,45 @@ def configure_routes(app):
             return redirect(url_for('all_users'))
         
         try:
-            return send_file(document['file_path'], 
-                            as_attachment=True, 
-                            download_name=document['file_name'])
+            # Content-hash ETag is strong and stable across renames; older rows fall back to mtime+size.
+            # conditional=True answers If-None-Match/If-Modified-Since with 304 and Range with 206.
+            response = send_file(document['file_path'],
+                                 as_attachment=as_attachment,
+                                 download_name=document['file_name'],
+                                 conditional=True,
+                                 etag=document['content_hash'] or True,
+                                 max_age=Config.DOCUMENT_CACHE_SECONDS)
+            # Applicant documents may sit in the browser cache, never in a shared proxy
+            response.cache_control.public = False
+            response.cache_control.private = True
+            return response
         except FileNotFoundError:
             flash('Document file not found on server!', 'error')
             return redirect(url_for('view_user', user_id=document['user_id']))
 
+    @app.route('/document/thumbnail/<content_hash>.jpg')
+    def document_thumbnail(content_hash):
+        """Thumbnail of an image document; content-addressed, so cached for a year"""
+        path = thumbnail_path(secure_filename(content_hash))
+        if not os.path.exists(path):
+            return '', 404
+        response = send_file(path, mimetype='image/jpeg', conditional=True, etag=content_hash,
+                             max_age=Config.THUMBNAIL_CACHE_SECONDS)
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
+
+    @app.route('/download_document/<int:doc_id>')
+    def download_document(doc_id):
+        """Download a specific document"""
+        return serve_document(doc_id, as_attachment=True)
+
+    @app.route('/document/<int:doc_id>/preview')
+    def preview_document(doc_id):
+        """Open a document inline in the browser's PDF/image viewer"""
+        return serve_document(doc_id, as_attachment=False)
+
     @app.route('/delete_document/<int:doc_id>')
     def delete_document(doc_id):
         """Delete a specific document"""
@@ -456,12 +604,20 @@ def configure_routes(app):
         user_id = document['user_id']
         
         try:
-            # Delete file from filesystem
-            if os.path.exists(document['file_path']):
-                os.remove(document['file_path'])
-            
             # Delete record from database
             conn.execute('DELETE FROM user_documents WHERE id = ?', (doc_id,))
+            record_document_removed(conn, user_id, document['document_type'])
+            if document['file_path'].startswith(Config.DOCUMENT_STORE_FOLDER):
+                # Shared blob: only removed when no other document references it
+                unused_paths = release_reference(conn, document['content_hash'])
+            else:
+                unused_paths = [document['file_path']]
+            
+            # Delete files while this transaction holds the write lock, so an identical
+            # upload cannot reference the blob between the commit and the removal
+            for unused_path in unused_paths:
+                if os.path.exists(unused_path):
+                    os.remove(unused_path)
             conn.commit()
             flash('Document deleted successfully!', 'success')
             
@@ -475,47 +631,139 @@ def configure_routes(app):
 
     @app.route('/user/<int:user_id>/download_all')
     def download_all_documents(user_id):
-        """Download all documents for a user as zip (placeholder)"""
-        flash('Bulk download feature coming soon!', 'info')
-        return redirect(url_for('view_user', user_id=user_id))
+        """Download all documents for a user as a ZIP streamed while it is built"""
+        conn = get_db_connection()
+        user = conn.execute('SELECT id, applicant_name FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn.close()
+        
+        if user is None:
+            flash('User not found!', 'error')
+            return redirect(url_for('all_users'))
+        
+        documents = get_uploaded_documents(user_id)
+        if not documents:
+            flash('No documents uploaded for this user.', 'info')
+            return redirect(url_for('view_user', user_id=user_id))
+        
+        filename = secure_filename(f"{user['id']}_{user['applicant_name']}_documents.zip")
+        return Response(stream_zip(document_archive_entries(documents)), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    @app.route('/download_documents')
+    def download_filtered_documents():
+        """ZIP of every document for the applicants matching the listing's ?search= and ?status= filters"""
+        users = get_filtered_users(request.args.get('search', '').strip(), request.args.get('status', ''),
+                                   limit=Config.EXPORT_MAX_APPLICANTS, **listing_filters(request.args))
+        if not users:
+            flash('No applicants match the current filters.', 'info')
+            return redirect(url_for('all_users'))
+        
+        conn = get_db_connection()
+        documents = conn.execute(f'''
+            SELECT * FROM user_documents WHERE user_id IN ({','.join('?' * len(users))})
+            ORDER BY user_id, document_type, upload_date DESC
+        ''', [user['id'] for user in users]).fetchall()
+        conn.close()
+        
+        names = {user['id']: user['applicant_name'] for user in users}
+        
+        def entries():
+            # One folder per applicant: "<id>_<name>/<document type>/<file>"
+            for user_id, user_documents in groupby(documents, key=lambda document: document['user_id']):
+                yield from document_archive_entries(user_documents, prefix=f"{user_id}_{secure_filename(names[user_id])}/")
+        
+        return Response(stream_zip(entries()), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename="applicant_documents.zip"'})
+
+    @app.route('/export_applicants.<any(csv, xlsx):file_format>')
+    def export_applicants(file_format):
+        """Every applicant matching the listing filters with their latest analysis, streamed as CSV or XLSX"""
+        rows = iter_applicant_rows(request.args.get('search', '').strip(), request.args.get('status', ''),
+                                   **listing_filters(request.args))
+        if file_format == 'csv':
+            body, mimetype = stream_csv(rows), 'text/csv'
+        else:
+            body, mimetype = stream_xlsx(rows), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return Response(body, mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="applicants.{file_format}"'})
 
     # AI Analysis Routes
     @app.route('/user/<int:user_id>/run_analysis')
     def run_analysis(user_id):
         """Run AI analysis for a user"""
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn = get_read_connection()
+        user = conn.execute('SELECT id, applicant_name FROM users WHERE id = ?', (user_id,)).fetchone()
         conn.close()
         
         if user is None:
             flash('User not found!', 'error')
             return redirect(url_for('all_users'))
         
-        return render_template('run_analysis.html', user=user)
+        # A job id means an analysis was just queued; the page follows its progress
+        job = get_job(request.args.get('job', ''))
+        if job and job['user_id'] != user_id:
+            job = None
+        
+        return render_template('run_analysis.html', user=user, job=job)
 
     @app.route('/user/<int:user_id>/analyze', methods=['POST'])
     def analyze_user(user_id):
-        """Execute AI analysis"""
+        """Queue AI analysis; progress is followed through analysis_stream/analysis_status"""
         try:
-            # Run AI analysis
-            analysis_result = analyze_loan_eligibility(user_id)
-            
-            if 'error' in analysis_result:
-                flash(f'Analysis failed: {analysis_result["error"]}', 'error')
-                return redirect(url_for('view_user', user_id=user_id))
-            
-            flash('AI analysis completed successfully!', 'success')
-            return redirect(url_for('view_loan_analysis', user_id=user_id))
-            
+            job_id = queue_analysis(user_id)
         except Exception as e:
             flash(f'Analysis error: {str(e)}', 'error')
             return redirect(url_for('view_user', user_id=user_id))
+        
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({
+                'job_id': job_id,
+                'status_url': url_for('analysis_status', user_id=user_id, job_id=job_id),
+                'stream_url': url_for('analysis_stream', user_id=user_id, job_id=job_id)
+            }), 202
+        return redirect(url_for('run_analysis', user_id=user_id, job=job_id))
+
+    @app.route('/user/<int:user_id>/analysis_status/<job_id>')
+    def analysis_status(user_id, job_id):
+        """Long-poll: wait until the job moves past ?since=<version>, then return its state"""
+        since = request.args.get('since', 0, type=int)
+        job = wait_for_job(job_id, since, Config.AI_STATUS_POLL_SECONDS)
+        if job is None or job['user_id'] != user_id:
+            return jsonify({'error': 'Unknown or expired analysis job'}), 404
+        job['redirect_url'] = url_for('view_loan_analysis', user_id=user_id)
+        return jsonify(job)
+
+    @app.route('/user/<int:user_id>/analysis_stream/<job_id>')
+    def analysis_stream(user_id, job_id):
+        """Server-sent events with each progress step of an analysis job"""
+        job = get_job(job_id)
+        if job is None or job['user_id'] != user_id:
+            return jsonify({'error': 'Unknown or expired analysis job'}), 404
+        redirect_url = url_for('view_loan_analysis', user_id=user_id)
+        
+        def events():
+            sent = 0
+            while True:
+                current = wait_for_job(job_id, sent, Config.AI_STATUS_POLL_SECONDS)
+                if current is None:
+                    return
+                for event in current['events'][sent:]:
+                    yield f"event: progress\ndata: {json.dumps(dict(event, redirect_url=redirect_url))}\n\n"
+                if current['version'] == sent:
+                    # Keep proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                sent = current['version']
+                if current['done']:
+                    return
+        
+        return Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
     @app.route('/user/<int:user_id>/analysis')
     def view_loan_analysis(user_id):
         """View AI analysis results"""
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn = get_read_connection()
+        user = conn.execute('SELECT id, applicant_name, loan_amount FROM users WHERE id = ?', (user_id,)).fetchone()
         analysis = get_user_analysis(user_id)
         conn.close()
         
@@ -550,105 +798,26 @@ def configure_routes(app):
             flash(f'Migration failed: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
-    # Excel processing helper functions
-    def validate_excel_columns(df):
-        """Validate that Excel file has required columns"""
-        required_columns = ['Applicant Name', 'Email ID', 'Loan Amount', 'Tenure']
-        missing_required = [col for col in required_columns if col not in df.columns]
-        
-        if missing_required:
-            return False, f"Missing required columns: {', '.join(missing_required)}"
-        
-        return True, ""
-
-    def map_excel_to_db(row):
-        """Map Excel column names to database column names"""
-        mapping = {
-            # Applicant Details
-            'Applicant Name': 'applicant_name',
-            'Applicant Spouse Name': 'applicant_spouse_name',
-            'Applicant Mother Name': 'applicant_mother_name',
-            'Current Address': 'current_address',
-            'Mobile No': 'mobile_no',
-            'Email ID': 'email_id',
-            'Children': 'children',
-            'Qualification': 'qualification',
-            'Office Address': 'office_address',
-            'Office Landline No': 'office_landline',
-            'Official Email ID': 'official_email_id',
-            'Job Since': 'job_since',
-            'Total Experience': 'total_experience',
-            'Department': 'department',
-            'Designation': 'designation',
-            'Loan Amount': 'loan_amount',
-            'Tenure': 'tenure',
-            'Investment Details': 'investment_details',
-            'Property Address': 'property_address',
-            'Type': 'property_type',
-            'Property Pincode': 'property_pincode',
-            'Property Carpet Area': 'property_carpet_area',
-            'Sale Deed Amount': 'sale_deed_amount',
-            # Reference 1
-            'Reference 1 Name': 'ref1_name',
-            'Reference 1 Mobile Number': 'ref1_mobile',
-            'Reference 1 Email ID': 'ref1_email',
-            'Reference 1 Address': 'ref1_address',
-            # Reference 2
-            'Reference 2 Name': 'ref2_name',
-            'Reference 2 Mobile Number': 'ref2_mobile',
-            'Reference 2 Email ID': 'ref2_email',
-            'Reference 2 Address': 'ref2_address',
-            # Co-Applicant
-            'Considering Co-Applicant Income': 'has_co_applicant',
-            'Co-Applicant Name': 'co_applicant_name',
-            'Co-Applicant Spouse Name': 'co_applicant_spouse_name',
-            'Co-Applicant Mother Name': 'co_applicant_mother_name',
-            'Co-Applicant Mobile Number': 'co_applicant_mobile',
-            'Co-Applicant Current Address': 'co_applicant_address',
-            'Co-Applicant Email ID': 'co_applicant_email',
-            'Co-Applicant Qualification': 'co_applicant_qualification'
-        }
-        
-        db_data = {}
-        for excel_col, db_col in mapping.items():
-            if excel_col in row:
-                value = row[excel_col]
-                # Handle boolean conversion for co-applicant checkbox
-                if db_col == 'has_co_applicant':
-                    value = bool(value) if pd.notna(value) else False
-                # Handle numeric conversions
-                elif db_col in ['loan_amount', 'sale_deed_amount']:
-                    value = float(value) if pd.notna(value) else 0.0
-                elif db_col == 'tenure':
-                    value = int(value) if pd.notna(value) else 0
-                # Handle text conversions
-                else:
-                    value = str(value) if pd.notna(value) else ''
-                
-                db_data[db_col] = value
-        
-        return db_data
-    
     @app.route('/analyze_all_pending')
     def analyze_all_pending():
         """Analyze all users with pending status (for admin)"""
         conn = get_db_connection()
         pending_users = conn.execute('''
-            SELECT u.* FROM users u 
+            SELECT u.id FROM users u 
             LEFT JOIN user_analysis ua ON u.id = ua.user_id 
             WHERE ua.id IS NULL OR ua.eligibility_status = 'Pending'
             LIMIT 10
         ''').fetchall()
         conn.close()
 
-        analyzed_count = 0
+        queued_count = 0
         for user in pending_users:
             try:
-                analyze_loan_eligibility(user['id'])
-                analyzed_count += 1
+                queue_analysis(user['id'])
+                queued_count += 1
             except Exception as e:
-                print(f"Failed to analyze user {user['id']}: {e}")
+                print(f"Failed to queue analysis for user {user['id']}: {e}")
 
-        flash(f'AI analysis completed for {analyzed_count} users!', 'success')
+        flash(f'AI analysis queued for {queued_count} users!', 'success')
         return redirect(url_for('dashboard'))
     
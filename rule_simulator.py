@@ -0,0 +1,173 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from flask import jsonify, request
+from config import Config
+from models import get_read_connection
+from admin_auth import admin_token_required
+from ai_utils import classify_employment_type, estimate_age_from_years
+from document_extraction import extracted_financials_by_user
+from loan_calculator import price_loans, foir_percentages
+
+# What-if evaluation of the eligibility thresholds over the whole portfolio. Per-user
+# features (employment type, estimated age, tenure, LTV, FOIR at table rates) are loaded
+# into arrays once; a grid of threshold scenarios is then evaluated by broadcasting
+# scenarios × users. A user passes a scenario when no swept rule rejects them; a rule
+# whose input is unknown (no income for FOIR, no sale deed for LTV) does not reject,
+# as in create_fallback_analysis. Results are cached per scenario until the features
+# are reloaded. Served as JSON at /admin/rule_simulator.
+
+# Swept thresholds, named after their Config attributes
+SCENARIO_FIELDS = [
+    'salaried_foir_max', 'self_employed_foir_max', 'max_age_salaried',
+    'max_age_self_employed', 'max_tenure', 'ltv_threshold'
+]
+RULES = ['foir', 'age', 'tenure', 'ltv', 'foir_plus_ltv']
+FOIR_PLUS_LTV_MAX = 140  # self-employed, fixed by policy
+
+# Bound on scenarios × users evaluated at once (booleans per rule)
+_MAX_CELLS = 4_000_000
+
+def current_scenario():
+    """The thresholds Config holds today"""
+    return tuple(float(getattr(Config, field.upper())) for field in SCENARIO_FIELDS)
+
+class RuleSimulator:
+    """Portfolio feature arrays plus a bounded per-scenario result cache"""
+
+    def __init__(self):
+        conn = get_read_connection()
+        users = conn.execute('''
+            SELECT id, designation, department, total_experience_years, loan_amount, tenure,
+                   sale_deed_amount, property_type
+            FROM users ORDER BY id
+        ''').fetchall()
+        conn.close()
+        financials = extracted_financials_by_user()
+
+        self.loaded_at = time.time()
+        self.user_ids = np.array([user['id'] for user in users], dtype=np.int64)
+        self.self_employed = np.array([classify_employment_type(dict(user)) == 'Self-Employed' for user in users], dtype=bool)
+        # Same assumptions as the analysis prompt: 22 + experience, 30 when unknown
+        self.age = np.array([estimate_age_from_years(user['total_experience_years'])
+                             if user['total_experience_years'] is not None else 30 for user in users], dtype=float)
+
+        loan_amount = np.array([user['loan_amount'] or 0 for user in users], dtype=float)
+        tenure_months = np.array([user['tenure'] or 0 for user in users], dtype=float)
+        sale_deed = np.array([user['sale_deed_amount'] or 0 for user in users], dtype=float)
+        self.tenure_years = np.where(tenure_months > 0, tenure_months / 12, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.ltv = np.where(sale_deed > 0, loan_amount / sale_deed * 100, np.nan)
+
+        summaries = [financials.get(user['id'], {}) for user in users]
+        income = np.array([summary.get('net_monthly_income') or summary.get('gross_monthly_income') or np.nan
+                           for summary in summaries], dtype=float)
+        obligations = np.array([summary.get('monthly_obligations') or 0 for summary in summaries], dtype=float)
+        emi = price_loans(loan_amount, tenure_months, [user['property_type'] for user in users])['emi']
+        self.foir = foir_percentages(emi, income, obligations)
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.baseline = self._evaluate(np.array([current_scenario()], dtype=float))['eligible'][0]
+
+    def _evaluate(self, scenarios):
+        """Eligibility and per-rule rejections for a (scenarios × fields) array"""
+        column = {field: scenarios[:, index][:, None] for index, field in enumerate(SCENARIO_FIELDS)}
+        salaried = ~self.self_employed
+        # NaN comparisons are False, so unknown inputs never reject
+        rejected = {
+            'foir': np.where(self.self_employed, self.foir > column['self_employed_foir_max'] * 100,
+                             self.foir > column['salaried_foir_max'] * 100),
+            'age': np.where(self.self_employed, self.age > column['max_age_self_employed'],
+                            self.age > column['max_age_salaried']),
+            'tenure': salaried & (self.tenure_years > column['max_tenure']),
+            'ltv': self.ltv > column['ltv_threshold'] * 100,
+            'foir_plus_ltv': np.broadcast_to(self.self_employed & (self.foir + self.ltv > FOIR_PLUS_LTV_MAX),
+                                             (len(scenarios), len(self.user_ids))),
+        }
+        eligible = ~np.logical_or.reduce([rejected[rule] for rule in RULES])
+        return {'eligible': eligible, 'rejected': {rule: rejected[rule].sum(axis=1) for rule in RULES}}
+
+    def simulate(self, scenarios):
+        """Outcome counts and affected user ids per scenario (tuples in SCENARIO_FIELDS order)"""
+        scenarios = [tuple(float(value) for value in scenario) for scenario in scenarios]
+        results = {}
+        with self._cache_lock:
+            for scenario in scenarios:
+                if scenario in self._cache:
+                    self._cache.move_to_end(scenario)
+                    results[scenario] = self._cache[scenario]
+        pending = [scenario for scenario in dict.fromkeys(scenarios) if scenario not in results]
+
+        chunk = max(1, _MAX_CELLS // max(len(self.user_ids), 1))
+        for start in range(0, len(pending), chunk):
+            batch = pending[start:start + chunk]
+            outcome = self._evaluate(np.array(batch, dtype=float))
+            for index, scenario in enumerate(batch):
+                eligible = outcome['eligible'][index]
+                results[scenario] = {
+                    'thresholds': dict(zip(SCENARIO_FIELDS, scenario)),
+                    'eligible': int(eligible.sum()),
+                    'not_eligible': int(len(eligible) - eligible.sum()),
+                    'rejected_by_rule': {rule: int(counts[index]) for rule, counts in outcome['rejected'].items()},
+                    'newly_rejected_user_ids': self.user_ids[self.baseline & ~eligible].tolist(),
+                    'newly_eligible_user_ids': self.user_ids[~self.baseline & eligible].tolist(),
+                }
+            with self._cache_lock:
+                for scenario in batch:
+                    self._cache[scenario] = results[scenario]
+                while len(self._cache) > Config.RULE_SIMULATOR_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        return [results[scenario] for scenario in scenarios]
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+def get_rule_simulator(refresh=False):
+    """The loaded simulator, reloaded on request or once its features are older than the TTL"""
+    global _simulator
+    with _simulator_lock:
+        if (refresh or _simulator is None
+                or time.time() - _simulator.loaded_at > Config.RULE_SIMULATOR_MAX_AGE_SECONDS):
+            _simulator = RuleSimulator()
+        return _simulator
+
+def scenario_grid(values_by_field):
+    """Cartesian product of per-field values; fields not given keep their Config value"""
+    base = dict(zip(SCENARIO_FIELDS, current_scenario()))
+    axes = [values_by_field.get(field) or [base[field]] for field in SCENARIO_FIELDS]
+    return list(itertools.product(*axes))
+
+def init_rule_simulator(app):
+    """Expose the simulator to credit policy as an admin JSON endpoint"""
+
+    @app.route('/admin/rule_simulator')
+    @admin_token_required
+    def rule_simulator():
+        """?ltv_threshold=0.70,0.75&max_tenure=25 sweeps those values; ?refresh=1 reloads features"""
+        try:
+            values_by_field = {
+                field: [float(value) for value in request.args[field].split(',') if value.strip()]
+                for field in SCENARIO_FIELDS if request.args.get(field)
+            }
+        except ValueError:
+            return jsonify({'error': 'Threshold values must be numbers'}), 400
+
+        scenarios = scenario_grid(values_by_field)
+        if len(scenarios) > Config.RULE_SIMULATOR_MAX_SCENARIOS:
+            return jsonify({'error': f'At most {Config.RULE_SIMULATOR_MAX_SCENARIOS} scenarios per request'}), 400
+
+        started = time.perf_counter()
+        simulator = get_rule_simulator(refresh=request.args.get('refresh') == '1')
+        results = simulator.simulate(scenarios)
+        return jsonify({
+            'users': int(len(simulator.user_ids)),
+            'baseline': dict(zip(SCENARIO_FIELDS, current_scenario())),
+            'baseline_eligible': int(simulator.baseline.sum()),
+            'features_loaded_at': simulator.loaded_at,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+            'scenarios': results,
+        })
@@ -1,7 +1,9 @@
+import re
 import pandas as pd
 from datetime import datetime
-from models import get_db_connection
+from models import get_read_connection
 from config import Config
+from field_parsing import parse_job_since_year, parsed_user_columns
 
 def allowed_file(filename, file_type='excel'):
     """Check if file extension is allowed"""
@@ -13,6 +15,48 @@ def allowed_file(filename, file_type='excel'):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+# Every type get_required_documents can ask for, in its order. A type's position is its bit
+# in the users.doc_*_mask columns, so only ever append to this list.
+DOCUMENT_TYPES = [
+    'Aadhar Card', 'PAN Card', 'Salary Slip 1', 'Salary Slip 2', 'Salary Slip 3',
+    'Form 16 Part A', 'Form 16 Part B', 'Bank Statement 1', 'Bank Statement 2', 'Bank Statement 3',
+    'Bank Statement 4', 'Bank Statement 5', 'Bank Statement 6', 'Appointment Letter', 'Resume',
+    'Co-Applicant Aadhar Card', 'Co-Applicant PAN Card'
+]
+DOCUMENT_TYPE_BITS = {doc_type: 1 << position for position, doc_type in enumerate(DOCUMENT_TYPES)}
+
+# Fields counted by the completeness score (70% weight; documents make up the other 30%)
+COMPLETENESS_FIELDS = [
+    'applicant_name', 'email_id', 'mobile_no', 'current_address',
+    'qualification', 'department', 'designation', 'loan_amount', 'tenure',
+    'property_address', 'property_type', 'office_address', 'total_experience'
+]
+
+def document_mask(document_types):
+    """Bitmask of the known types among document_types"""
+    mask = 0
+    for doc_type in document_types:
+        mask |= DOCUMENT_TYPE_BITS.get(doc_type, 0)
+    return mask
+
+def document_types_in_mask(mask):
+    """Document types whose bits are set, in get_required_documents order"""
+    return [doc_type for doc_type in DOCUMENT_TYPES if mask & DOCUMENT_TYPE_BITS[doc_type]]
+
+def completeness_score(filled_fields, required_mask, uploaded_mask):
+    """0-100 score from the filled COMPLETENESS_FIELDS count and the document masks"""
+    field_percentage = filled_fields / len(COMPLETENESS_FIELDS) * 70
+    required_count = required_mask.bit_count()
+    if required_count:
+        document_percentage = (required_mask & uploaded_mask).bit_count() / required_count * 30
+    else:
+        document_percentage = 30
+    return min(round(field_percentage + document_percentage), 100)
+
+def _stored_column(user, column):
+    """Maintained column of a users row, or None for rows/dicts that do not carry it"""
+    return user[column] if column in user.keys() else None
+
 def get_required_documents(user):
     """Get list of required documents based on user data"""
     required_docs = [
@@ -32,16 +76,14 @@ def get_required_documents(user):
     ]
     
     # Check if job tenure is less than 3 years
-    try:
-        if user['job_since']:
-            # Simple check - if job_since contains a year less than 3 years ago
-            current_year = datetime.now().year
-            job_year = int(user['job_since'].split('-')[-1]) if '-' in user['job_since'] else int(user['job_since'])
-            if current_year - job_year < 3:
-                required_docs.extend(['Appointment Letter', 'Resume'])
-    except (ValueError, TypeError):
+    if user['job_since']:
+        # Parsed once at ingest; rows/dicts without the typed column are parsed here
+        job_year = _stored_column(user, 'job_since_year')
+        if job_year is None:
+            job_year = parse_job_since_year(user['job_since'])
         # If we can't parse the date, include the extra documents to be safe
-        required_docs.extend(['Appointment Letter', 'Resume'])
+        if job_year is None or datetime.now().year - job_year < 3:
+            required_docs.extend(['Appointment Letter', 'Resume'])
     
     # Add co-applicant documents if applicable
     if user['has_co_applicant']:
@@ -54,7 +96,7 @@ def get_required_documents(user):
 
 def get_uploaded_documents(user_id):
     """Get all uploaded documents for a user"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     documents = conn.execute(
         'SELECT * FROM user_documents WHERE user_id = ? ORDER BY document_type, upload_date DESC',
         (user_id,)
@@ -64,16 +106,66 @@ def get_uploaded_documents(user_id):
 
 def get_document_status(user_id, user_data):
     """Get status of required vs uploaded documents"""
-    required = get_required_documents(user_data)
-    uploaded = get_uploaded_documents(user_id)
+    required_mask = _stored_column(user_data, 'doc_required_mask')
+    uploaded_mask = _stored_column(user_data, 'doc_uploaded_mask')
+    if required_mask is None or uploaded_mask is None:
+        # Row without the maintained masks: derive them
+        required_mask = document_mask(get_required_documents(user_data))
+        uploaded_mask = document_mask(doc['document_type'] for doc in get_uploaded_documents(user_id))
     
-    uploaded_types = [doc['document_type'] for doc in uploaded]
+    return {doc_type: bool(uploaded_mask & DOCUMENT_TYPE_BITS[doc_type])
+            for doc_type in document_types_in_mask(required_mask)}
+
+# Filename patterns for bulk uploads, checked in order against the lower-cased name with
+# separators collapsed to spaces. Numbered types take the number in the name, else the next free slot.
+DOCUMENT_FILENAME_PATTERNS = [
+    (re.compile(r'\b(?:aadh?aa?r|uid(?:ai)?)\b'), 'Aadhar Card', False),
+    (re.compile(r'\bpan\b'), 'PAN Card', False),
+    (re.compile(r'\b(?:sal(?:ary)? ?slip|pay ?slip|salary)\b'), 'Salary Slip', True),
+    (re.compile(r'\bform ?16 ?(?:part ?)?a\b'), 'Form 16 Part A', False),
+    (re.compile(r'\bform ?16 ?(?:part ?)?b\b'), 'Form 16 Part B', False),
+    (re.compile(r'\bform ?16\b'), 'Form 16 Part', False),
+    (re.compile(r'\b(?:bank ?(?:stmt|statement)|statement|stmt)\b'), 'Bank Statement', True),
+    (re.compile(r'\b(?:appointment|offer) ?letter\b'), 'Appointment Letter', False),
+    (re.compile(r'\b(?:resume|cv)\b'), 'Resume', False),
+]
+_CO_APPLICANT_PREFIX = re.compile(r'^co ?(?:app(?:licant)?)?\b ?')
+_FILENAME_NUMBER = re.compile(r'\b0*(\d{1,2})\b')
+
+def classify_document_filename(filename, required_docs, taken_types):
+    """Map an uploaded filename to one of required_docs, or None.
+
+    taken_types holds types already uploaded or assigned in this batch; it is updated.
+    """
+    name = re.sub(r'[^a-z0-9]+', ' ', filename.rsplit('.', 1)[0].lower()).strip()
+    prefix = ''
+    if _CO_APPLICANT_PREFIX.match(name):
+        prefix = 'Co-Applicant '
+        name = _CO_APPLICANT_PREFIX.sub('', name, count=1)
     
-    status = {}
-    for doc_type in required:
-        status[doc_type] = doc_type in uploaded_types
+    for pattern, base_type, numbered in DOCUMENT_FILENAME_PATTERNS:
+        if not pattern.search(name):
+            continue
+        
+        if numbered:
+            number = _FILENAME_NUMBER.search(pattern.sub(' ', name))
+            candidates = [f"{prefix}{base_type} {int(number.group(1))}"] if number else \
+                [doc for doc in required_docs if doc.startswith(f"{prefix}{base_type} ")]
+        elif base_type == 'Form 16 Part':
+            # Unlabelled Form 16: whichever part is still missing
+            candidates = [f"{prefix}Form 16 Part A", f"{prefix}Form 16 Part B"]
+        else:
+            candidates = [f"{prefix}{base_type}"]
+        
+        candidates = [doc for doc in candidates if doc in required_docs]
+        for doc_type in candidates:
+            if doc_type not in taken_types:
+                taken_types.add(doc_type)
+                return doc_type
+        # Everything it could be is already present: treat as a replacement of the first
+        return candidates[0] if candidates else None
     
-    return status
+    return None
 
 def validate_excel_columns(df):
     """Validate that Excel file has required columns"""
@@ -85,56 +177,57 @@ def validate_excel_columns(df):
     
     return True, ""
 
+# Excel import headers -> users columns (also the applicant headers of exports)
+EXCEL_COLUMN_MAP = {
+    # Applicant Details
+    'Applicant Name': 'applicant_name',
+    'Applicant Spouse Name': 'applicant_spouse_name',
+    'Applicant Mother Name': 'applicant_mother_name',
+    'Current Address': 'current_address',
+    'Mobile No': 'mobile_no',
+    'Email ID': 'email_id',
+    'Children': 'children',
+    'Qualification': 'qualification',
+    'Office Address': 'office_address',
+    'Office Landline No': 'office_landline',
+    'Official Email ID': 'official_email_id',
+    'Job Since': 'job_since',
+    'Total Experience': 'total_experience',
+    'Department': 'department',
+    'Designation': 'designation',
+    'Loan Amount': 'loan_amount',
+    'Tenure': 'tenure',
+    'Investment Details': 'investment_details',
+    'Property Address': 'property_address',
+    'Type': 'property_type',
+    'Property Pincode': 'property_pincode',
+    'Property Carpet Area': 'property_carpet_area',
+    'Sale Deed Amount': 'sale_deed_amount',
+    # Reference 1
+    'Reference 1 Name': 'ref1_name',
+    'Reference 1 Mobile Number': 'ref1_mobile',
+    'Reference 1 Email ID': 'ref1_email',
+    'Reference 1 Address': 'ref1_address',
+    # Reference 2
+    'Reference 2 Name': 'ref2_name',
+    'Reference 2 Mobile Number': 'ref2_mobile',
+    'Reference 2 Email ID': 'ref2_email',
+    'Reference 2 Address': 'ref2_address',
+    # Co-Applicant
+    'Considering Co-Applicant Income': 'has_co_applicant',
+    'Co-Applicant Name': 'co_applicant_name',
+    'Co-Applicant Spouse Name': 'co_applicant_spouse_name',
+    'Co-Applicant Mother Name': 'co_applicant_mother_name',
+    'Co-Applicant Mobile Number': 'co_applicant_mobile',
+    'Co-Applicant Current Address': 'co_applicant_address',
+    'Co-Applicant Email ID': 'co_applicant_email',
+    'Co-Applicant Qualification': 'co_applicant_qualification'
+}
+
 def map_excel_to_db(row):
     """Map Excel column names to database column names"""
-    mapping = {
-        # Applicant Details
-        'Applicant Name': 'applicant_name',
-        'Applicant Spouse Name': 'applicant_spouse_name',
-        'Applicant Mother Name': 'applicant_mother_name',
-        'Current Address': 'current_address',
-        'Mobile No': 'mobile_no',
-        'Email ID': 'email_id',
-        'Children': 'children',
-        'Qualification': 'qualification',
-        'Office Address': 'office_address',
-        'Office Landline No': 'office_landline',
-        'Official Email ID': 'official_email_id',
-        'Job Since': 'job_since',
-        'Total Experience': 'total_experience',
-        'Department': 'department',
-        'Designation': 'designation',
-        'Loan Amount': 'loan_amount',
-        'Tenure': 'tenure',
-        'Investment Details': 'investment_details',
-        'Property Address': 'property_address',
-        'Type': 'property_type',
-        'Property Pincode': 'property_pincode',
-        'Property Carpet Area': 'property_carpet_area',
-        'Sale Deed Amount': 'sale_deed_amount',
-        # Reference 1
-        'Reference 1 Name': 'ref1_name',
-        'Reference 1 Mobile Number': 'ref1_mobile',
-        'Reference 1 Email ID': 'ref1_email',
-        'Reference 1 Address': 'ref1_address',
-        # Reference 2
-        'Reference 2 Name': 'ref2_name',
-        'Reference 2 Mobile Number': 'ref2_mobile',
-        'Reference 2 Email ID': 'ref2_email',
-        'Reference 2 Address': 'ref2_address',
-        # Co-Applicant
-        'Considering Co-Applicant Income': 'has_co_applicant',
-        'Co-Applicant Name': 'co_applicant_name',
-        'Co-Applicant Spouse Name': 'co_applicant_spouse_name',
-        'Co-Applicant Mother Name': 'co_applicant_mother_name',
-        'Co-Applicant Mobile Number': 'co_applicant_mobile',
-        'Co-Applicant Current Address': 'co_applicant_address',
-        'Co-Applicant Email ID': 'co_applicant_email',
-        'Co-Applicant Qualification': 'co_applicant_qualification'
-    }
-    
     db_data = {}
-    for excel_col, db_col in mapping.items():
+    for excel_col, db_col in EXCEL_COLUMN_MAP.items():
         if excel_col in row:
             value = row[excel_col]
             # Handle boolean conversion for co-applicant checkbox
@@ -151,63 +244,44 @@ def map_excel_to_db(row):
             
             db_data[db_col] = value
     
+    # Typed copies of the free-text fields, parsed once here
+    db_data.update(parsed_user_columns(db_data))
     return db_data
 
+def _filled(field):
+    """SQL truth test matching Python truthiness of a users column ('' / 0 / NULL are empty)"""
+    return f"COALESCE({field}, '') NOT IN ('', 0)"
+
 def analyze_user_data():
     """
     Analyze all users in the database and return comprehensive analytics
     """
-    conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    
-    total_users = len(users)
-    
-    # Initialize counters
-    users_with_full_details = 0
-    users_with_pending_fields = 0
-    users_with_documents_pending = 0
-    users_with_coapplicant_pending = 0
-    
-    # Define required fields for completeness check
+    # Fields required for the "full details" count
     required_fields = [
         'applicant_name', 'email_id', 'mobile_no', 'current_address',
         'qualification', 'department', 'designation', 'loan_amount', 'tenure',
         'property_address', 'property_type'
     ]
+    co_applicant_fields = ['co_applicant_name', 'co_applicant_mobile', 'co_applicant_email', 'co_applicant_address']
     
-    for user in users:
-        # Check field completeness
-        is_complete = True
-        for field in required_fields:
-            if not user[field]:
-                is_complete = False
-                break
-        
-        if is_complete:
-            users_with_full_details += 1
-        else:
-            users_with_pending_fields += 1
-        
-        # Check document completeness
-        document_status = get_document_status(user['id'], user)
-        required_doc_count = len(document_status)
-        uploaded_doc_count = sum(1 for status in document_status.values() if status)
-        
-        if uploaded_doc_count < required_doc_count:
-            users_with_documents_pending += 1
-        
-        # Check co-applicant completeness
-        if user['has_co_applicant']:
-            co_applicant_fields = [
-                'co_applicant_name', 'co_applicant_mobile', 
-                'co_applicant_email', 'co_applicant_address'
-            ]
-            co_applicant_complete = all(user[field] for field in co_applicant_fields)
-            if not co_applicant_complete:
-                users_with_coapplicant_pending += 1
-    
+    conn = get_read_connection()
+    # One aggregate pass; document completeness comes from the maintained doc_missing_mask
+    counts = conn.execute(f'''
+        SELECT COUNT(*) AS total_users,
+               COALESCE(SUM({' AND '.join(map(_filled, required_fields))}), 0) AS users_with_full_details,
+               COALESCE(SUM(doc_missing_mask != 0), 0) AS users_with_documents_pending,
+               COALESCE(SUM({_filled('has_co_applicant')} AND NOT ({' AND '.join(map(_filled, co_applicant_fields))})), 0)
+                   AS users_with_coapplicant_pending
+        FROM users_full
+    ''').fetchone()
     conn.close()
     
+    total_users = counts['total_users']
+    users_with_full_details = counts['users_with_full_details']
+    users_with_pending_fields = total_users - users_with_full_details
+    users_with_documents_pending = counts['users_with_documents_pending']
+    users_with_coapplicant_pending = counts['users_with_coapplicant_pending']
+    
     # Calculate percentages
     analytics = {
         'total_users': total_users,
@@ -224,35 +298,18 @@ def analyze_user_data():
     return analytics
 
 def get_user_completeness_score(user_id):
-    """Calculate completeness score for a specific user (0-100)"""
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    """Completeness score for a specific user (0-100), maintained on write"""
+    conn = get_read_connection()
+    user = conn.execute('SELECT * FROM users_full WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
     
     if not user:
         return 0
+    if user['completeness_score'] is not None:
+        return user['completeness_score']
     
-    # Field completeness (70% weight)
-    required_fields = [
-        'applicant_name', 'email_id', 'mobile_no', 'current_address',
-        'qualification', 'department', 'designation', 'loan_amount', 'tenure',
-        'property_address', 'property_type', 'office_address', 'total_experience'
-    ]
-    
-    field_score = 0
-    for field in required_fields:
-        if user[field]:
-            field_score += 1
-    
-    field_percentage = (field_score / len(required_fields)) * 70
-    
-    # Document completeness (30% weight)
+    # Not scored yet (e.g. inserted behind the app's back): compute it once here
+    filled_fields = sum(1 for field in COMPLETENESS_FIELDS if user[field])
     document_status = get_document_status(user_id, user)
-    required_doc_count = len(document_status)
-    uploaded_doc_count = sum(1 for status in document_status.values() if status)
-    
-    document_percentage = (uploaded_doc_count / required_doc_count) * 30 if required_doc_count > 0 else 30
-    
-    total_score = round(field_percentage + document_percentage)
-    
-    conn.close()
-    return min(total_score, 100)
\ No newline at end of file
+    return completeness_score(filled_fields, document_mask(document_status),
+                              document_mask(doc_type for doc_type, uploaded in document_status.items() if uploaded))
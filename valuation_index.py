@@ -0,0 +1,139 @@
+from config import Config
+
+# Sale-deed sanity check: price per sq ft of carpet area, per property pincode and per
+# pincode × property type. Each bucket is one valuation_index row holding a P² (Jain &
+# Chlamtac) sketch of the median, so quartiles are updated in O(1) per application
+# without keeping the observations. The five P² markers for the median sit at the 0, 25,
+# 50, 75 and 100th percentiles, which gives min, Q1, median, Q3 and max. Rows are updated
+# in the insert transaction (models.insert_user); an application's deviation score is
+# read from its bucket with one primary-key lookup.
+
+# Marker quantiles of the P² median sketch
+_MARKER_QUANTILES = (0.0, 0.25, 0.5, 0.75, 1.0)
+HEIGHT_COLUMNS = ('price_min', 'price_q1', 'price_median', 'price_q3', 'price_max')
+POSITION_COLUMNS = ('pos_q1', 'pos_median', 'pos_q3')  # first and last marker sit at 1 and samples
+# Normal-consistent scale from the interquartile range
+_IQR_TO_SIGMA = 1.349
+
+def price_per_sqft(sale_deed_amount, carpet_area_sqft):
+    """Sale deed amount per sq ft of carpet area, or None when either is missing"""
+    if not sale_deed_amount or not carpet_area_sqft or sale_deed_amount <= 0 or carpet_area_sqft <= 0:
+        return None
+    return sale_deed_amount / carpet_area_sqft
+
+def p2_add(heights, positions, samples, value):
+    """Add one observation to a P² sketch; returns (heights, positions) for samples + 1.
+
+    Until five observations arrive the heights are just the sorted observations.
+    """
+    heights, positions = list(heights), list(positions)
+    if samples < 5:
+        heights = sorted(heights[:samples] + [value])
+        return heights, list(range(1, len(heights) + 1))
+
+    # Cell of the new observation; the extreme markers track min and max
+    if value < heights[0]:
+        heights[0] = value
+        cell = 0
+    elif value >= heights[4]:
+        heights[4] = value
+        cell = 3
+    else:
+        cell = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+    for i in range(cell + 1, 5):
+        positions[i] += 1
+
+    # Nudge the middle markers towards their desired positions
+    count = samples + 1
+    for i in (1, 2, 3):
+        offset = 1 + (count - 1) * _MARKER_QUANTILES[i] - positions[i]
+        if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (offset <= -1 and positions[i - 1] - positions[i] < -1):
+            step = 1 if offset > 0 else -1
+            parabolic = heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+                (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+                + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+            )
+            if heights[i - 1] < parabolic < heights[i + 1]:
+                heights[i] = parabolic
+            else:
+                heights[i] += step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+            positions[i] += step
+    return heights, positions
+
+def _bucket_keys(property_pincode, property_type):
+    pincode = str(property_pincode or '').strip()
+    if not pincode:
+        return []
+    # '' is the pincode-wide bucket, used while the property-type bucket is still thin
+    keys = [(pincode, '')]
+    if property_type:
+        keys.append((pincode, property_type))
+    return keys
+
+def update_valuation_index(conn, property_pincode, property_type, sale_deed_amount, carpet_area_sqft):
+    """Add an application's price per sq ft to its pincode buckets (caller commits)"""
+    price = price_per_sqft(sale_deed_amount, carpet_area_sqft)
+    if price is None:
+        return
+    for pincode, type_key in _bucket_keys(property_pincode, property_type):
+        row = conn.execute(f'''
+            SELECT samples, {', '.join(HEIGHT_COLUMNS + POSITION_COLUMNS)} FROM valuation_index
+            WHERE property_pincode = ? AND property_type = ?
+        ''', (pincode, type_key)).fetchone()
+        samples = row['samples'] if row else 0
+        heights = [row[column] for column in HEIGHT_COLUMNS] if row else []
+        positions = [1] + [row[column] for column in POSITION_COLUMNS] + [samples] if row else []
+        heights, positions = p2_add(heights, positions, samples, price)
+
+        # Fewer than five observations fill the markers left to right
+        heights += [None] * (5 - len(heights))
+        positions += [None] * (5 - len(positions))
+        conn.execute(f'''
+            INSERT OR REPLACE INTO valuation_index
+                (property_pincode, property_type, samples, {', '.join(HEIGHT_COLUMNS + POSITION_COLUMNS)})
+            VALUES (?, ?, ?, {', '.join('?' * 8)})
+        ''', [pincode, type_key, samples + 1] + heights + positions[1:4])
+
+def valuation_check(buckets, property_type, sale_deed_amount, carpet_area_sqft, loan_amount=None):
+    """Deviation of an application's price per sq ft from its bucket's median.
+
+    buckets maps property_type ('' for pincode-wide) to valuation_index rows. The
+    property-type bucket is used once it has Config.VALUATION_MIN_SAMPLES samples,
+    else the pincode-wide one. deviation_score is a robust z-score (IQR scale);
+    positive means the deed values the property above comparable ones.
+    """
+    price = price_per_sqft(sale_deed_amount, carpet_area_sqft)
+    if price is None:
+        return None
+    bucket, scope = buckets.get(property_type or ''), 'pincode_and_type'
+    if not property_type or bucket is None or bucket['samples'] < Config.VALUATION_MIN_SAMPLES:
+        bucket, scope = buckets.get(''), 'pincode'
+    if bucket is None or bucket['samples'] < Config.VALUATION_MIN_SAMPLES:
+        return None
+
+    median = bucket['price_median']
+    scale = max((bucket['price_q3'] - bucket['price_q1']) / _IQR_TO_SIGMA, median * Config.VALUATION_MIN_SPREAD)
+    deviation = (price - median) / scale
+    return {
+        'scope': scope,
+        'comparables': bucket['samples'],
+        'price_per_sqft': round(price),
+        'median_price_per_sqft': round(median),
+        'q1_price_per_sqft': round(bucket['price_q1']),
+        'q3_price_per_sqft': round(bucket['price_q3']),
+        'deviation_score': round(deviation, 2),
+        'outlier': abs(deviation) >= Config.VALUATION_OUTLIER_SCORE,
+        # LTV if the property were worth the local median price
+        'ltv_at_local_median': round(loan_amount / (median * carpet_area_sqft) * 100, 1) if loan_amount else None,
+    }
+
+def backfill_valuation_index(conn):
+    """Add every existing application in id order (caller commits)"""
+    users = conn.execute('''
+        SELECT property_pincode, property_type, sale_deed_amount, carpet_area_sqft FROM users
+        WHERE sale_deed_amount > 0 AND carpet_area_sqft > 0 ORDER BY id
+    ''').fetchall()
+    for user in users:
+        update_valuation_index(conn, user['property_pincode'], user['property_type'],
+                               user['sale_deed_amount'], user['carpet_area_sqft'])
+    print(f"Indexed {len(users)} property valuations")
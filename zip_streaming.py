@@ -0,0 +1,72 @@
+import os
+import time
+import zipfile
+from config import Config
+
+# ZIP archives written straight into the HTTP response. zipfile supports unseekable
+# output by emitting data descriptors, so nothing is buffered beyond one chunk.
+
+# Already-compressed formats gain nothing from deflate; store them as-is
+STORED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'zip', 'xlsx'}
+
+class _ChunkSink:
+    """Unseekable write target that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _zip_info(arcname, file_path):
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(file_path))[:6])
+    extension = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+    info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return info
+
+def stream_zip(entries):
+    """Yield a ZIP archive of (arcname, file_path) entries chunk by chunk; missing files are skipped"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w') as archive:
+        for arcname, file_path in entries:
+            try:
+                source = open(file_path, 'rb')
+            except OSError as e:
+                print(f"Skipping {file_path} in archive: {e}")
+                continue
+            with source, archive.open(_zip_info(arcname, file_path), mode='w', force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(Config.DOWNLOAD_CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+def _safe_part(value):
+    return ''.join(c if c.isalnum() or c in ' ._-' else '_' for c in str(value)).strip() or 'unnamed'
+
+def document_archive_entries(documents, prefix=''):
+    """Archive names "<prefix><document type>/<file name>" for user_documents rows, kept unique"""
+    seen = set()
+    for document in documents:
+        base = f"{prefix}{_safe_part(document['document_type'])}/{_safe_part(document['file_name'])}"
+        arcname = base
+        counter = 1
+        while arcname in seen:
+            stem, dot, extension = base.rpartition('.')
+            arcname = f"{stem} ({counter}).{extension}" if dot else f"{base} ({counter})"
+            counter += 1
+        seen.add(arcname)
+        yield arcname, document['file_path']